@@ -1,74 +1,10 @@
 import argparse
-
-
-def symbol(instruction):
-    instruct_type = instruction_type(instruction)
-    if instruct_type == "A_INSTRUCTION":
-        return instruction.split("@")[-1]
-    elif instruct_type == "L_INSTRUCTION":
-        return instruction.split("(")[-1].split(")")[0]
-    else:
-        print("symbol called for C_INSTRUCTION")
-        exit(1)
-
-
-def dest(instruction):
-    if instruction_type(instruction) != "C_INSTRUCTION":
-        print("dest called for instruction that is not a C instruction")
-        exit(1)
-    if "=" in instruction:
-        proposed_dest = instruction.split("=")[0]
-        if proposed_dest in list(d_bits_from_dest_dict.keys()):
-            return proposed_dest
-        else:
-            print(
-                f"dest called for instruction {instruction} with unkknown destination {proposed_dest}"
-            )
-            exit(1)
-    return "null"
-
-
-def jump(instruction):
-    if instruction_type(instruction) != "C_INSTRUCTION":
-        print("jump called for instruction that is not a C instruction")
-        exit(1)
-    if ";" in instruction:
-        proposed_jump = instruction.split(";")[1]
-        if proposed_jump in list(j_bits_from_jump_dict.keys()):
-            return proposed_jump
-        else:
-            print(f"unknown jump {proposed_jump}")
-            exit(1)
-    return "null"
-
-
-def comp(instruction):
-    if instruction_type(instruction) != "C_INSTRUCTION":
-        print("comp called for instruction that is not a C instruction")
-        exit(1)
-    if "=" in instruction:
-        instruction = instruction.split("=")[1]
-    if ";" in instruction:
-        if "M" in instruction.split(";")[0]:
-            print("jumps not permitted when instruction contains M")
-            exit(1)
-        instruction = instruction.split(";")[0]
-    if instruction in list(c_bits_from_comp_dict.keys()):
-        return instruction
-    else:
-        print(f"unknown computation {instruction}")
-        exit(1)
-
-
-def decimal_to_binary_string(decimal_string):
-    # Max number allowed: 2^15-1 = 32767
-    if int(decimal_string) > 32767:
-        print(f"address or literal {decimal_string} larger than 32767")
-        exit(1)
-    # First digit always 0; pad to 15 digits
-    # bin() converts integer to binary string beginning with '0b'
-    # [2:] skips the '0b' prefix. zfill pads to 15 digits
-    return "0" + bin(int(decimal_string))[2:].zfill(15)
+from array import array
+from dataclasses import dataclass, field
+from functools import lru_cache
+import json
+from pathlib import Path
+import sys
 
 
 c_bits_from_comp_dict = {
@@ -133,68 +69,90 @@ j_bits_from_jump_dict = {
 }
 
 
-def compute_instruction_to_binary_string(instruction):
-    if instruction_type(instruction) != "C_INSTRUCTION":
-        print(
-            "comput_instruction_to_binary_string received an instruction that is not a compute instruction"
-        )
+# The same tables as integers, for encoding instructions as 16-bit words
+c_code_from_comp_dict = {
+    key: int(bits, 2) for key, bits in c_bits_from_comp_dict.items()
+}
+d_code_from_dest_dict = {
+    key: int(bits, 2) for key, bits in d_bits_from_dest_dict.items()
+}
+j_code_from_jump_dict = {
+    key: int(bits, 2) for key, bits in j_bits_from_jump_dict.items()
+}
+
+# Maximum number of distinct C instructions whose encodings are remembered.
+# Translated vm code repeats a few dozen distinct C instructions thousands
+# of times, so this comfortably holds all of them.
+C_INSTRUCTION_CACHE_SIZE = 4096
+
+
+# Encode a C instruction (dest=comp;jump) as a 16-bit word. The instruction
+# is split into its fields once, and the encoding of each distinct
+# instruction is cached.
+@lru_cache(maxsize=C_INSTRUCTION_CACHE_SIZE)
+def encode_compute_instruction(instruction):
+    if "=" in instruction:
+        dest_text, comp_and_jump_text = instruction.split("=", 1)
+        if dest_text not in d_code_from_dest_dict:
+            print(f"unknown destination {dest_text} in instruction {instruction}")
+            exit(1)
+    else:
+        dest_text, comp_and_jump_text = "null", instruction
+    if ";" in comp_and_jump_text:
+        comp_text, jump_text = comp_and_jump_text.split(";", 1)
+        if "M" in comp_text:
+            print("jumps not permitted when instruction contains M")
+            exit(1)
+        if jump_text not in j_code_from_jump_dict:
+            print(f"unknown jump {jump_text}")
+            exit(1)
+    else:
+        comp_text, jump_text = comp_and_jump_text, "null"
+    if comp_text not in c_code_from_comp_dict:
+        print(f"unknown computation {comp_text}")
         exit(1)
-    comp_text = comp(instruction)
-    dest_text = dest(instruction)
-    jump_text = jump(instruction)
-    instruction = instruction.split("=")[-1]
-    instruction = instruction.split(";")[0]
-    a_bit = "1" if "M" in instruction else "0"
+    a_bit = 1 if "M" in comp_text else 0
     return (
-        "111"
-        + a_bit
-        + c_bits_from_comp_dict[comp_text]
-        + d_bits_from_dest_dict[dest_text]
-        + j_bits_from_jump_dict[jump_text]
+        (0b111 << 13)
+        | (a_bit << 12)
+        | (c_code_from_comp_dict[comp_text] << 6)
+        | (d_code_from_dest_dict[dest_text] << 3)
+        | j_code_from_jump_dict[jump_text]
     )
 
 
-def instruction_to_binary_string(instruction):
-    if instruction_type(instruction) == "A_INSTRUCTION":
-        # No symbol support just yet... it's just a number
-        return decimal_to_binary_string(symbol(instruction))
-    elif instruction_type(instruction) == "L_INSTRUCTION":
-        return
-
+# Encode an address or literal as the 16-bit word of an A instruction
+def encode_address(decimal_address):
+    # Max number allowed: 2^15-1 = 32767
+    if int(decimal_address) > 32767:
+        print(f"address or literal {decimal_address} larger than 32767")
+        exit(1)
+    return int(decimal_address)
 
-def instruction_type(instruction):
-    if instruction.startswith("@"):
-        return "A_INSTRUCTION"
-    elif instruction.startswith("(") and instruction.endswith(")"):
-        return "L_INSTRUCTION"
-    else:
-        return "C_INSTRUCTION"
 
+# Remove comments and whitespace from a line of hack assembly. Returns an
+# empty string for lines with nothing to assemble.
+def clean_assembly_line(line):
+    # ignore commented lines and empty lines, but keep other lines for parsing
+    line = line.split("//", 1)[0].strip()
+    # remove all spaces and tabs and newlines
+    return line.replace(" ", "").replace("\t", "").replace("\n", "")
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "input_file", type=str, help="Input file containing hack assembly code"
-    )
-    args = parser.parse_args()
 
-    # First, open the file
-    # list of assembly commands
+# Read a file of hack assembly, returning the list of lines to assemble
+# with comments and whitespace removed
+def read_assembly_lines(input_file_path):
     lines_to_parse = []
-    with open(args.input_file, "r") as input_file:
+    with open(input_file_path, "r") as input_file:
         for line in input_file:
-            # remove leading and trailing whitespace
-            line = line.strip()
-            # ignore commented lines and empty lines, but add other lines for parsing
-            line = line.split("//", 1)[0].strip()
-            if not line:
-                continue
-            # remove all spaces and tabs and newlines
-            lines_to_parse.append(
-                line.replace(" ", "").replace("\t", "").replace("\n", "")
-            )
+            line = clean_assembly_line(line)
+            if line:
+                lines_to_parse.append(line)
+    return lines_to_parse
 
-    symbol_table = {
+
+def predefined_symbol_table():
+    return {
         "R0": 0,
         "R1": 1,
         "R2": 2,
@@ -224,51 +182,259 @@ def main():
         "THAT": 4,
         "TEMP": 5,
     }
-    address_of_next_free_ram_for_variable = 16
-    object_code = ""
-    line_number_of_latest_a_or_c = -1
-    # First pass: find symbols and store them in the symbol table
-    for line in lines_to_parse:
-        instruct_type = instruction_type(line)
-        if instruct_type == "A_INSTRUCTION" or instruct_type == "C_INSTRUCTION":
-            line_number_of_latest_a_or_c += 1
-        if instruct_type == "L_INSTRUCTION":
-            symbol_table[symbol(line)] = line_number_of_latest_a_or_c + 1
-    # Second pass: return machine code
-    for line in lines_to_parse:
-        instruct_type = instruction_type(line)
-        decimal_address = None
-        if instruct_type == "A_INSTRUCTION":
-            symbol_text = symbol(line)
-            # if symbol_text is alrady in the symbol table, just
-            # replace it with its value
-            if symbol_text in symbol_table:
-                decimal_address = symbol_table[symbol_text]
-            # if symbol_text is a number, it is a decimal address already;
-            # just use it
+
+
+# Version of the object module format written by Assembler.assemble_object.
+# Bump this whenever the format or the encoding of instructions changes, so
+# cached object modules are not reused.
+OBJECT_FORMAT_VERSION = 1
+
+
+# Relocatable object code for one module (e.g. one translated vm file).
+# A instructions that name a label or a variable cannot be encoded until
+# the modules are laid out in ROM and variables are given RAM addresses by
+# the linker, so their words hold 0 and are listed in relocations.
+@dataclass
+class ObjectModule:
+    name: str
+    # one 16-bit word per instruction
+    code: list[int] = field(default_factory=list)
+    # labels defined in this module -> address relative to the module start
+    labels: dict[str, int] = field(default_factory=dict)
+    # (address relative to the module start, symbol) for each A instruction
+    # naming a label or variable
+    relocations: list[tuple[int, str]] = field(default_factory=list)
+
+    def to_json(self):
+        return json.dumps(
+            {
+                "format_version": OBJECT_FORMAT_VERSION,
+                "name": self.name,
+                "code": self.code,
+                "labels": self.labels,
+                "relocations": self.relocations,
+            }
+        )
+
+    @staticmethod
+    def from_json(json_text):
+        fields = json.loads(json_text)
+        if fields.get("format_version") != OBJECT_FORMAT_VERSION:
+            raise ValueError(
+                f"Object module {fields.get('name')} has format version "
+                f"{fields.get('format_version')}, not {OBJECT_FORMAT_VERSION}"
+            )
+        return ObjectModule(
+            name=fields["name"],
+            code=fields["code"],
+            labels=fields["labels"],
+            relocations=[(offset, symbol) for offset, symbol in fields["relocations"]],
+        )
+
+
+# Assembler: turns lines of hack assembly into 16-bit words.
+# Lines may come straight from a file or from another stage of the
+# compile pipeline (comments and whitespace are removed here), so the
+# assembler can run in-process on a list of lines. After assemble(),
+# symbol_table holds the labels and variables of the program.
+class Assembler:
+    symbol_table: dict[str, int]
+    address_of_next_free_ram_for_variable: int
+
+    def __init__(self):
+        self.symbol_table = predefined_symbol_table()
+        self.address_of_next_free_ram_for_variable = 16
+
+    # First pass: find labels and store them in the symbol table. Returns
+    # the A and C instructions, cleaned up, in program order.
+    def find_labels(self, lines):
+        instructions = []
+        for line in lines:
+            line = clean_assembly_line(line)
+            if not line:
+                continue
+            if line.startswith("(") and line.endswith(")"):
+                self.symbol_table[line[1:-1]] = len(instructions)
+            else:
+                instructions.append(line)
+        return instructions
+
+    # Encode the A instruction @symbol_text as a 16-bit word
+    def encode_address_instruction(self, symbol_text):
+        # if symbol_text is alrady in the symbol table, just
+        # replace it with its value
+        if symbol_text in self.symbol_table:
+            return encode_address(self.symbol_table[symbol_text])
+        # if symbol_text is a number, it is a decimal address already;
+        # just use it
+        if symbol_text.isdigit():
+            return encode_address(symbol_text)
+        # if symbol_text is not a number yet not in the symbol table,
+        # it is a new variable. Add it to the symbol table and
+        # assign it the next available RAM address
+        decimal_address = self.address_of_next_free_ram_for_variable
+        self.address_of_next_free_ram_for_variable += 1
+        self.symbol_table[symbol_text] = decimal_address
+        return encode_address(decimal_address)
+
+    # Assemble lines of hack assembly into object code, one 16-bit word
+    # per instruction
+    def assemble(self, lines):
+        self.symbol_table = predefined_symbol_table()
+        self.address_of_next_free_ram_for_variable = 16
+        instructions = self.find_labels(lines)
+        # Second pass: return machine code
+        object_code = array("H")
+        append_word = object_code.append
+        for instruction in instructions:
+            if instruction.startswith("@"):
+                append_word(self.encode_address_instruction(instruction[1:]))
+            else:
+                append_word(encode_compute_instruction(instruction))
+        return object_code
+
+    # Assemble lines of hack assembly into a relocatable object module.
+    # Predefined symbols and numbers are encoded now; labels and variables
+    # are left for the linker.
+    def assemble_object(self, lines, name):
+        self.symbol_table = predefined_symbol_table()
+        instructions = self.find_labels(lines)
+        predefined_symbols = predefined_symbol_table()
+        object_module = ObjectModule(
+            name=name,
+            labels={
+                symbol: address
+                for symbol, address in self.symbol_table.items()
+                if symbol not in predefined_symbols
+            },
+        )
+        code = object_module.code
+        for instruction in instructions:
+            if not instruction.startswith("@"):
+                code.append(encode_compute_instruction(instruction))
+                continue
+            symbol_text = instruction[1:]
+            if symbol_text in predefined_symbols:
+                code.append(encode_address(predefined_symbols[symbol_text]))
             elif symbol_text.isdigit():
-                decimal_address = symbol_text
-            # if symbol_text is not a number yet not in the symbol table,
-            # it is a new variable. Add it to the symbol table and
-            # assign it the next available RAM address
+                code.append(encode_address(symbol_text))
             else:
-                decimal_address = address_of_next_free_ram_for_variable
-                address_of_next_free_ram_for_variable += 1
-                symbol_table[symbol_text] = decimal_address
-            object_code += decimal_to_binary_string(decimal_address) + "\n"
-        elif instruct_type == "C_INSTRUCTION":
-            object_code += compute_instruction_to_binary_string(line) + "\n"
-        elif instruct_type == "L_INSTRUCTION":
-            pass
-        else:
-            print(f"unknown instruction type {instruct_type}")
-            exit(1)
+                object_module.relocations.append((len(code), symbol_text))
+                code.append(0)
+        return object_module
+
+
+# Assemble a list of lines of hack assembly into object code
+def assemble_lines(lines_to_parse):
+    return Assembler().assemble(lines_to_parse)
+
+
+# Object code as ascii binary numbers, 16 bits per line (the .hack format)
+def object_code_to_ascii(object_code):
+    return "".join(f"{word:016b}\n" for word in object_code)
+
+
+# Object code as hexadecimal numbers, 4 digits per line, for $readmemh
+def object_code_to_memh(object_code):
+    return "".join(f"{word:04x}\n" for word in object_code)
+
 
-    print(object_code)
+# Object code as big endian bytes, the format loaded from flash at boot
+def object_code_to_big_endian_bytes(object_code):
+    big_endian_object_code = array("H", object_code)
+    if sys.byteorder == "little":
+        big_endian_object_code.byteswap()
+    return big_endian_object_code.tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "input_file", type=str, help="Input file containing hack assembly code"
+    )
+    parser.add_argument(
+        "--output_bin",
+        type=str,
+        help="Write object code as big endian bytes to this file",
+    )
+    parser.add_argument(
+        "--output_hack",
+        type=str,
+        help="Write object code as ascii binary numbers, 16 bits per line, to this file",
+    )
+    parser.add_argument(
+        "--output_memh",
+        type=str,
+        help="Write object code as hexadecimal numbers, 4 digits per line, to this file",
+    )
+    parser.add_argument(
+        "--output_object",
+        type=str,
+        help="Write a relocatable object module (json) to this file, for assembler/linker.py",
+    )
+    parser.add_argument(
+        "--output_map",
+        type=str,
+        help="Write a map (json) of each ROM address to its assembly line, label, function, vm command and jack line to this file",
+    )
+    parser.add_argument(
+        "--output_listing",
+        type=str,
+        help="Write a listing of addresses, object code and source locations to this file",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Run the peephole optimizer before assembling (report on stderr)",
+    )
+    args = parser.parse_args()
+
+    lines_to_parse = read_assembly_lines(args.input_file)
+    if args.optimize:
+        from peephole import optimize
+
+        lines_to_parse, report = optimize(lines_to_parse)
+        print(report.summary(), file=sys.stderr)
+    if args.output_object:
+        object_module = Assembler().assemble_object(
+            lines_to_parse, Path(args.input_file).stem
+        )
+        with open(args.output_object, "w") as output_file:
+            output_file.write(object_module.to_json())
+        if not (args.output_bin or args.output_hack or args.output_memh):
+            return
+    object_code = assemble_lines(lines_to_parse)
+
+    if args.output_bin:
+        with open(args.output_bin, "wb") as output_file:
+            output_file.write(object_code_to_big_endian_bytes(object_code))
+    if args.output_hack:
+        with open(args.output_hack, "w") as output_file:
+            output_file.write(object_code_to_ascii(object_code))
+    if args.output_memh:
+        with open(args.output_memh, "w") as output_file:
+            output_file.write(object_code_to_memh(object_code))
+    if args.output_map or args.output_listing:
+        from source_map import source_map, source_map_to_json, source_map_to_listing
+
+        # Unless optimized, map the lines as written, with the comments
+        # that carry vm and jack locations
+        map_lines = (
+            lines_to_parse
+            if args.optimize
+            else Path(args.input_file).read_text().splitlines()
+        )
+        entries = source_map(map_lines, object_code, Path(args.input_file).name)
+        if args.output_map:
+            with open(args.output_map, "w") as output_file:
+                output_file.write(source_map_to_json(entries))
+        if args.output_listing:
+            with open(args.output_listing, "w") as output_file:
+                output_file.write(source_map_to_listing(entries))
 
-    # print("\n\n\n\n")
-    # for key in symbol_table:
-    #   print(f"{key} -> {symbol_table[key]}")
+    # With no output files requested, print the ascii object code
+    if not (args.output_bin or args.output_hack or args.output_memh):
+        print(object_code_to_ascii(object_code))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,338 @@
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from assembler import (
+    Assembler,
+    c_bits_from_comp_dict,
+    d_bits_from_dest_dict,
+    j_bits_from_jump_dict,
+    object_code_to_ascii,
+    predefined_symbol_table,
+    read_assembly_lines,
+)
+
+ASSEMBLER_DIRECTORY = Path(__file__).resolve().parent
+
+# Hack ROM holds at most 32768 16-bit words
+MAX_ROM_WORDS = 32768
+
+
+# The assembler as it was before it encoded instructions as 16-bit words:
+# each instruction is turned into a string of bits, appended to the
+# object code with +=, to time the original pipeline against and to check
+# that the object code is the same
+
+
+def symbol(instruction):
+    instruct_type = instruction_type(instruction)
+    if instruct_type == "A_INSTRUCTION":
+        return instruction.split("@")[-1]
+    elif instruct_type == "L_INSTRUCTION":
+        return instruction.split("(")[-1].split(")")[0]
+    else:
+        print("symbol called for C_INSTRUCTION")
+        exit(1)
+
+
+def dest(instruction):
+    if instruction_type(instruction) != "C_INSTRUCTION":
+        print("dest called for instruction that is not a C instruction")
+        exit(1)
+    if "=" in instruction:
+        proposed_dest = instruction.split("=")[0]
+        if proposed_dest in list(d_bits_from_dest_dict.keys()):
+            return proposed_dest
+        else:
+            print(f"unknown destination {proposed_dest}")
+            exit(1)
+    return "null"
+
+
+def jump(instruction):
+    if instruction_type(instruction) != "C_INSTRUCTION":
+        print("jump called for instruction that is not a C instruction")
+        exit(1)
+    if ";" in instruction:
+        proposed_jump = instruction.split(";")[1]
+        if proposed_jump in list(j_bits_from_jump_dict.keys()):
+            return proposed_jump
+        else:
+            print(f"unknown jump {proposed_jump}")
+            exit(1)
+    return "null"
+
+
+def comp(instruction):
+    if instruction_type(instruction) != "C_INSTRUCTION":
+        print("comp called for instruction that is not a C instruction")
+        exit(1)
+    if "=" in instruction:
+        instruction = instruction.split("=")[1]
+    if ";" in instruction:
+        if "M" in instruction.split(";")[0]:
+            print("jumps not permitted when instruction contains M")
+            exit(1)
+        instruction = instruction.split(";")[0]
+    if instruction in list(c_bits_from_comp_dict.keys()):
+        return instruction
+    else:
+        print(f"unknown computation {instruction}")
+        exit(1)
+
+
+def decimal_to_binary_string(decimal_string):
+    # Max number allowed: 2^15-1 = 32767
+    if int(decimal_string) > 32767:
+        print(f"address or literal {decimal_string} larger than 32767")
+        exit(1)
+    # First digit always 0; pad to 15 digits
+    return "0" + bin(int(decimal_string))[2:].zfill(15)
+
+
+def compute_instruction_to_binary_string(instruction):
+    comp_text = comp(instruction)
+    dest_text = dest(instruction)
+    jump_text = jump(instruction)
+    instruction = instruction.split("=")[-1]
+    instruction = instruction.split(";")[0]
+    a_bit = "1" if "M" in instruction else "0"
+    return (
+        "111"
+        + a_bit
+        + c_bits_from_comp_dict[comp_text]
+        + d_bits_from_dest_dict[dest_text]
+        + j_bits_from_jump_dict[jump_text]
+    )
+
+
+def instruction_type(instruction):
+    if instruction.startswith("@"):
+        return "A_INSTRUCTION"
+    elif instruction.startswith("(") and instruction.endswith(")"):
+        return "L_INSTRUCTION"
+    else:
+        return "C_INSTRUCTION"
+
+
+# Ascii object code of lines of hack assembly (comments and whitespace
+# removed), built by appending each instruction's bits to a string
+def assemble_by_appending_strings(lines_to_parse):
+    symbol_table = predefined_symbol_table()
+    address_of_next_free_ram_for_variable = 16
+    object_code = ""
+    line_number_of_latest_a_or_c = -1
+    # First pass: find symbols and store them in the symbol table
+    for line in lines_to_parse:
+        instruct_type = instruction_type(line)
+        if instruct_type == "A_INSTRUCTION" or instruct_type == "C_INSTRUCTION":
+            line_number_of_latest_a_or_c += 1
+        if instruct_type == "L_INSTRUCTION":
+            symbol_table[symbol(line)] = line_number_of_latest_a_or_c + 1
+    # Second pass: return machine code
+    for line in lines_to_parse:
+        instruct_type = instruction_type(line)
+        if instruct_type == "A_INSTRUCTION":
+            symbol_text = symbol(line)
+            if symbol_text in symbol_table:
+                decimal_address = symbol_table[symbol_text]
+            elif symbol_text.isdigit():
+                decimal_address = symbol_text
+            else:
+                decimal_address = address_of_next_free_ram_for_variable
+                address_of_next_free_ram_for_variable += 1
+                symbol_table[symbol_text] = decimal_address
+            object_code += decimal_to_binary_string(decimal_address) + "\n"
+        elif instruct_type == "C_INSTRUCTION":
+            object_code += compute_instruction_to_binary_string(line) + "\n"
+    return object_code
+
+
+# Write a synthetic program of number_of_instructions A and C instructions.
+# The program is made of small "functions" that look like translated vm code:
+# labels, stack pushes and pops, static variables and jumps, so all of the
+# assembler's code paths (symbols, variables, C instruction encoding) are used.
+def synthetic_program(number_of_instructions):
+    lines = ["(VM_RETURN)"]
+    instruction_count = 0
+    function_counter = 0
+    while instruction_count < number_of_instructions:
+        function_name = f"Bench.f{function_counter}"
+        body = [
+            f"({function_name})",
+            "// push constant",
+            f"@{function_counter % 32768}",
+            "D=A",
+            "@SP",
+            "A=M",
+            "M=D",
+            "@SP",
+            "M=M+1",
+            "// pop static",
+            "@SP",
+            "AM=M-1",
+            "D=M",
+            f"@Bench.{function_counter % 200}",
+            "M=D",
+            "// add",
+            "@SP",
+            "AM=M-1",
+            "D=M",
+            "@SP",
+            "AM=M-1",
+            "M=D+M",
+            "@SP",
+            "M=M+1",
+            f"@{function_name}",
+            "D;JNE",
+            "@VM_RETURN",
+            "0;JMP",
+        ]
+        for line in body:
+            if instruction_count == number_of_instructions:
+                break
+            lines.append(line)
+            if not (line.startswith("(") or line.startswith("//")):
+                instruction_count += 1
+        function_counter += 1
+    return "\n".join(lines) + "\n"
+
+
+def time_command(command, stdout=None):
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=stdout)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--instructions",
+        type=int,
+        default=MAX_ROM_WORDS,
+        help="Number of instructions in the synthetic program",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of times to time each pipeline"
+    )
+    parser.add_argument(
+        "--baseline_assembler",
+        type=str,
+        help="Only print the ascii object code of this hack assembly file, "
+        "assembled by the baseline assembler (run by the benchmark to time it)",
+    )
+    args = parser.parse_args()
+
+    if args.baseline_assembler:
+        print(
+            assemble_by_appending_strings(read_assembly_lines(args.baseline_assembler))
+        )
+        return
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        temp_path = Path(temp_directory)
+        asm_path = temp_path / "Bench.asm"
+        baseline_hack_path = temp_path / "BenchBaseline.hack"
+        hack_path = temp_path / "Bench.hack"
+        baseline_bin_path = temp_path / "BenchBaseline.bin"
+        ascii_bin_path = temp_path / "BenchFromAscii.bin"
+        streamed_bin_path = temp_path / "BenchStreamed.bin"
+        asm_path.write_text(synthetic_program(args.instructions))
+
+        baseline_assembler = [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "--baseline_assembler",
+        ]
+        assembler = [sys.executable, str(ASSEMBLER_DIRECTORY / "assembler.py")]
+        packer = [
+            sys.executable,
+            str(ASSEMBLER_DIRECTORY / "object_code_ascii_to_big_endian.py"),
+        ]
+
+        # Time printing ascii object code with each assembler, then
+        # re-parsing it to pack the big endian bytes
+        def time_two_steps(assembler_command, hack_path, bin_path):
+            times = []
+            for _ in range(args.repeat):
+                with open(hack_path, "w") as hack_file:
+                    elapsed = time_command(
+                        [*assembler_command, str(asm_path)], stdout=hack_file
+                    )
+                elapsed += time_command([*packer, str(hack_path), str(bin_path)])
+                times.append(elapsed)
+            return min(times)
+
+        # The original pipeline: the baseline assembler, then the packer
+        baseline_time = time_two_steps(
+            baseline_assembler, baseline_hack_path, baseline_bin_path
+        )
+        # The new assembler, still followed by the packer
+        two_step_time = time_two_steps(assembler, hack_path, ascii_bin_path)
+
+        # One step pipeline: stream object code straight to the binary
+        streamed_times = []
+        for _ in range(args.repeat):
+            streamed_times.append(
+                time_command(
+                    [
+                        *assembler,
+                        str(asm_path),
+                        "--output_bin",
+                        str(streamed_bin_path),
+                    ]
+                )
+            )
+        streamed_time = min(streamed_times)
+
+        for bin_path in [baseline_bin_path, ascii_bin_path]:
+            if bin_path.read_bytes() != streamed_bin_path.read_bytes():
+                print(f"Error: streamed object code differs from {bin_path.name}")
+                exit(1)
+
+        # In-process assembly, without interpreter start-up or file output:
+        # building the object code as a string with +=, and as 16-bit words
+        lines = read_assembly_lines(asm_path)
+        baseline_in_process_times = []
+        in_process_times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            baseline_object_code = assemble_by_appending_strings(lines)
+            baseline_in_process_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            object_code = Assembler().assemble(lines)
+            in_process_times.append(time.perf_counter() - start)
+        if baseline_object_code != object_code_to_ascii(object_code):
+            print("Error: object code differs from the baseline assembler's")
+            exit(1)
+
+    best_baseline_in_process = min(baseline_in_process_times)
+    best_in_process = min(in_process_times)
+    print(f"Synthetic program: {args.instructions} instructions")
+    print("  pipeline to .bin                                   time (s)    speedup")
+    for name, pipeline_time in [
+        ("baseline assembler > .hack, then pack", baseline_time),
+        ("assembler.py > .hack, then pack", two_step_time),
+        ("assembler.py --output_bin", streamed_time),
+    ]:
+        print(
+            f"  {name:50s} {pipeline_time:8.3f}    "
+            f"{baseline_time / pipeline_time:6.2f}x"
+        )
+    print(f"  packer step removed: {two_step_time / streamed_time:.2f}x")
+    print("  in-process assembly                                time (s)    speedup")
+    for name, assembly_time in [
+        ("baseline (object code built with +=)", best_baseline_in_process),
+        ("Assembler().assemble()", best_in_process),
+    ]:
+        print(
+            f"  {name:50s} {assembly_time:8.3f}    "
+            f"{best_baseline_in_process / assembly_time:6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import argparse
+from array import array
+import hashlib
+import sys
+import time
+from pathlib import Path
+
+from assembler import (
+    OBJECT_FORMAT_VERSION,
+    Assembler,
+    ObjectModule,
+    clean_assembly_line,
+    encode_address,
+    object_code_to_ascii,
+    object_code_to_big_endian_bytes,
+    object_code_to_memh,
+    predefined_symbol_table,
+)
+
+# Linker for hack assembly modules
+#
+# Each module (e.g. one .asm file written by vm/translator.py
+# --output_directory) is assembled on its own into a relocatable
+# ObjectModule. The linker then lays the modules out in ROM in the order
+# given, resolves labels defined in any module (e.g. VM_CALL, Sys.init) and
+# gives each variable (e.g. static variables like Memory.0) the next free
+# RAM address starting at 16, in order of first use, just as assembling
+# all of the modules together as one file would.
+#
+# Object modules are cached by the hash of their assembly, so only modules
+# whose assembly changed are assembled again.
+
+
+# Cache key for a module: changes whenever its assembly, the object format
+# or the optimization setting changes
+def module_hash(assembly_text, optimize):
+    hasher = hashlib.sha256()
+    hasher.update(f"{OBJECT_FORMAT_VERSION} {optimize}\n".encode())
+    hasher.update(assembly_text.encode())
+    return hasher.hexdigest()
+
+
+# The lines of hack assembly text to assemble, with comments and
+# whitespace removed (as read_assembly_lines reads them from a file)
+def assembly_lines_to_parse(assembly_text):
+    lines = map(clean_assembly_line, assembly_text.splitlines())
+    return [line for line in lines if line]
+
+
+# Assemble one module of hack assembly into an ObjectModule, reusing the
+# cached object module if its assembly has not changed. Returns the object
+# module and whether it came from the cache.
+def assemble_module(input_file, cache_directory=None, optimize=False):
+    input_path = Path(input_file)
+    return assemble_module_text(
+        input_path.read_text(), input_path.stem, cache_directory, optimize
+    )
+
+
+# Assemble the hack assembly of the module name (e.g. from an .asm file, or
+# translated in the same process) as assemble_module does
+def assemble_module_text(assembly_text, name, cache_directory=None, optimize=False):
+    cache_path = None
+    if cache_directory:
+        cache_path = (
+            Path(cache_directory)
+            / f"{name}.{module_hash(assembly_text, optimize)}.json"
+        )
+        if cache_path.exists():
+            return ObjectModule.from_json(cache_path.read_text()), True
+
+    lines_to_parse = assembly_lines_to_parse(assembly_text)
+    if optimize:
+        from peephole import optimize as optimize_lines
+
+        lines_to_parse, report = optimize_lines(lines_to_parse)
+        print(f"{name}.asm: {report.summary()}", file=sys.stderr)
+    object_module = Assembler().assemble_object(lines_to_parse, name)
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(object_module.to_json())
+    return object_module, False
+
+
+# Link object modules, in order, into one program. Returns the object code
+# and the symbol table of the linked program.
+def link(object_modules):
+    # Lay out the modules and find the address of every label
+    symbol_table = predefined_symbol_table()
+    defined_in = {}
+    module_address = 0
+    for object_module in object_modules:
+        for label, offset in object_module.labels.items():
+            if label in defined_in:
+                print(
+                    f"Error: label {label} defined in both {defined_in[label]} "
+                    f"and {object_module.name}"
+                )
+                exit(1)
+            defined_in[label] = object_module.name
+            symbol_table[label] = module_address + offset
+        module_address += len(object_module.code)
+
+    # Patch each relocation with the address of its label or variable
+    address_of_next_free_ram_for_variable = 16
+    object_code = array("H")
+    for object_module in object_modules:
+        module_code = array("H", object_module.code)
+        for offset, symbol_text in object_module.relocations:
+            if symbol_text not in symbol_table:
+                symbol_table[symbol_text] = address_of_next_free_ram_for_variable
+                address_of_next_free_ram_for_variable += 1
+            module_code[offset] = encode_address(symbol_table[symbol_text])
+        object_code.extend(module_code)
+    return object_code, symbol_table
+
+
+# Address-to-source map of the linked program (see source_map.py)
+def linked_source_map(input_files, object_code, optimize=False):
+    modules = [
+        (Path(input_file).name, Path(input_file).read_text())
+        for input_file in input_files
+    ]
+    return linked_source_map_of_modules(modules, object_code, optimize)
+
+
+# Address-to-source map of the linked program from the file name and
+# assembly text of each module, in link order
+def linked_source_map_of_modules(modules, object_code, optimize=False):
+    from source_map import source_map
+
+    entries = []
+    for file_name, assembly_text in modules:
+        if optimize:
+            from peephole import optimize as optimize_lines
+
+            lines, _ = optimize_lines(assembly_lines_to_parse(assembly_text))
+        else:
+            lines = assembly_text.splitlines()
+        entries += source_map(
+            lines, object_code[len(entries) :], file_name, len(entries)
+        )
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "input_files",
+        nargs="+",
+        type=str,
+        help="Files of hack assembly code, one per module, in the order to lay them out in ROM",
+    )
+    parser.add_argument(
+        "--cache_directory",
+        type=str,
+        help="Reuse object modules from (and save new ones to) this directory",
+    )
+    parser.add_argument(
+        "--output_bin",
+        type=str,
+        help="Write object code as big endian bytes to this file",
+    )
+    parser.add_argument(
+        "--output_hack",
+        type=str,
+        help="Write object code as ascii binary numbers, 16 bits per line, to this file",
+    )
+    parser.add_argument(
+        "--output_memh",
+        type=str,
+        help="Write object code as hexadecimal numbers, 4 digits per line, to this file",
+    )
+    parser.add_argument(
+        "--output_map",
+        type=str,
+        help="Write a map (json) of each ROM address to its assembly line, label, function, vm command and jack line to this file",
+    )
+    parser.add_argument(
+        "--output_listing",
+        type=str,
+        help="Write a listing of addresses, object code and source locations to this file",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Run the peephole optimizer on each module before assembling (report on stderr)",
+    )
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    object_modules = []
+    modules_from_cache = 0
+    for input_file in args.input_files:
+        object_module, from_cache = assemble_module(
+            input_file, args.cache_directory, args.optimize
+        )
+        object_modules.append(object_module)
+        modules_from_cache += from_cache
+    object_code, _ = link(object_modules)
+
+    if args.output_bin:
+        with open(args.output_bin, "wb") as output_file:
+            output_file.write(object_code_to_big_endian_bytes(object_code))
+    if args.output_hack:
+        with open(args.output_hack, "w") as output_file:
+            output_file.write(object_code_to_ascii(object_code))
+    if args.output_memh:
+        with open(args.output_memh, "w") as output_file:
+            output_file.write(object_code_to_memh(object_code))
+    if args.output_map or args.output_listing:
+        from source_map import source_map_to_json, source_map_to_listing
+
+        entries = linked_source_map(args.input_files, object_code, args.optimize)
+        if args.output_map:
+            with open(args.output_map, "w") as output_file:
+                output_file.write(source_map_to_json(entries))
+        if args.output_listing:
+            with open(args.output_listing, "w") as output_file:
+                output_file.write(source_map_to_listing(entries))
+
+    # With no output files requested, print the ascii object code
+    if not (args.output_bin or args.output_hack or args.output_memh):
+        print(object_code_to_ascii(object_code))
+
+    print(
+        f"Linked {len(object_modules)} modules ({modules_from_cache} from cache, "
+        f"{len(object_modules) - modules_from_cache} assembled) into "
+        f"{len(object_code)} words in {time.perf_counter() - start_time:.2f} s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
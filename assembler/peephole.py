@@ -0,0 +1,281 @@
+import argparse
+from dataclasses import dataclass, field
+import sys
+
+from assembler import clean_assembly_line
+
+# Every instruction takes the same number of clock cycles: the main loop in
+# computer/top_computer.v goes through 10 states (START_NEXT_CPU_LOOP_ROUND
+# through GATHER_CPU_OUTPUTS_FOR_NEXT_INSTRUCTION) per instruction, except
+# when writing to TX.
+CLOCK_CYCLES_PER_INSTRUCTION = 10
+CLOCK_FREQUENCY_HZ = 12_000_000
+
+# Peephole optimizer for hack assembly
+#
+# Works on the stream of cleaned-up instructions between the vm translator
+# and the assembler. Labels start a new basic block: nothing is assumed
+# about registers at a label, and no pattern matches across one. Rules:
+#
+#  push_pop_round_trip:   @SP M=M+1 @SP AM=M-1  ->  @SP A=M
+#  redundant_a_load:      @X (or @X A=M) when A already holds that value
+#  redundant_d_load:      D=M when D already equals M
+#  dead_a_load:           @X whose value is overwritten before it is used
+#  dead_d_load:           D=... whose value is overwritten before it is used
+#  jump_to_next:          @L 0;JMP (L)  ->  (L)
+#
+# The vm stack pointer (SP) is assumed never to point at itself, so a
+# write through SP does not change SP.
+
+
+@dataclass
+class PeepholeReport:
+    words_before: int = 0
+    words_after: int = 0
+    words_removed_by_rule: dict[str, int] = field(default_factory=dict)
+
+    def count(self, rule, words):
+        self.words_removed_by_rule[rule] = (
+            self.words_removed_by_rule.get(rule, 0) + words
+        )
+
+    def words_saved(self):
+        return self.words_before - self.words_after
+
+    # Each removed instruction saves its clock cycles every time the code
+    # around it runs. This is the saving for running each optimized
+    # straight-line sequence once.
+    def cycles_saved(self):
+        return self.words_saved() * CLOCK_CYCLES_PER_INSTRUCTION
+
+    def summary(self):
+        lines = [
+            f"Peephole optimizer: {self.words_before} -> {self.words_after} words "
+            f"({self.words_saved()} saved)",
+            f"  {self.cycles_saved()} clock cycles saved per pass through the "
+            f"optimized code ({self.cycles_saved() / CLOCK_FREQUENCY_HZ * 1e6:.1f} us "
+            f"at {CLOCK_FREQUENCY_HZ // 1_000_000} MHz)",
+        ]
+        for rule, words in self.words_removed_by_rule.items():
+            lines.append(f"  {rule}: {words} words")
+        return "\n".join(lines)
+
+
+def is_label(instruction):
+    return instruction.startswith("(")
+
+
+def is_address_instruction(instruction):
+    return instruction.startswith("@")
+
+
+# Split a C instruction dest=comp;jump into its three fields ("" if absent)
+def split_compute_instruction(instruction):
+    dest, _, comp_and_jump = instruction.rpartition("=")
+    comp, _, jump = comp_and_jump.partition(";")
+    return dest, comp, jump
+
+
+def count_words(lines):
+    return sum(1 for line in lines if not is_label(line))
+
+
+def remove_push_pop_round_trips(lines, report):
+    result = []
+    i = 0
+    while i < len(lines):
+        if lines[i : i + 4] == ["@SP", "M=M+1", "@SP", "AM=M-1"]:
+            # SP ends where it started, and A points at the value just pushed
+            result += ["@SP", "A=M"]
+            report.count("push_pop_round_trip", 2)
+            i += 4
+        else:
+            result.append(lines[i])
+            i += 1
+    return result
+
+
+# Track what A and D hold within a basic block, dropping loads of values
+# they already hold:
+#   a_value ("address", X): A == X, after @X
+#   a_value ("pointer", X): A == RAM[X], after @X A=M
+#   d_equals_m: D == RAM[A]
+def remove_redundant_loads(lines, report):
+    result = []
+    a_value = None
+    d_equals_m = False
+    i = 0
+    while i < len(lines):
+        instruction = lines[i]
+        if is_label(instruction):
+            a_value = None
+            d_equals_m = False
+            result.append(instruction)
+            i += 1
+            continue
+        if is_address_instruction(instruction):
+            symbol = instruction[1:]
+            if a_value == ("address", symbol):
+                report.count("redundant_a_load", 1)
+                i += 1
+                continue
+            if a_value == ("pointer", symbol) and i + 1 < len(lines):
+                if lines[i + 1] == "A=M":
+                    report.count("redundant_a_load", 2)
+                    i += 2
+                    continue
+            result.append(instruction)
+            a_value = ("address", symbol)
+            d_equals_m = False
+            i += 1
+            continue
+
+        dest, comp, jump = split_compute_instruction(instruction)
+        if instruction == "D=M" and d_equals_m:
+            report.count("redundant_d_load", 1)
+            i += 1
+            continue
+        result.append(instruction)
+        i += 1
+
+        if "M" in dest and a_value is not None and a_value[0] == "pointer":
+            # A write through any pointer other than SP might change the
+            # pointer itself
+            if a_value[1] != "SP":
+                a_value = None
+        if "A" in dest:
+            # A=M or AM=...: A now holds the value stored at the old address
+            if a_value is not None and a_value[0] == "address" and (
+                comp == "M" or "M" in dest
+            ):
+                a_value = ("pointer", a_value[1])
+            else:
+                a_value = None
+            d_equals_m = False
+        elif "D" in dest and "M" in dest:
+            d_equals_m = True
+        elif "D" in dest:
+            d_equals_m = comp == "M"
+        elif "M" in dest:
+            d_equals_m = comp == "D"
+        if jump:
+            a_value = None
+            d_equals_m = False
+    return result
+
+
+# Does this C instruction use the value of A (as a number or an address)?
+def reads_a(dest, comp, jump):
+    return "A" in comp or "M" in comp or "M" in dest or bool(jump)
+
+
+def remove_dead_a_loads(lines, report):
+    result = []
+    for i, instruction in enumerate(lines):
+        if is_address_instruction(instruction) and i + 1 < len(lines):
+            next_instruction = lines[i + 1]
+            if is_address_instruction(next_instruction):
+                report.count("dead_a_load", 1)
+                continue
+            if not is_label(next_instruction):
+                dest, comp, jump = split_compute_instruction(next_instruction)
+                if "A" in dest and not reads_a(dest, comp, jump):
+                    report.count("dead_a_load", 1)
+                    continue
+        result.append(instruction)
+    return result
+
+
+def is_d_dead_after(lines, i):
+    for j in range(i + 1, len(lines)):
+        instruction = lines[j]
+        if is_label(instruction):
+            return False
+        if is_address_instruction(instruction):
+            continue
+        dest, comp, jump = split_compute_instruction(instruction)
+        if "D" in comp or jump:
+            return False
+        if "D" in dest:
+            return True
+    return False
+
+
+def remove_dead_d_loads(lines, report):
+    result = []
+    for i, instruction in enumerate(lines):
+        if not (is_label(instruction) or is_address_instruction(instruction)):
+            dest, comp, jump = split_compute_instruction(instruction)
+            if dest == "D" and not jump and is_d_dead_after(lines, i):
+                report.count("dead_d_load", 1)
+                continue
+        result.append(instruction)
+    return result
+
+
+def labels_starting_at(lines, i):
+    labels = set()
+    while i < len(lines) and is_label(lines[i]):
+        labels.add(lines[i][1:-1])
+        i += 1
+    return labels
+
+
+def remove_jumps_to_next_instruction(lines, report):
+    result = []
+    i = 0
+    while i < len(lines):
+        instruction = lines[i]
+        if is_address_instruction(instruction) and i + 1 < len(lines):
+            next_instruction = lines[i + 1]
+            if not (is_label(next_instruction) or is_address_instruction(next_instruction)):
+                dest, comp, jump = split_compute_instruction(next_instruction)
+                if jump and not dest and instruction[1:] in labels_starting_at(lines, i + 2):
+                    report.count("jump_to_next", 2)
+                    i += 2
+                    continue
+        result.append(instruction)
+        i += 1
+    return result
+
+
+optimization_passes = [
+    remove_push_pop_round_trips,
+    remove_redundant_loads,
+    remove_dead_a_loads,
+    remove_dead_d_loads,
+    remove_jumps_to_next_instruction,
+]
+
+
+# Optimize lines of hack assembly. Lines may be raw (with comments and
+# whitespace); the optimized lines are cleaned up. Returns the optimized
+# lines and a report of the words saved.
+def optimize(lines):
+    lines = [line for line in map(clean_assembly_line, lines) if line]
+    report = PeepholeReport(words_before=count_words(lines))
+    changed = True
+    while changed:
+        words_before_round = count_words(lines)
+        for optimization_pass in optimization_passes:
+            lines = optimization_pass(lines, report)
+        changed = count_words(lines) != words_before_round
+    report.words_after = count_words(lines)
+    return lines, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "input_file", type=str, help="Input file containing hack assembly code"
+    )
+    args = parser.parse_args()
+
+    with open(args.input_file, "r") as input_file:
+        optimized_lines, report = optimize(input_file)
+    print("\n".join(optimized_lines))
+    print(report.summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from dataclasses import asdict, dataclass, field
+import json
+
+from assembler import clean_assembly_line
+
+# Address-to-source map for hack assembly
+#
+# For each ROM address, records the assembly file and line the instruction
+# came from, the labels at that address, the function it belongs to, and
+# the vm command and jack line it was translated from. vm/translator.py
+# writes the vm and jack locations as comments before each vm command's
+# assembly:
+#
+#   // source Main.vm:4 Main.jack:5 | push constant 1
+#
+# The function is the last label before the instruction that is not local
+# to a function (local labels contain "$"), e.g. Main.main or VM_CALL. A
+# function label with no source comment just before it (e.g. VM_CALL)
+# starts code that was not translated from a vm command.
+#
+# The peephole optimizer drops comments, so the map of optimized assembly
+# has labels and functions, but no vm or jack locations.
+
+SOURCE_MAP_FORMAT_VERSION = 1
+SOURCE_COMMENT_PREFIX = "// source "
+
+
+@dataclass
+class SourceMapEntry:
+    address: int
+    word: int
+    instruction: str
+    asm_file: str
+    # line number in asm_file (of the optimized lines, if optimized)
+    asm_line: int
+    labels: list[str] = field(default_factory=list)
+    function: str | None = None
+    # e.g. "Main.vm:4"
+    vm: str | None = None
+    # e.g. "push constant 1"
+    vm_command: str | None = None
+    # e.g. "Main.jack:5"
+    jack: str | None = None
+
+
+# Parse "// source Main.vm:4 Main.jack:5 | push constant 1" into
+# (vm, vm_command, jack)
+def parse_source_comment(line):
+    locations, _, vm_command = line[len(SOURCE_COMMENT_PREFIX) :].partition("|")
+    locations = locations.split()
+    vm = locations[0] if locations else None
+    jack = locations[1] if len(locations) > 1 else None
+    return vm, vm_command.strip() or None, jack
+
+
+# Map each instruction in lines of hack assembly to its source. object_code
+# is the assembled lines, starting at ROM address base_address.
+def source_map(lines, object_code, asm_file, base_address=0):
+    entries = []
+    labels = []
+    function = None
+    vm = vm_command = jack = None
+    source_comment_since_last_instruction = False
+    for line_number, line in enumerate(lines, start=1):
+        stripped_line = line.strip()
+        if stripped_line.startswith(SOURCE_COMMENT_PREFIX):
+            vm, vm_command, jack = parse_source_comment(stripped_line)
+            source_comment_since_last_instruction = True
+            continue
+        instruction = clean_assembly_line(line)
+        if not instruction:
+            continue
+        if instruction.startswith("("):
+            label = instruction[1:-1]
+            labels.append(label)
+            if "$" not in label:
+                function = label
+                if not source_comment_since_last_instruction:
+                    vm = vm_command = jack = None
+            continue
+        address = base_address + len(entries)
+        entries.append(
+            SourceMapEntry(
+                address=address,
+                word=object_code[len(entries)],
+                instruction=instruction,
+                asm_file=asm_file,
+                asm_line=line_number,
+                labels=labels,
+                function=function,
+                vm=vm,
+                vm_command=vm_command,
+                jack=jack,
+            )
+        )
+        labels = []
+        source_comment_since_last_instruction = False
+    return entries
+
+
+def source_map_to_json(entries):
+    return json.dumps(
+        {
+            "format_version": SOURCE_MAP_FORMAT_VERSION,
+            "entries": [asdict(entry) for entry in entries],
+        },
+        indent=1,
+    )
+
+
+# Listing: one line per instruction with its address, object code and
+# source, preceded by its labels and by the vm command it starts
+def source_map_to_listing(entries):
+    listing_lines = []
+    previous_vm = None
+    for entry in entries:
+        if entry.vm is not None and entry.vm != previous_vm:
+            jack = f" ({entry.jack})" if entry.jack else ""
+            listing_lines.append(f"// {entry.vm}{jack}: {entry.vm_command}")
+            previous_vm = entry.vm
+        for label in entry.labels:
+            listing_lines.append(f"({label})")
+        listing_lines.append(
+            f"{entry.address:05d}  {entry.word:04x}  {entry.instruction:<12}"
+            f"  {entry.asm_file}:{entry.asm_line}"
+        )
+    return "\n".join(listing_lines) + "\n"
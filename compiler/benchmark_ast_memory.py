@@ -0,0 +1,167 @@
+import argparse
+from collections import Counter
+from dataclasses import field, fields, is_dataclass, make_dataclass
+import tracemalloc
+from pathlib import Path
+
+import jack_compiler
+from jack_compiler import JackCompiler, Token, tokenize_code_from_file
+
+COMPILER_DIRECTORY = Path(__file__).resolve().parent
+SOURCE_DIRECTORY = COMPILER_DIRECTORY.parent / "src"
+
+# Parses every jack file under src/ and reports the memory the parsed
+# classes take: the peak while parsing, what is left after parsing (the
+# classes themselves) and the number of nodes of each type. The files are
+# tokenized before memory is traced, so only the parser's memory counts.
+# The same token streams are also parsed into a baseline: copies of the
+# node classes as they were before they were slotted, with a __dict__ per
+# node and list children.
+
+# The node classes of a parsed class: the slotted dataclasses of
+# jack_compiler other than Token, by name
+NODE_CLASSES = {
+    name: value
+    for name, value in vars(jack_compiler).items()
+    if isinstance(value, type)
+    and is_dataclass(value)
+    and value.__module__ == jack_compiler.__name__
+    and "__slots__" in vars(value)
+    and value is not Token
+}
+
+
+# Copy of a node class without slots, whose children (defaulting to an
+# empty tuple in node_class) are lists. The parser gives every node tuple
+# children, so they are turned into lists as the node is made.
+def unslotted_node_class(node_class):
+    node_fields = []
+    children_names = []
+    for node_field in fields(node_class):
+        if node_field.default == ():
+            children_names.append(node_field.name)
+            default = field(default_factory=list, compare=node_field.compare)
+        else:
+            default = field(
+                default=node_field.default,
+                default_factory=node_field.default_factory,
+                compare=node_field.compare,
+                repr=node_field.repr,
+            )
+        node_fields.append((node_field.name, node_field.type, default))
+
+    def children_to_lists(node):
+        for name in children_names:
+            setattr(node, name, list(getattr(node, name)))
+
+    return make_dataclass(
+        node_class.__name__,
+        node_fields,
+        namespace={"__post_init__": children_to_lists},
+    )
+
+
+# Number of nodes of each type in the tree under node, with the tokens in
+# it counted as "Token"
+def count_nodes(node, counts):
+    if isinstance(node, Token):
+        counts["Token"] += 1
+    elif is_dataclass(node):
+        counts[type(node).__name__] += 1
+        for node_field in fields(node):
+            count_nodes(getattr(node, node_field.name), counts)
+    elif isinstance(node, (list, tuple)):
+        for child in node:
+            count_nodes(child, counts)
+    return counts
+
+
+# Parses each token stream repeat times with the parser making nodes of
+# node_classes (put in place of jack_compiler's node classes of the same
+# names). Returns the node counts, the memory of the parsed classes and
+# the peak memory while parsing.
+def trace_parsing(token_streams, repeat, node_classes):
+    vars(jack_compiler).update(node_classes)
+    try:
+        tracemalloc.start()
+        classes = [
+            JackCompiler(tokens=token_stream).compile_class()
+            for _ in range(repeat)
+            for token_stream in token_streams
+        ]
+        memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        vars(jack_compiler).update(NODE_CLASSES)
+    counts = Counter()
+    for compiled_class in classes:
+        count_nodes(compiled_class, counts)
+    return counts, memory, peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--source_directory",
+        type=str,
+        default=str(SOURCE_DIRECTORY),
+        help="Directory to parse every jack file under",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Parse every file this many times, keeping every parsed class",
+    )
+    args = parser.parse_args()
+
+    jack_paths = sorted(Path(args.source_directory).rglob("*.jack"))
+    if not jack_paths:
+        print(f"Error: no .jack files in {args.source_directory}")
+        exit(1)
+    token_streams = [tokenize_code_from_file(jack_path) for jack_path in jack_paths]
+
+    unslotted_node_classes = {
+        name: unslotted_node_class(node_class)
+        for name, node_class in NODE_CLASSES.items()
+    }
+    results = [
+        trace_parsing(token_streams, args.repeat, node_classes)
+        for node_classes in [unslotted_node_classes, NODE_CLASSES]
+    ]
+    numbers_of_nodes = [
+        sum(count for node_type, count in counts.items() if node_type != "Token")
+        for counts, _, _ in results
+    ]
+
+    print(
+        f"Parsed {len(token_streams) * args.repeat} classes "
+        f"from {len(jack_paths)} files"
+    )
+    print("                             unslotted, lists    slotted, tuples")
+    for name, values, number_format in [
+        ("peak memory (bytes)", [peak for _, _, peak in results], "d"),
+        ("memory of classes (bytes)", [memory for _, memory, _ in results], "d"),
+        ("nodes", numbers_of_nodes, "d"),
+        ("tokens in nodes", [counts["Token"] for counts, _, _ in results], "d"),
+        (
+            "bytes per node",
+            [
+                memory / number_of_nodes
+                for (_, memory, _), number_of_nodes in zip(results, numbers_of_nodes)
+            ],
+            ".1f",
+        ),
+    ]:
+        print(
+            f"  {name:25s}  {values[0]:16{number_format}}    "
+            f"{values[1]:15{number_format}}"
+        )
+    print("  (bytes per node include the tokens)")
+    unslotted_counts, slotted_counts = results[0][0], results[1][0]
+    for node_type, count in slotted_counts.most_common():
+        print(f"    {node_type:23s}  {unslotted_counts[node_type]:16d}    {count:15d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import time
+
+from jack_compiler import JackCompiler, StringConstantTable, VMGenerator, tokenize_code
+
+# Times vm code generation (VMGenerator) for one generated subroutine of
+# more and more statements, to check that the time grows linearly with the
+# size of the subroutine (the time per statement stays about the same).
+# Each block of statements is nested in --depth while loops and has
+# expressions with nested terms, so code written for nested nodes is not
+# copied again at each enclosing node.
+
+# A block of STATEMENTS_PER_BLOCK statements
+STATEMENTS_PER_BLOCK = 8
+BLOCK = """
+let x = x + (y * 2);
+if (x > y) {
+  while (y < 100) {
+    let y = y + 1;
+    do Output.printInt(((x + y) - 1) / (2 + (x & 7)));
+  }
+} else {
+  let a[x] = -(y | (x - 3));
+}
+let y = a[y] - x;
+do Main.check(x, y, ~(x = y));
+"""
+
+
+# Jack code of a class with one function of about number_of_statements
+# statements, in blocks each nested in depth while loops, and its exact
+# number of statements
+def generated_class_code(number_of_statements, depth):
+    nested_block = BLOCK
+    for _ in range(depth):
+        nested_block = f"while (x < 30000) {{\n{nested_block}let x = x + 1;\n}}\n"
+    statements_per_nested_block = STATEMENTS_PER_BLOCK + 2 * depth
+    number_of_blocks = max(1, number_of_statements // statements_per_nested_block)
+    jack_code = (
+        "class Main {\n"
+        "function int run(int x, int y) {\n"
+        "var Array a;\n"
+        "let a = Array.new(100);\n"
+        + nested_block * number_of_blocks
+        + "return x;\n}\n}\n"
+    )
+    return jack_code, statements_per_nested_block * number_of_blocks + 2
+
+
+# Best time of repeat runs of generating the vm code of compiled_class
+def time_code_generation(compiled_class, repeat):
+    times = []
+    for _ in range(repeat):
+        vm_generator = VMGenerator(StringConstantTable())
+        start = time.perf_counter()
+        instructions = vm_generator.generate_vm_code_for_class(compiled_class)
+        times.append(time.perf_counter() - start)
+    return min(times), instructions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--statements",
+        type=int,
+        default=5000,
+        help="Number of statements in the largest generated subroutine",
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=4,
+        help="Number of while loops each block of statements is nested in",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of times to time each size"
+    )
+    args = parser.parse_args()
+
+    print("  statements    vm commands    time (s)    time per statement (us)")
+    for fraction in [8, 4, 2, 1]:
+        jack_code, number_of_statements = generated_class_code(
+            args.statements // fraction, args.depth
+        )
+        compiled_class = JackCompiler(tokens=tokenize_code(jack_code)).compile_class()
+        generation_time, instructions = time_code_generation(
+            compiled_class, args.repeat
+        )
+        print(
+            f"  {number_of_statements:10d}    {len(instructions):11d}    "
+            f"{generation_time:8.4f}    "
+            f"{generation_time / number_of_statements * 1e6:23.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import pickle
+import time
+import tracemalloc
+from pathlib import Path
+
+from jack_compiler import (
+    Token,
+    keywords,
+    newline_characters,
+    symbols,
+    tokenize_code,
+    whitespace_characters,
+)
+
+COMPILER_DIRECTORY = Path(__file__).resolve().parent
+OS_DIRECTORY = COMPILER_DIRECTORY.parent / "src" / "os"
+
+# Code that tokenizes differently from jack written as intended: comments
+# that end early or run to the end, strings with newlines in them, identifiers
+# split by digits, characters that are neither symbols nor whitespace, and
+# a token left open at the end of the code
+UNUSUAL_CODE = [
+    '/*/ let x = 1; /**/ let y2 = "a // b";\r\n/* a */* 3 /',
+    'let s = "unterminated\n;\tdo Output.printString("");\fx$1',
+    "return 123",
+    'let s = "open to the end',
+    "// comment to the end",
+    "/* comment to the end",
+    "class Main { field int x\u00b2; }",
+]
+
+
+# The tokenizer as it was before it worked in passes over the whole code,
+# to check that tokenize_code gives the same tokens and to time it against
+
+
+def get_token_type(first_char_of_token):
+    if first_char_of_token in symbols:
+        return "symbol"
+    elif first_char_of_token.isdigit():
+        return "integerConstant"
+    elif first_char_of_token == '"':
+        return "stringConstant"
+    else:
+        return "keyword_or_identifier"
+
+
+def should_add_character_to_current_token(character, current_token):
+    if current_token.type == "integerConstant":
+        return character.isdigit()
+    elif current_token.type == "stringConstant":
+        return (character != '"') and (character not in newline_characters)
+    elif current_token.type == "symbol":
+        return False
+    elif current_token.type == "keyword_or_identifier":
+        return not (
+            (character in symbols)
+            or (character.isdigit())
+            or (character == '"')
+            or character in whitespace_characters
+        )
+
+
+def is_token_keyword(token):
+    return token.type == "keyword_or_identifier" and token.value in keywords
+
+
+def tokenize_code_one_character_at_a_time(jack_code):
+    tokens = []
+    current_token = None
+    current_token_type = None
+    in_comment_until_next_newline = False
+    in_comment_until_next_end_of_comment_string = False
+    line_number = 1
+
+    # Tokenize the jack code
+    # loop over characters in jack_code
+    for i, c in enumerate(jack_code):
+        if i > 0 and jack_code[i - 1] == "\n":
+            line_number += 1
+        if not current_token:
+            # Not currently assembling a token. Need to determine
+            # if current character starts a new token  .
+            # First, check if we are already in a comment.
+            if in_comment_until_next_newline:
+                # We are in a comment that ends at the next newline
+                # Do not start a new token, but check if this char ends the comment
+                if c in newline_characters:
+                    in_comment_until_next_newline = False
+                continue
+            if in_comment_until_next_end_of_comment_string:
+                # We are in a comment that ends at the next */ . Do not start
+                # a new token, but check if this char ends the comment.
+                if i > 0:
+                    if f"{jack_code[i-1]}{c}" == "*/":
+                        in_comment_until_next_end_of_comment_string = False
+                continue
+            # Next, check if this character starts a new comment
+            if i < len(jack_code) - 1:
+                # Check if this character starts a comment
+                if f"{c}{jack_code[i+1]}" == "/*":
+                    in_comment_until_next_end_of_comment_string = True
+                    continue
+                if f"{c}{jack_code[i+1]}" == "//":
+                    in_comment_until_next_newline = True
+                    continue
+            # This character is not in a comment or starting a comment.
+            # Is it whitespace? If so, it cannot start a new token.
+            if c in whitespace_characters:
+                continue
+
+            # OK, this character is not part of a comment, does not start
+            # a new comment, and is not whitespace. Therefore, this
+            # character starts a new token. The first character
+            # determines the token type, except if keyword or identifier,
+            # can only tell which after complete token is known
+            current_token_type = get_token_type(c)
+            current_token = Token(
+                type=current_token_type, value=f"{c}", line=line_number
+            )
+            if current_token_type == "symbol":
+                # Token is a single-character token
+                tokens.append(current_token)
+                current_token = None
+            elif current_token_type == "stringConstant":
+                # Do not include double-quote character in the string token
+                current_token.value = ""
+        else:
+            # Is the current character part of the current token?
+            if should_add_character_to_current_token(c, current_token):
+                current_token.value += c
+                continue
+            else:
+                # Is the completed token keyword_or_identifier? If so, decide which
+                if current_token.type == "keyword_or_identifier":
+                    if is_token_keyword(current_token):
+                        current_token.type = "keyword"
+                    else:
+                        current_token.type = "identifier"
+
+                # previous character completed a token; add it to list of tokens
+                tokens.append(current_token)
+
+                # Is the current token a stringConstant?
+                if current_token.type == "stringConstant":
+                    if c == '"':
+                        # String constant completed; ignore closing double-quote;
+                        # start new token on next character (if any) instead
+                        current_token = None
+                        continue
+                    elif c in newline_characters:
+                        # Ignore newline character in string constant
+                        continue
+
+                current_token = None
+                # Does current character start a new token?
+                # Just finished a token, so not currently in a comment.
+                # Does this char start a comment or is it whitespace?
+                # If so, then don't start a new token.
+                # Otherwise, start a new token.
+                if i < len(jack_code) - 1:
+                    if f"{c}{jack_code[i+1]}" == "/*":
+                        in_comment_until_next_end_of_comment_string = True
+                        continue
+                    if f"{c}{jack_code[i+1]}" == "//":
+                        in_comment_until_next_newline = True
+                        continue
+                if c in whitespace_characters:
+                    continue
+                else:
+                    # Start a new token
+                    current_token_type = get_token_type(c)
+                    current_token = Token(
+                        type=current_token_type, value=f"{c}", line=line_number
+                    )
+                    if current_token_type == "symbol":
+                        # Token is a single-character token
+                        tokens.append(current_token)
+                        current_token = None
+                    elif current_token_type == "stringConstant":
+                        # Do not include double-quote character in the string token
+                        current_token.value = ""
+    return tokens
+
+
+# Write synthetic jack code of about number_of_bytes bytes: the OS classes
+# repeated, so the code has the keywords, symbols, constants and comments of
+# real jack code
+def synthetic_jack_code(number_of_bytes):
+    os_code = "\n".join(
+        jack_path.read_text() for jack_path in sorted(OS_DIRECTORY.glob("*.jack"))
+    )
+    return os_code * (number_of_bytes // len(os_code) + 1)
+
+
+# Best time of repeat runs of tokenize on jack_code, and its tokens
+def time_tokenizer(tokenize, jack_code, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = tokenize(jack_code)
+        times.append(time.perf_counter() - start)
+    return min(times), tokens
+
+
+# Bytes of memory taken by what make_tokens returns, and the size of it
+# pickled
+def memory_and_pickle_size(make_tokens):
+    tracemalloc.start()
+    tokens = make_tokens()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory, len(pickle.dumps(tokens))
+
+
+def same_tokens(tokens, other_tokens):
+    return [(token.type, token.value, token.line) for token in tokens] == [
+        (token.type, token.value, token.line) for token in other_tokens
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bytes",
+        type=int,
+        default=1_000_000,
+        help="Size in bytes of the synthetic jack code",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of times to time each tokenizer"
+    )
+    args = parser.parse_args()
+
+    for jack_code in UNUSUAL_CODE:
+        if not same_tokens(
+            tokenize_code(jack_code), tokenize_code_one_character_at_a_time(jack_code)
+        ):
+            print(f"Error: tokens differ from the old tokenizer's for {jack_code!r}")
+            exit(1)
+
+    jack_codes = {
+        jack_path.name: jack_path.read_text()
+        for jack_path in sorted(OS_DIRECTORY.glob("*.jack"))
+    }
+    jack_codes["synthetic"] = synthetic_jack_code(args.bytes)
+
+    print(
+        "  jack code              bytes    one character (s)    "
+        "tokenize_code (s)    speedup"
+    )
+    for name, jack_code in jack_codes.items():
+        old_time, old_tokens = time_tokenizer(
+            tokenize_code_one_character_at_a_time, jack_code, args.repeat
+        )
+        new_time, new_tokens = time_tokenizer(tokenize_code, jack_code, args.repeat)
+        if not same_tokens(new_tokens, old_tokens):
+            print(f"Error: tokens of {name} differ from the old tokenizer's")
+            exit(1)
+        print(
+            f"  {name:16s} {len(jack_code):11d}    {old_time:17.4f}    "
+            f"{new_time:17.4f}    {old_time / new_time:6.1f}x"
+        )
+
+    # The tokens of the synthetic code as a TokenStream, and as the list of
+    # Token objects the tokenizer used to return
+    jack_code = jack_codes["synthetic"]
+    print("  tokens of synthetic    memory (bytes)    pickled (bytes)")
+    for name, make_tokens in [
+        ("list of Tokens", lambda: list(tokenize_code(jack_code))),
+        ("TokenStream", lambda: tokenize_code(jack_code)),
+    ]:
+        memory, pickle_size = memory_and_pickle_size(make_tokens)
+        print(f"  {name:19s}    {memory:14d}    {pickle_size:15d}")
+
+
+if __name__ == "__main__":
+    main()
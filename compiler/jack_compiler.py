@@ -1,11 +1,20 @@
 from __future__ import annotations
 import argparse
 import codecs
+from array import array
 from dataclasses import dataclass, field
+from itertools import count, groupby, repeat
+from operator import floordiv, mul
 from pathlib import Path
+import re
+import struct
+import sys
+import time
 from typing import Literal, Optional, Union
 import xml.etree.ElementTree as et
 
+from vm_ir import Opcode, Segment, VMInstruction, write_vm_code
+
 # Global constants
 
 keywords = [
@@ -86,8 +95,16 @@ TokenType = Literal[
     "keyword_or_identifier",
 ]
 
+# Type codes of tokens in a TokenStream, indices into token_types
+token_types = ["keyword", "symbol", "integerConstant", "stringConstant", "identifier"]
+KEYWORD, SYMBOL, INTEGER_CONSTANT, STRING_CONSTANT, IDENTIFIER = range(len(token_types))
+
 
 # Dataclasses for tokens and program structure
+#
+# The nodes of a parsed class are slotted dataclasses (no __dict__ per
+# node), and their children are tuples, as nothing changes a node after
+# the parser makes it.
 
 
 # Token
@@ -95,11 +112,13 @@ TokenType = Literal[
 class Token:
     type: TokenType
     value: str
-    __slots__ = ["type", "value"]
+    # line number in the jack file (not part of the token's identity)
+    __slots__ = ["type", "value", "line"]
 
-    def __init__(self, type: TokenType, value: str):
+    def __init__(self, type: TokenType, value: str, line: int = 0):
         self.type = type
         self.value = value
+        self.line = line
 
     def __eq__(self, other: Token) -> bool:
         if not isinstance(other, Token):
@@ -110,49 +129,101 @@ class Token:
         return hash((self.type, self.value))
 
 
+# Tokens of one jack file, stored as columns instead of Token objects
+#
+# The tokens are parallel arrays of type codes (see token_types), indices
+# into a table of the distinct values (each value stored once, however
+# often it appears) and line numbers. The parser compares type codes and
+# values without making a Token (see JackCompiler.current_type and
+# current_value); indexing or iterating over the stream makes Tokens, for
+# the parsed classes and the token xml. Arrays pickle as their bytes, so a
+# stream is small to pickle (e.g. to cache it).
+class TokenStream:
+    type_codes: array
+    value_indices: array
+    lines: array
+    values: list[str]
+    __slots__ = ["type_codes", "value_indices", "lines", "values"]
+
+    def __init__(self):
+        self.type_codes = array("H")
+        self.value_indices = array("I")
+        self.lines = array("I")
+        self.values = []
+
+    @classmethod
+    def from_tokens(cls, tokens) -> TokenStream:
+        token_stream = cls()
+        index_of_value = {}
+        for token in tokens:
+            value_index = index_of_value.setdefault(token.value, len(index_of_value))
+            if value_index == len(token_stream.values):
+                token_stream.values.append(token.value)
+            token_stream.type_codes.append(token_types.index(token.type))
+            token_stream.value_indices.append(value_index)
+            token_stream.lines.append(token.line)
+        return token_stream
+
+    def __len__(self) -> int:
+        return len(self.type_codes)
+
+    def __getitem__(self, index: int) -> Token:
+        return Token(
+            token_types[self.type_codes[index]],
+            self.values[self.value_indices[index]],
+            self.lines[index],
+        )
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+    def value(self, index: int) -> str:
+        return self.values[self.value_indices[index]]
+
+
 # Term and expression related classes
-@dataclass
+@dataclass(slots=True)
 class Expression:
     # first term
     first_term: Term
-    # other terms: list of pairs of symbol-type tokens representing
-    # binary operators (+|-|*|/|&|||<|>|=)
-    # a list, possibly empty
-    other_terms: list[tuple[Token, Term]] = field(default_factory=list)
+    # other terms: pairs of symbol-type tokens representing
+    # binary operators (+|-|*|/|&|||<|>|=) and terms
+    # a tuple, possibly empty
+    other_terms: tuple[tuple[Token, Term], ...] = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class ExpressionList:
-    # a list of expressions
-    expressions: list[Expression] = field(default_factory=list)
+    # a tuple of expressions
+    expressions: tuple[Expression, ...] = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class IntegerConstant:
     # a token of type integerConstant specifying the constant
     token: Token
 
 
-@dataclass
+@dataclass(slots=True)
 class StringConstant:
     # a token of type stringConstant specifying the constant
     token: Token
 
 
-@dataclass
+@dataclass(slots=True)
 class KeywordConstant:
     # a token of type keyword specifying the constant
     # must be one of true, false, null, this
     token: Token
 
 
-@dataclass
+@dataclass(slots=True)
 class VarName:
     # a token of type identifier specifying the variable name
     token: Token
 
 
-@dataclass
+@dataclass(slots=True)
 class ArrayAccess:
     # a token of type identifier specifying the array name
     array_name_token: Token
@@ -160,13 +231,13 @@ class ArrayAccess:
     array_index: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class ParentheticalExpression:
     # expression representing the expression enclosed in ()
     expression: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class UnaryOpTerm:
     # a token of type symbol specifying the unary op
     op_token: Token
@@ -174,7 +245,7 @@ class UnaryOpTerm:
     term_to_operate_on: Term
 
 
-@dataclass
+@dataclass(slots=True)
 class SubroutineCall:
     # a token of type identifier naming the subroutine
     subroutine_name_token: Token
@@ -198,34 +269,44 @@ Term = Union[
 # Statement related classes
 
 
-@dataclass
+@dataclass(slots=True)
 class LetStatement:
     var_name_token: Token
     expression: Expression
     array_index: Optional[Expression] = None
+    # line number of the statement in the jack file
+    line: int = field(default=0, compare=False, repr=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class DoStatement:
     subroutine_call: SubroutineCall
+    # line number of the statement in the jack file
+    line: int = field(default=0, compare=False, repr=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class ReturnStatement:
     expression: Optional[Expression] = None
+    # line number of the statement in the jack file
+    line: int = field(default=0, compare=False, repr=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class IfStatement:
     condition: Expression
     then_statements: Statements
     else_statements: Optional[Statements] = None
+    # line number of the statement in the jack file
+    line: int = field(default=0, compare=False, repr=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class WhileStatement:
     condition: Expression
     body: Statements
+    # line number of the statement in the jack file
+    line: int = field(default=0, compare=False, repr=False)
 
 
 Statement = Union[
@@ -233,41 +314,41 @@ Statement = Union[
 ]
 
 
-@dataclass
+@dataclass(slots=True)
 class Statements:
-    statements: list[Statement] = field(default_factory=list)
+    statements: tuple[Statement, ...] = ()
 
 
 # Program structure related classes
 
 
-@dataclass
+@dataclass(slots=True)
 class VariableDeclaration:
     # keyword token (int, char, or boolean) or identifier (class name)
     type_token: Token
     # variable name token(s)
     first_var_name_token: Token
-    other_var_name_tokens: list[Token] = field(default_factory=list)
+    other_var_name_tokens: tuple[Token, ...] = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class SubroutineBody:
-    variable_declarations: list[VariableDeclaration] = field(default_factory=list)
+    variable_declarations: tuple[VariableDeclaration, ...] = ()
     statements: Statements = field(default_factory=Statements)
 
 
-@dataclass
+@dataclass(slots=True)
 class Parameter:
     type_token: Token
     variable_name_token: Token
 
 
-@dataclass
+@dataclass(slots=True)
 class ParameterList:
-    parameters: list[Parameter] = field(default_factory=list)
+    parameters: tuple[Parameter, ...] = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class SubroutineDeclaration:
     # keyword token (constructor or function or method)
     subroutine_kind_token: Token
@@ -281,7 +362,7 @@ class SubroutineDeclaration:
     subroutine_body: SubroutineBody
 
 
-@dataclass
+@dataclass(slots=True)
 class ClassVariableDeclaration:
     # keyword token (static or field)
     class_variable_kind_token: Token
@@ -289,170 +370,192 @@ class ClassVariableDeclaration:
     type_token: Token
     # variable name token(s)
     first_var_name_token: Token
-    other_var_name_tokens: list[Token] = field(default_factory=list)
+    other_var_name_tokens: tuple[Token, ...] = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class Class:
     name_token: Token
-    class_variable_declarations: list[ClassVariableDeclaration] = field(
-        default_factory=list
-    )
-    subroutine_declarations: list[SubroutineDeclaration] = field(default_factory=list)
+    class_variable_declarations: tuple[ClassVariableDeclaration, ...] = ()
+    subroutine_declarations: tuple[SubroutineDeclaration, ...] = ()
 
 
 # Functions for tokenizing
-
-
-def get_token_type(first_char_of_token):
-    if first_char_of_token in symbols:
-        return "symbol"
-    elif first_char_of_token.isdigit():
-        return "integerConstant"
-    elif first_char_of_token == '"':
-        return "stringConstant"
-    else:
-        return "keyword_or_identifier"
-
-
-def should_add_character_to_current_token(character, current_token):
-    if current_token.type == "integerConstant":
-        return character.isdigit()
-    elif current_token.type == "stringConstant":
-        return (character != '"') and (character not in newline_characters)
-    elif current_token.type == "symbol":
-        return False
-    elif current_token.type == "keyword_or_identifier":
-        return not (
-            (character in symbols)
-            or (character.isdigit())
-            or (character == '"')
-            or character in whitespace_characters
+#
+# The tokenizer works on the utf-8 bytes of the jack code, in a few passes
+# over the whole code that each run in C, rather than a step of Python code
+# per token or per character:
+# - one regular expression splits out the comments and string constants. A
+#   comment starting with // ends at the next newline, and one starting
+#   with /* at the first */ after the / (so /*/ is a whole comment); either
+#   may run to the end of the code. A string constant runs from a double
+#   quote to the next double quote, or to the end of the code. Each comment
+#   is replaced by the newlines in it, and each string constant by a piece
+#   '"n' naming it (followed by the newlines in it)
+# - spaces are put around each symbol (a symbol is one character) and each
+#   newline is replaced by a marker, so splitting the code on whitespace
+#   gives pieces that are each a string constant, a newline marker or a run
+#   of other characters
+# - each piece is looked up in a table of the records of its tokens (see
+#   TokenRecords), which turns each distinct piece into its tokens once,
+#   and the records of every piece are joined in one pass. The records of
+#   the tokens between two newline markers get the line number of that line
+# A token still open at the end of the code is dropped (a string is only
+# listed for the newlines in it), as no character after it ends it.
+
+comment_or_string_pattern = re.compile(
+    rb'(//[^\n\r]*|/\*(?:/|[^*]*\*+(?:[^*/][^*]*\*+)*/)|/\*.*|"[^"]*"?)', re.DOTALL
+)
+symbol_bytes = [symbol.encode() for symbol in symbols]
+# Last characters of code that close the token before them
+closing_bytes = frozenset(
+    symbol_bytes + [character.encode() for character in whitespace_characters]
+)
+keyword_set = frozenset(keywords)
+symbol_set = frozenset(symbols)
+newline_pattern = re.compile(f"[{re.escape(''.join(newline_characters))}]")
+ascii_digit_pattern = re.compile(rb"[0-9]")
+
+# bytes.split() also splits on vertical tabs and form feeds, which are not
+# whitespace in jack code, so they are escaped while the code is split, as
+# are newlines, which become a piece of their own. 0xff is never part of
+# utf-8, so the escapes cannot clash with the code.
+NEWLINE_MARKER = b"\xff\x00"
+escaped_characters = {b"\x0b": b"\xff\x01", b"\x0c": b"\xff\x02"}
+
+# The record of a token: its value index, its type code and two bytes of
+# padding (zero), in native byte order. The record of a newline marker is
+# eight 0xff bytes: a run of token records has no eight 0xff bytes from a
+# record's start, and every eight bytes from inside a record take in its
+# type code or padding, so the line ends are found by splitting the joined
+# records on LINE_END.
+pack_token = struct.Struct("IHxx").pack
+LINE_END = b"\xff" * 8
+pack_line = struct.Struct("I").pack
+
+# Every token stream's values start with the symbols and keywords, so the
+# records of the pieces that are a symbol or keyword are made once, here
+fixed_values = symbols + keywords
+index_of_fixed_value = {value: index for index, value in enumerate(fixed_values)}
+fixed_records = {NEWLINE_MARKER: LINE_END}
+for value_index, value in enumerate(fixed_values):
+    type_code = SYMBOL if value in symbol_set else KEYWORD
+    fixed_records[value.encode()] = pack_token(value_index, type_code)
+
+
+# The tokens of a piece of jack code (see tokenize_code), as (type code,
+# value) pairs. A piece '"n' is string_constants[n], the text of a string
+# constant from its opening double quote.
+def tokens_of_piece(piece, string_constants):
+    if piece.startswith(b'"'):
+        string_constant = string_constants[int(piece[1:])]
+        closed = len(string_constant) > 1 and string_constant.endswith('"')
+        value, number_of_newlines = newline_pattern.subn(
+            "", string_constant[1 : len(string_constant) - closed]
         )
+        return [(STRING_CONSTANT, value)] * (number_of_newlines + closed)
+    if b"\xff" in piece:
+        for character, escaped in escaped_characters.items():
+            piece = piece.replace(escaped, character)
+    text = piece.decode("utf-8", "surrogatepass")
+    if text in symbol_set:
+        return [(SYMBOL, text)]
+    if piece.isascii() and not ascii_digit_pattern.search(piece):
+        return [(KEYWORD if text in keyword_set else IDENTIFIER, text)]
+    # Digits (anything str.isdigit() accepts, e.g. superscripts) end a
+    # keyword or identifier and start an integer constant
+    tokens = []
+    for is_digit, characters in groupby(text, key=str.isdigit):
+        value = "".join(characters)
+        if is_digit:
+            tokens.append((INTEGER_CONSTANT, value))
+        else:
+            tokens.append((KEYWORD if value in keyword_set else IDENTIFIER, value))
+    return tokens
 
 
-def is_token_keyword(token):
-    return token.type == "keyword_or_identifier" and token.value in keywords
+# Records of the tokens of each piece of one jack code (see tokenize_code),
+# made the first time a piece is looked up. New values are added to values
+# (the token stream's table of values).
+class TokenRecords(dict):
+    def __init__(self, string_constants, values):
+        super().__init__(fixed_records)
+        self.string_constants = string_constants
+        self.values = values
+        self.index_of_value = dict(index_of_fixed_value)
+        values.extend(fixed_values)
+
+    def __missing__(self, piece):
+        # A piece of ascii letters that is not a keyword (see fixed_records)
+        # is an identifier
+        if piece.isalpha():
+            tokens = [(IDENTIFIER, piece.decode())]
+        else:
+            tokens = tokens_of_piece(piece, self.string_constants)
+        records = []
+        for type_code, value in tokens:
+            value_index = self.index_of_value.get(value)
+            if value_index is None:
+                value_index = self.index_of_value[value] = len(self.values)
+                self.values.append(sys.intern(value))
+            records.append(pack_token(value_index, type_code))
+        record = self[piece] = b"".join(records)
+        return record
 
 
 # function to tokenize code (a stream of characters)
 # basically, turn list of characters into a list of words
 # input: code (a string)
-# output: list of tokens
+# output: TokenStream of the tokens
 def tokenize_code(jack_code):
-    tokens = []
-    current_token = None
-    current_token_type = None
-    in_comment_until_next_newline = False
-    in_comment_until_next_end_of_comment_string = False
-
-    # Tokenize the jack code
-    # loop over characters in jack_code
-    for i, c in enumerate(jack_code):
-        if not current_token:
-            # Not currently assembling a token. Need to determine
-            # if current character starts a new token  .
-            # First, check if we are already in a comment.
-            if in_comment_until_next_newline:
-                # We are in a comment that ends at the next newline
-                # Do not start a new token, but check if this char ends the comment
-                if c in newline_characters:
-                    in_comment_until_next_newline = False
-                continue
-            if in_comment_until_next_end_of_comment_string:
-                # We are in a comment that ends at the next */ . Do not start
-                # a new token, but check if this char ends the comment.
-                if i > 0:
-                    if f"{jack_code[i-1]}{c}" == "*/":
-                        in_comment_until_next_end_of_comment_string = False
-                continue
-            # Next, check if this character starts a new comment
-            if i < len(jack_code) - 1:
-                # Check if this character starts a comment
-                if f"{c}{jack_code[i+1]}" == "/*":
-                    in_comment_until_next_end_of_comment_string = True
-                    continue
-                if f"{c}{jack_code[i+1]}" == "//":
-                    in_comment_until_next_newline = True
-                    continue
-            # This character is not in a comment or starting a comment.
-            # Is it whitespace? If so, it cannot start a new token.
-            if c in whitespace_characters:
-                continue
-
-            # OK, this character is not part of a comment, does not start
-            # a new comment, and is not whitespace. Therefore, this
-            # character starts a new token. The first character
-            # determines the token type, except if keyword or identifier,
-            # can only tell which after complete token is known
-            current_token_type = get_token_type(c)
-            current_token = Token(type=current_token_type, value=f"{c}")
-            if current_token_type == "symbol":
-                # Token is a single-character token
-                tokens.append(current_token)
-                current_token = None
-            elif current_token_type == "stringConstant":
-                # Do not include double-quote character in the string token
-                current_token.value = ""
+    code = jack_code.encode("utf-8", "surrogatepass")
+    parts = comment_or_string_pattern.split(code)
+    ends_in_open_token = bool(parts[-1]) and parts[-1][-1:] not in closing_bytes
+
+    # Replace the comments and string constants (every other part)
+    string_constants = []
+    replacements = {}
+    for comment_or_string in dict.fromkeys(parts[1::2]):
+        newlines = b"\n" * comment_or_string.count(b"\n")
+        if comment_or_string.startswith(b'"'):
+            replacements[comment_or_string] = (
+                b' "%d ' % len(string_constants) + newlines
+            )
+            string_constants.append(comment_or_string.decode("utf-8", "surrogatepass"))
         else:
-            # Is the current character part of the current token?
-            if should_add_character_to_current_token(c, current_token):
-                current_token.value += c
-                continue
-            else:
-                # Is the completed token keyword_or_identifier? If so, decide which
-                if current_token.type == "keyword_or_identifier":
-                    if is_token_keyword(current_token):
-                        current_token.type = "keyword"
-                    else:
-                        current_token.type = "identifier"
-
-                # previous character completed a token; add it to list of tokens
-                tokens.append(current_token)
-
-                # Is the current token a stringConstant?
-                if current_token.type == "stringConstant":
-                    if c == '"':
-                        # String constant completed; ignore closing double-quote;
-                        # start new token on next character (if any) instead
-                        current_token = None
-                        continue
-                    elif c in newline_characters:
-                        # Ignore newline character in string constant
-                        continue
-
-                current_token = None
-                # Does current character start a new token?
-                # Just finished a token, so not currently in a comment.
-                # Does this char start a comment or is it whitespace?
-                # If so, then don't start a new token.
-                # Otherwise, start a new token.
-                if i < len(jack_code) - 1:
-                    if f"{c}{jack_code[i+1]}" == "/*":
-                        in_comment_until_next_end_of_comment_string = True
-                        continue
-                    if f"{c}{jack_code[i+1]}" == "//":
-                        in_comment_until_next_newline = True
-                        continue
-                if c in whitespace_characters:
-                    continue
-                else:
-                    # Start a new token
-                    current_token_type = get_token_type(c)
-                    current_token = Token(type=current_token_type, value=f"{c}")
-                    if current_token_type == "symbol":
-                        # Token is a single-character token
-                        tokens.append(current_token)
-                        current_token = None
-                    elif current_token_type == "stringConstant":
-                        # Do not include double-quote character in the string token
-                        current_token.value = ""
-    return tokens
+            replacements[comment_or_string] = b" " + newlines
+    parts[1::2] = map(replacements.__getitem__, parts[1::2])
+    code = b"".join(parts)
+
+    for character, escaped in escaped_characters.items():
+        code = code.replace(character, escaped)
+    code = code.replace(b"\n", b" " + NEWLINE_MARKER + b" ")
+    for symbol in symbol_bytes:
+        code = code.replace(symbol, b" " + symbol + b" ")
+
+    token_stream = TokenStream()
+    records = TokenRecords(string_constants, token_stream.values)
+    records_by_line = b"".join(map(records.__getitem__, code.split())).split(LINE_END)
+    token_records = memoryview(b"".join(records_by_line))
+    token_stream.value_indices.frombytes(token_records.cast("I")[0::2].tobytes())
+    token_stream.type_codes.frombytes(token_records.cast("H")[2::4].tobytes())
+    tokens_by_line = map(floordiv, map(len, records_by_line), repeat(len(LINE_END)))
+    token_stream.lines.frombytes(
+        b"".join(map(mul, map(pack_line, count(1)), tokens_by_line))
+    )
+
+    # An integer constant, keyword or identifier at the very end of the code
+    # is still open, so it is dropped
+    if ends_in_open_token:
+        token_stream.type_codes.pop()
+        token_stream.value_indices.pop()
+        token_stream.lines.pop()
+    return token_stream
 
 
 # function tokenize code from one file
 # Input: file_path = path to a .jack  file
-# Output: list of tokens
+# Output: TokenStream of the tokens
 def tokenize_code_from_file(file_path):
     with open(file_path, "r") as f:
         jack_code = f.read()
@@ -470,11 +573,18 @@ class StringLiteralPositionInfo:
 
 
 class StringConstantTable:
-    string_token_to_position_info: dict[Token, StringLiteralPositionInfo] = {}
+    string_token_to_position_info: dict[Token, StringLiteralPositionInfo]
     starting_address: int = 24600
     max_address: int = 32767
-    next_available_address: int = 24600
-    string_token_to_decoded_bytes: dict[Token, bytes] = {}
+    next_available_address: int
+    string_token_to_decoded_bytes: dict[Token, bytes]
+
+    # Each table has its own strings, so that tables made one after
+    # another (e.g. one per compilation session) do not share them
+    def __init__(self):
+        self.string_token_to_position_info = {}
+        self.next_available_address = self.starting_address
+        self.string_token_to_decoded_bytes = {}
 
     def add_string_literal(self, string_token: Token):
         # Error if passed a token that isn't a stringConstant
@@ -524,11 +634,36 @@ class StringConstantTable:
 
 @dataclass
 class JackCompiler:
-    tokens: list[Token]
+    # a TokenStream (a list of Tokens is converted to one)
+    tokens: TokenStream
     current_token_index: int = 0
+    # if set, each string constant is added to this table as it is parsed
+    string_constant_table: Optional[StringConstantTable] = None
+
+    def __post_init__(self):
+        if not isinstance(self.tokens, TokenStream):
+            self.tokens = TokenStream.from_tokens(self.tokens)
 
     def current_token(self) -> Token:
-        return self.tokens[self.current_token_index]
+        tokens = self.tokens
+        index = self.current_token_index
+        return Token(
+            token_types[tokens.type_codes[index]],
+            tokens.values[tokens.value_indices[index]],
+            tokens.lines[index],
+        )
+
+    # type code (see token_types) and value of the current token, without
+    # making a Token
+    def current_type(self) -> int:
+        return self.tokens.type_codes[self.current_token_index]
+
+    def current_value(self) -> str:
+        tokens = self.tokens
+        return tokens.values[tokens.value_indices[self.current_token_index]]
+
+    def current_line(self) -> int:
+        return self.tokens.lines[self.current_token_index]
 
     def next_token(self) -> Token:
         if self.has_next_token():
@@ -536,8 +671,21 @@ class JackCompiler:
         else:
             raise ValueError("Next token requested, but no next token available")
 
+    def next_type(self) -> int:
+        if self.has_next_token():
+            return self.tokens.type_codes[self.current_token_index + 1]
+        else:
+            raise ValueError("Next token requested, but no next token available")
+
+    def next_value(self) -> str:
+        if self.has_next_token():
+            tokens = self.tokens
+            return tokens.values[tokens.value_indices[self.current_token_index + 1]]
+        else:
+            raise ValueError("Next token requested, but no next token available")
+
     def has_next_token(self) -> bool:
-        return self.current_token_index + 1 < len(self.tokens)
+        return self.current_token_index + 1 < len(self.tokens.type_codes)
 
     def advance(self):
         self.current_token_index += 1
@@ -548,110 +696,118 @@ class JackCompiler:
     def compile_term(self) -> Term:
         # current token determines term type, expect when we must also look
         # ahead one token
-        current_token = self.current_token()
-        if current_token.type == "integerConstant":
+        current_type = self.current_type()
+        if current_type == INTEGER_CONSTANT:
+            integer_constant = IntegerConstant(token=self.current_token())
             self.advance()
-            return IntegerConstant(token=current_token)
-        elif current_token.type == "stringConstant":
+            return integer_constant
+        elif current_type == STRING_CONSTANT:
+            string_token = self.current_token()
             self.advance()
-            return StringConstant(token=current_token)
-        elif current_token.type == "keyword":
-            if current_token.value in keyword_constants:
+            if self.string_constant_table is not None:
+                self.string_constant_table.add_string_literal(string_token)
+            return StringConstant(token=string_token)
+        elif current_type == KEYWORD:
+            if self.current_value() in keyword_constants:
+                keyword_constant = KeywordConstant(token=self.current_token())
                 self.advance()
-                return KeywordConstant(token=current_token)
+                return keyword_constant
             else:
                 raise ValueError(
-                    f"Keyword {current_token.value} is not a keyword constant"
+                    f"Keyword {self.current_value()} is not a keyword constant"
                 )
-        elif current_token.type == "symbol":
-            if current_token.value == "(":
+        elif current_type == SYMBOL:
+            if self.current_value() == "(":
                 self.advance()  # advance past "("
                 result = ParentheticalExpression(expression=self.compile_expression())
-                if self.current_token().value == ")":
+                if self.current_value() == ")":
                     self.advance()
                     return result
                 else:
                     raise ValueError(
                         "Expected closing ) after ( in paranethetical expression"
                     )
-            elif current_token.value in unary_operators:
-                unary_op_token = current_token
+            elif self.current_value() in unary_operators:
+                unary_op_token = self.current_token()
                 self.advance()
                 return UnaryOpTerm(
                     op_token=unary_op_token, term_to_operate_on=self.compile_term()
                 )
             else:
-                raise ValueError(f"Unexpected symbol {current_token.value} in term")
-        elif current_token.type == "identifier":
+                raise ValueError(f"Unexpected symbol {self.current_value()} in term")
+        elif current_type == IDENTIFIER:
             # Need to look ahead 1 token to decide what's next
             # Possibilities:
             #   1. Next token is '[' -- ArrayAccess
             #   2. Next token is '(' -- SubroutineCall
             #   3. Next token is not a symbol -- VarName
             if not (self.has_next_token()):
+                var_name = VarName(token=self.current_token())
                 self.advance()
-                return VarName(token=current_token)
-            if self.next_token().type != "symbol":
+                return var_name
+            if self.next_type() != SYMBOL:
+                var_name = VarName(token=self.current_token())
                 self.advance()  # advance past identifier token
-                return VarName(token=current_token)
+                return var_name
             else:
-                if self.next_token().value == "[":
-                    array_name_token = current_token
+                if self.next_value() == "[":
+                    array_name_token = self.current_token()
                     self.advance()  # consumed identifier; current token is now "["
-                    if self.current_token().value != "[":
+                    if self.current_value() != "[":
                         raise ValueError(
-                            f"Expected [ after identifier {current_token.value} in array access"
+                            f"Expected [ after identifier {array_name_token.value} in array access"
                         )
                     self.advance()  # consumed "("; current token is now first token of expression
                     array_index = self.compile_expression()
-                    if self.current_token().value == "]":
+                    if self.current_value() == "]":
                         self.advance()
                         return ArrayAccess(
                             array_name_token=array_name_token, array_index=array_index
                         )
                     else:
                         raise ValueError("Expected closing ] after [ in array access")
-                elif self.next_token().value == "(":
+                elif self.next_value() == "(":
                     return self.compile_subroutine_call()
-                elif self.next_token().value == ".":
+                elif self.next_value() == ".":
                     return self.compile_subroutine_call()
                 else:
                     # Next token is a symbol but is not part of this term
+                    var_name = VarName(token=self.current_token())
                     self.advance()  # advance past identifier token
-                    return VarName(token=current_token)
+                    return var_name
 
     def compile_subroutine_call(self) -> SubroutineCall:
-        subroutine_name_token = self.current_token()
         receiver_name_token = None
-        if subroutine_name_token.type != "identifier":
+        if self.current_type() != IDENTIFIER:
             raise ValueError(
-                f"Subroutine name token {subroutine_name_token.value} is type {subroutine_name_token.type}, not identifier"
+                f"Subroutine name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
             )
+        subroutine_name_token = self.current_token()
         self.advance()
         # Two possibilities:
         #  1. Next token is "(" -- implicitly call method of this
         #  2. Next token is "." -- call method of class or object
-        if self.current_token().value == ".":
+        if self.current_value() == ".":
             self.advance()  # advance past "."
             receiver_name_token = subroutine_name_token
-            subroutine_name_token = self.current_token()
-            if subroutine_name_token.type != "identifier":
+            if self.current_type() != IDENTIFIER:
                 raise ValueError(
-                    f"Subroutine name token {subroutine_name_token.value} is type {subroutine_name_token.type}, not identifier"
+                    f"Subroutine name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
                 )
+            subroutine_name_token = self.current_token()
             self.advance()  # advance past subroutine name token
-        if self.current_token().value == "(":
+        if self.current_value() == "(":
             self.advance()  # advance past "("
-            if self.current_token().value == ")":
+            if self.current_value() == ")":
                 self.advance()  # advance past ")"
                 return SubroutineCall(
                     subroutine_name_token=subroutine_name_token,
                     receiver_name_token=receiver_name_token,
-                    expression_list=ExpressionList(expressions=[]),
+                    expression_list=ExpressionList(),
                 )
             else:
                 expression_list = self.compile_expression_list()
-                if self.current_token().value != ")":
+                if self.current_value() != ")":
                     raise ValueError(
                         "Expected closing ) after ( in expression list in subroutine call"
                     )
@@ -671,59 +827,60 @@ class JackCompiler:
     # is empty (e.g. by finding ")" right away)
     def compile_expression_list(self) -> ExpressionList:
         expressions = [self.compile_expression()]
-        while self.current_token().value == ",":
+        while self.current_value() == ",":
             self.advance()  # advance past ","
             expressions.append(self.compile_expression())
-        return ExpressionList(expressions=expressions)
+        return ExpressionList(expressions=tuple(expressions))
 
     def compile_expression(self) -> Expression:
         # Compile term and advance to next token not part of that term
         # Note: compile_term() advances to appropriate token
-        expression = Expression(first_term=self.compile_term())
+        first_term = self.compile_term()
+        other_terms = []
         while (
-            self.current_token().type == "symbol"
-            and self.current_token().value in binary_operators
+            self.current_type() == SYMBOL and self.current_value() in binary_operators
         ):
             operator_token = self.current_token()
             self.advance()
             next_term = self.compile_term()
-            expression.other_terms.append((operator_token, next_term))
-        return expression
+            other_terms.append((operator_token, next_term))
+        return Expression(first_term=first_term, other_terms=tuple(other_terms))
 
     # Compile statements
     # 'let' varName('['expression']')?'=' expression ';'
     def compile_let_statement(self) -> LetStatement:
         # to get here, current token should be keyword "let"
-        if self.current_token().value != "let":
+        if self.current_value() != "let":
             raise ValueError(
-                f"Expected let keyword in let statement, not {self.current_token().value}"
+                f"Expected let keyword in let statement, not {self.current_value()}"
             )
+        line = self.current_line()
         self.advance()  # consume "let"
-        var_name_token = self.current_token()
-        if var_name_token.type != "identifier":
+        if self.current_type() != IDENTIFIER:
             raise ValueError(
-                f"Variable name token {var_name_token.value} is type {var_name_token.type}, not identifier"
+                f"Variable name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
             )
+        var_name_token = self.current_token()
         self.advance()  # consume varName
         array_index = None
-        if self.current_token().value == "[":
+        if self.current_value() == "[":
             # assigning to index of array
             self.advance()  # consume "["
             array_index = self.compile_expression()
             # after expression for array index, expect "]"
-            if self.current_token().value != "]":
+            if self.current_value() != "]":
                 raise ValueError(
                     f"Expected ] after expression for array index in let statement"
                 )
             self.advance()  # consume "]"
         # Next token in let statement must be '='
-        if self.current_token().value != "=":
+        if self.current_value() != "=":
             raise ValueError(
-                f"Expected = after variable name in let statement, not {self.current_token().value}"
+                f"Expected = after variable name in let statement, not {self.current_value()}"
             )
         self.advance()  # consume "="
         expression = self.compile_expression()
-        if self.current_token().value != ";":
+        if self.current_value() != ";":
             raise ValueError(f"Expected ; after expression in let statement")
         self.advance()  # consume ";"
 
@@ -731,71 +888,75 @@ class JackCompiler:
             var_name_token=var_name_token,
             array_index=array_index,
             expression=expression,
+            line=line,
         )
 
     # 'do' subroutineCall ';'
     def compile_do_statement(self) -> DoStatement:
         # to get here, current token should be keyword "do"
-        if self.current_token().value != "do":
+        if self.current_value() != "do":
             raise ValueError(
-                f"Expected do keyword in do statement, not {self.current_token().value}"
+                f"Expected do keyword in do statement, not {self.current_value()}"
             )
+        line = self.current_line()
         self.advance()  # consume "do"
         subroutine_call = self.compile_subroutine_call()
-        if self.current_token().value != ";":
+        if self.current_value() != ";":
             raise ValueError(f"Expected ; after subroutine call in do statement")
         self.advance()  # consume ";"
-        return DoStatement(subroutine_call=subroutine_call)
+        return DoStatement(subroutine_call=subroutine_call, line=line)
 
     # 'return' expression? ';'
     def compile_return_statement(self) -> ReturnStatement:
         # to get here, current token should be keyword "return"
-        if self.current_token().value != "return":
+        if self.current_value() != "return":
             raise ValueError(
-                f"Expected return keyword in return statement, not {self.current_token().value}"
+                f"Expected return keyword in return statement, not {self.current_value()}"
             )
+        line = self.current_line()
         self.advance()  # consume "return"
         expression = None
-        if self.current_token().value != ";":
+        if self.current_value() != ";":
             expression = self.compile_expression()
-        if self.current_token().value != ";":
+        if self.current_value() != ";":
             raise ValueError(f"Expected ; after expression in return statement")
         self.advance()  # consume ";"
-        return ReturnStatement(expression=expression)
+        return ReturnStatement(expression=expression, line=line)
 
     # 'if' '(' expression ')' '{' statements '}' ('else' '{' statements '}')?
     def compile_if_statement(self) -> IfStatement:
         # to get here, current token should be keyword "if"
-        if self.current_token().value != "if":
+        if self.current_value() != "if":
             raise ValueError(
-                f"Expected if keyword in if statement, not {self.current_token().value}"
+                f"Expected if keyword in if statement, not {self.current_value()}"
             )
+        line = self.current_line()
         self.advance()  # consume "if"
-        if self.current_token().value != "(":
+        if self.current_value() != "(":
             raise ValueError(f"Expected ( after if keyword in if statement")
         self.advance()  # consume "("
 
         condition = self.compile_expression()
 
-        if self.current_token().value != ")":
+        if self.current_value() != ")":
             raise ValueError(f"Expected ) after condition in if statement")
         self.advance()  # consume ")"
 
-        if self.current_token().value != "{":
+        if self.current_value() != "{":
             raise ValueError("Expected { at start of statements block in if statement")
         self.advance()  # consume "{" at start of statements block
 
         then_statements = self.compile_statements()
 
-        if self.current_token().value != "}":
+        if self.current_value() != "}":
             raise ValueError("Expected } at end of statements block in if statement")
         self.advance()  # consume "}" at end of statements block
 
         else_statements = None
-        if self.current_token().value == "else":
+        if self.current_value() == "else":
             self.advance()  # consume "else"
 
-            if self.current_token().value != "{":
+            if self.current_value() != "{":
                 raise ValueError(
                     "Expected { at start of statements block in else statement"
                 )
@@ -803,7 +964,7 @@ class JackCompiler:
 
             else_statements = self.compile_statements()
 
-            if self.current_token().value != "}":
+            if self.current_value() != "}":
                 raise ValueError(
                     "Expected } at end of statements block in else statement"
                 )
@@ -813,27 +974,29 @@ class JackCompiler:
             condition=condition,
             then_statements=then_statements,
             else_statements=else_statements,
+            line=line,
         )
 
     # 'while' '(' expression ')' '{' statements '}'
     def compile_while_statement(self) -> WhileStatement:
         # to get here, current token should be keyword "while"
-        if self.current_token().value != "while":
+        if self.current_value() != "while":
             raise ValueError(
-                f"Expected while keyword in while statement, not {self.current_token().value}"
+                f"Expected while keyword in while statement, not {self.current_value()}"
             )
+        line = self.current_line()
         self.advance()  # consume "while"
-        if self.current_token().value != "(":
+        if self.current_value() != "(":
             raise ValueError(f"Expected ( after while keyword in while statement")
         self.advance()  # consume "("
 
         condition = self.compile_expression()
 
-        if self.current_token().value != ")":
+        if self.current_value() != ")":
             raise ValueError(f"Expected ) after condition in while statement")
         self.advance()  # consume ")"
 
-        if self.current_token().value != "{":
+        if self.current_value() != "{":
             raise ValueError(
                 "Expected { at start of statements block in while statement"
             )
@@ -841,15 +1004,15 @@ class JackCompiler:
 
         body = self.compile_statements()
 
-        if self.current_token().value != "}":
+        if self.current_value() != "}":
             raise ValueError("Expected } at end of statements block in while statement")
         self.advance()  # consume "}" at end of statements block
 
-        return WhileStatement(condition=condition, body=body)
+        return WhileStatement(condition=condition, body=body, line=line)
 
     # statement*
     def compile_statements(self) -> Statements:
-        statements = Statements(statements=[])
+        statements = []
         # Statements always appear between "{" and "}" and
         # begin with one of five keywords, one for each of the five types
         # of statements: let, do, return, if, while.
@@ -857,104 +1020,104 @@ class JackCompiler:
         # consuming '{' and '}'. Here we just look for "}" to recognize
         # when we have finished consuming the statements in a statements block.
 
-        while self.current_token().value != "}":
-            if self.current_token().value == "let":
-                statements.statements.append(self.compile_let_statement())
-            elif self.current_token().value == "do":
-                statements.statements.append(self.compile_do_statement())
-            elif self.current_token().value == "return":
-                statements.statements.append(self.compile_return_statement())
-            elif self.current_token().value == "if":
-                statements.statements.append(self.compile_if_statement())
-            elif self.current_token().value == "while":
-                statements.statements.append(self.compile_while_statement())
+        while self.current_value() != "}":
+            if self.current_value() == "let":
+                statements.append(self.compile_let_statement())
+            elif self.current_value() == "do":
+                statements.append(self.compile_do_statement())
+            elif self.current_value() == "return":
+                statements.append(self.compile_return_statement())
+            elif self.current_value() == "if":
+                statements.append(self.compile_if_statement())
+            elif self.current_value() == "while":
+                statements.append(self.compile_while_statement())
             else:
                 raise ValueError(
-                    f"Statement begins with {self.current_token().value}, not let|do|return|if|while"
+                    f"Statement begins with {self.current_value()}, not let|do|return|if|while"
                 )
 
-        return statements
+        return Statements(statements=tuple(statements))
 
     # Compile program structure
     def compile_variable_declaration(self) -> VariableDeclaration:
         # to get here, current token should be keyword "var"
-        if self.current_token().value != "var":
+        if self.current_value() != "var":
             raise ValueError(
-                f"Expected var keyword in variable declaration, not {self.current_token().value}"
+                f"Expected var keyword in variable declaration, not {self.current_value()}"
             )
         self.advance()  # consume "var"
-        type_token = self.current_token()
         if (
-            type_token.value not in ["int", "char", "boolean"]
-            and self.current_token().type != "identifier"
+            self.current_value() not in ["int", "char", "boolean"]
+            and self.current_type() != IDENTIFIER
         ):
             raise ValueError(
                 f"Variable type token must be int, char, boolean, or identifier"
             )
+        type_token = self.current_token()
         self.advance()  # consume type token
-        first_var_name_token = self.current_token()
-        if first_var_name_token.type != "identifier":
+        if self.current_type() != IDENTIFIER:
             raise ValueError(
-                f"Variable name token {first_var_name_token.value} is type {first_var_name_token.type}, not identifier"
+                f"Variable name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
             )
+        first_var_name_token = self.current_token()
         self.advance()  # consume variable name token
         # Optionally, you can declare multiple variable names of the same time in one declaration
         other_var_name_tokens = []
-        while self.current_token().value == ",":
+        while self.current_value() == ",":
             self.advance()  # consume ","
-            if self.current_token().type != "identifier":
+            if self.current_type() != IDENTIFIER:
                 raise ValueError(
-                    f"Variable name token {self.current_token().value} is type {self.current_token().type}, not identifier"
+                    f"Variable name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
                 )
             other_var_name_tokens.append(self.current_token())
             self.advance()  # consume variable name token
 
-        if self.current_token().value != ";":
+        if self.current_value() != ";":
             raise ValueError("Expected ; token to end variable declaration")
         self.advance()  # consume ";"
 
         return VariableDeclaration(
             type_token=type_token,
             first_var_name_token=first_var_name_token,
-            other_var_name_tokens=other_var_name_tokens,
+            other_var_name_tokens=tuple(other_var_name_tokens),
         )
 
     def compile_subroutine_body(self) -> SubroutineBody:
         # to get here, current token should be symbol "{"
-        if self.current_token().value != "{":
+        if self.current_value() != "{":
             raise ValueError("Expected { token to start subroutine body")
         self.advance()  # consume "{"
 
         variable_declarations = []
-        while self.current_token().value == "var":
+        while self.current_value() == "var":
             variable_declarations.append(self.compile_variable_declaration())
 
         statements = self.compile_statements()
 
-        if self.current_token().value != "}":
+        if self.current_value() != "}":
             raise ValueError("Expected } token to end subroutine body")
         self.advance()  # consume "}"
 
         return SubroutineBody(
-            variable_declarations=variable_declarations, statements=statements
+            variable_declarations=tuple(variable_declarations), statements=statements
         )
 
     def compile_parameter(self) -> Parameter:
         # to get here, current token should be keyword "int" or "char" or "boolean" or identifier
         if (
-            self.current_token().value not in ["int", "char", "boolean"]
-            and self.current_token().type != "identifier"
+            self.current_value() not in ["int", "char", "boolean"]
+            and self.current_type() != IDENTIFIER
         ):
             raise ValueError(
                 f"Parameter type token must be int, char, boolean, or identifier"
             )
         type_token = self.current_token()
         self.advance()  # consume parameter type token
-        variable_name_token = self.current_token()
-        if variable_name_token.type != "identifier":
+        if self.current_type() != IDENTIFIER:
             raise ValueError(
-                f"Variable name token {variable_name_token.value} is type {variable_name_token.type}, not identifier"
+                f"Variable name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
             )
+        variable_name_token = self.current_token()
         self.advance()  # consume variable name token
         return Parameter(type_token=type_token, variable_name_token=variable_name_token)
 
@@ -962,44 +1125,44 @@ class JackCompiler:
         parameters = []
         # To get here, subroutine should have at least one parameter
         parameters.append(self.compile_parameter())
-        while self.current_token().value == ",":
+        while self.current_value() == ",":
             self.advance()  # consume ","
             parameters.append(self.compile_parameter())
-        return ParameterList(parameters=parameters)
+        return ParameterList(parameters=tuple(parameters))
 
     def compile_subroutine_declaration(self) -> SubroutineDeclaration:
         # to get here, current token should be keyword "constructor" or "function" or "method"
-        if self.current_token().value not in ["constructor", "function", "method"]:
+        if self.current_value() not in ["constructor", "function", "method"]:
             raise ValueError(
                 f"Expected keyword constructor, function, or method at subroutine declaration start"
             )
         subroutine_kind_token = self.current_token()
         self.advance()  # consume subroutine kind token
 
-        return_type_token = self.current_token()
         if (
-            return_type_token.value not in ["void", "int", "char", "boolean"]
-            and return_type_token.type != "identifier"
+            self.current_value() not in ["void", "int", "char", "boolean"]
+            and self.current_type() != IDENTIFIER
         ):
             raise ValueError(
                 f"Return type token must be void, int, char, boolean, or identifier"
             )
+        return_type_token = self.current_token()
         self.advance()  # consume return type token
 
-        name_token = self.current_token()
-        if name_token.type != "identifier":
+        if self.current_type() != IDENTIFIER:
             raise ValueError(
-                f"Subroutine name token {name_token.value} is type {name_token.type}, not identifier"
+                f"Subroutine name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
             )
+        name_token = self.current_token()
         self.advance()  # consume subroutine name token
 
-        if self.current_token().value != "(":
+        if self.current_value() != "(":
             raise ValueError(f"Expected ( after subroutine name {name_token.value}")
         self.advance()  # consume "("
-        parameter_list = ParameterList(parameters=[])
-        if self.current_token().value != ")":
+        parameter_list = ParameterList()
+        if self.current_value() != ")":
             parameter_list = self.compile_parameter_list()
-        if self.current_token().value != ")":
+        if self.current_value() != ")":
             raise ValueError(
                 f"Expected ) after parameter list in subroutine declaration"
             )
@@ -1017,40 +1180,40 @@ class JackCompiler:
 
     def compile_class_variable_declaration(self) -> ClassVariableDeclaration:
         # to get here, current token should be keyword "static" or "field"
-        if self.current_token().value not in ["static", "field"]:
+        if self.current_value() not in ["static", "field"]:
             raise ValueError(
                 f"Expected keyword static or field at class variable declaration start"
             )
         class_variable_kind_token = self.current_token()
         self.advance()  # consume class variable kind token
 
-        type_token = self.current_token()
         if (
-            type_token.value not in ["int", "char", "boolean"]
-            and self.current_token().type != "identifier"
+            self.current_value() not in ["int", "char", "boolean"]
+            and self.current_type() != IDENTIFIER
         ):
             raise ValueError(
                 f"Variable type token must be int, char, boolean, or identifier"
             )
+        type_token = self.current_token()
         self.advance()  # consume type token
-        first_var_name_token = self.current_token()
-        if first_var_name_token.type != "identifier":
+        if self.current_type() != IDENTIFIER:
             raise ValueError(
-                f"Variable name token {first_var_name_token.value} is type {first_var_name_token.type}, not identifier"
+                f"Variable name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
             )
+        first_var_name_token = self.current_token()
         self.advance()  # consume variable name token
         # Optionally, you can declare multiple variable names of the same time in one declaration
         other_var_name_tokens = []
-        while self.current_token().value == ",":
+        while self.current_value() == ",":
             self.advance()  # consume ","
-            if self.current_token().type != "identifier":
+            if self.current_type() != IDENTIFIER:
                 raise ValueError(
-                    f"Variable name token {self.current_token().value} is type {self.current_token().type}, not identifier"
+                    f"Variable name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
                 )
             other_var_name_tokens.append(self.current_token())
             self.advance()  # consume variable name token
 
-        if self.current_token().value != ";":
+        if self.current_value() != ";":
             raise ValueError("Expected ; token to end class variable declaration")
         self.advance()  # consume ";"
 
@@ -1058,44 +1221,41 @@ class JackCompiler:
             class_variable_kind_token=class_variable_kind_token,
             type_token=type_token,
             first_var_name_token=first_var_name_token,
-            other_var_name_tokens=other_var_name_tokens,
+            other_var_name_tokens=tuple(other_var_name_tokens),
         )
 
     def compile_class(self) -> Class:
         # to get here, current token should be keyword "class"
-        if self.current_token().value != "class":
+        if self.current_value() != "class":
             raise ValueError(f"Expected keyword class at class start")
         self.advance()  # consume "class"
 
-        name_token = self.current_token()
-        if name_token.type != "identifier":
+        if self.current_type() != IDENTIFIER:
             raise ValueError(
-                f"Class name token {name_token.value} is type {name_token.type}, not identifier"
+                f"Class name token {self.current_value()} is type {token_types[self.current_type()]}, not identifier"
             )
+        name_token = self.current_token()
         self.advance()  # consume class name token
 
-        if self.current_token().value != "{":
+        if self.current_value() != "{":
             raise ValueError("Expected { token to start class body")
         self.advance()  # consume "{"
 
         class_variable_declarations = []
-        while (
-            self.current_token().value == "static"
-            or self.current_token().value == "field"
-        ):
+        while self.current_value() == "static" or self.current_value() == "field":
             class_variable_declarations.append(
                 self.compile_class_variable_declaration()
             )
 
         subroutine_declarations = []
         while (
-            self.current_token().value == "constructor"
-            or self.current_token().value == "function"
-            or self.current_token().value == "method"
+            self.current_value() == "constructor"
+            or self.current_value() == "function"
+            or self.current_value() == "method"
         ):
             subroutine_declarations.append(self.compile_subroutine_declaration())
 
-        if self.current_token().value != "}":
+        if self.current_value() != "}":
             raise ValueError("Expected } token to end class body")
         self.advance()  # consume "}"
 
@@ -1106,15 +1266,15 @@ class JackCompiler:
 
         return Class(
             name_token=name_token,
-            class_variable_declarations=class_variable_declarations,
-            subroutine_declarations=subroutine_declarations,
+            class_variable_declarations=tuple(class_variable_declarations),
+            subroutine_declarations=tuple(subroutine_declarations),
         )
 
 
 # Emitters
 
 # Code to emit VM code
-# Writes different VM statements as strings
+# Writes different VM statements as lists of VMInstructions (see vm_ir.py)
 segments = [
     "argument",
     "local",
@@ -1147,9 +1307,23 @@ SymbolRecordKind = Literal[
 ]
 
 
+# VMWriter: appends each vm command written to its buffer, instructions,
+# as a VMInstruction from the jack line being compiled (jack_line). Code
+# generation writes every command straight to the buffer, so no code is
+# copied from one list to another as the nodes it came from are nested.
 class VMWriter:
-    @staticmethod
-    def write_push(segment: str, index: int, include_newline: bool = True) -> str:
+    instructions: list[VMInstruction]
+    jack_line: int
+
+    def __init__(self):
+        self.instructions = []
+        self.jack_line = 0
+
+    def write_instruction(self, instruction: VMInstruction):
+        instruction.jack_line = self.jack_line
+        self.instructions.append(instruction)
+
+    def write_push(self, segment: str, index: int):
         if segment not in segments:
             raise ValueError(f"Cannot write vm code: invalid segment {segment}")
         if index < 0:
@@ -1164,13 +1338,11 @@ class VMWriter:
             raise ValueError(f"Cannot write vm code: temp {index} is greater than 7")
         if segment == "uart" and index > 2:
             raise ValueError(f"Cannot write vm code: uart {index} is greater than 2")
-        result = f"push {segment} {index}"
-        if include_newline:
-            result += "\n"
-        return result
+        self.write_instruction(
+            VMInstruction(Opcode.PUSH, Segment(segment), operand=index)
+        )
 
-    @staticmethod
-    def write_pop(segment: str, index: int, include_newline: bool = True) -> str:
+    def write_pop(self, segment: str, index: int):
         if segment not in segments:
             raise ValueError(f"Cannot write vm code: invalid segment {segment}")
         if index < 0:
@@ -1183,85 +1355,68 @@ class VMWriter:
             raise ValueError(f"Cannot write vm code: temp {index} is greater than 7")
         if segment == "uart" and index > 2:
             raise ValueError(f"Cannot write vm code: uart {index} is greater than 2")
-        result = f"pop {segment} {index}"
-        if include_newline:
-            result += "\n"
-        return result
+        self.write_instruction(
+            VMInstruction(Opcode.POP, Segment(segment), operand=index)
+        )
 
-    @staticmethod
-    def write_arithmetic(command: str, include_newline: bool = True) -> str:
+    def write_arithmetic(self, command: str):
         if command not in arithmetic_commands:
             raise ValueError(
                 f"Cannot write vm code: invalid arithmetic command {command}"
             )
-        result = f"{command}"
-        if include_newline:
-            result += "\n"
-        return result
+        self.write_instruction(VMInstruction(Opcode(command)))
 
-    @staticmethod
-    def write_label(label: str, include_newline: bool = True) -> str:
+    def write_label(self, label: str):
         if label == "":
             raise ValueError(f"Cannot write vm code: label cannot be empty")
-        result = f"label {label}"
-        if include_newline:
-            result += "\n"
-        return result
+        self.write_instruction(VMInstruction(Opcode.LABEL, name=label))
 
-    @staticmethod
-    def write_goto(label: str, include_newline: bool = True) -> str:
+    def write_goto(self, label: str):
         if label == "":
             raise ValueError(f"Cannot write vm code: label cannot be empty")
-        result = f"goto {label}"
-        if include_newline:
-            result += "\n"
-        return result
+        self.write_instruction(VMInstruction(Opcode.GOTO, name=label))
 
-    @staticmethod
-    def write_if_goto(label: str, include_newline: bool = True) -> str:
+    def write_if_goto(self, label: str):
         if label == "":
             raise ValueError(f"Cannot write vm code: label cannot be empty")
-        result = f"if-goto {label}"
-        if include_newline:
-            result += "\n"
-        return result
+        self.write_instruction(VMInstruction(Opcode.IF_GOTO, name=label))
 
-    @staticmethod
+    # uninitialized_locals are the locals the function assigns before
+    # reading (see write_local_variables in vm/translator.py)
     def write_function(
-        function_name: str, number_of_local_variables: int, include_newline: bool = True
-    ) -> str:
+        self,
+        function_name: str,
+        number_of_local_variables: int,
+        uninitialized_locals: Optional[list[int]] = None,
+    ):
         if function_name == "":
             raise ValueError(f"Cannot write vm code: function name cannot be empty")
         if number_of_local_variables < 0:
             raise ValueError(
                 f"Cannot write vm code: number of local variables cannot be negative"
             )
-        result = f"function {function_name} {number_of_local_variables}"
-        if include_newline:
-            result += "\n"
-        return result
-
-    @staticmethod
-    def write_call(
-        function_name: str, number_of_arguments: int, include_newline: bool = True
-    ) -> str:
+        self.write_instruction(
+            VMInstruction(
+                Opcode.FUNCTION,
+                name=function_name,
+                operand=number_of_local_variables,
+                uninitialized_locals=tuple(uninitialized_locals or []),
+            )
+        )
+
+    def write_call(self, function_name: str, number_of_arguments: int):
         if function_name == "":
             raise ValueError(f"Cannot write vm code: function name cannot be empty")
         if number_of_arguments < 0:
             raise ValueError(
                 f"Cannot write vm code: number of arguments cannot be negative"
             )
-        result = f"call {function_name} {number_of_arguments}"
-        if include_newline:
-            result += "\n"
-        return result
+        self.write_instruction(
+            VMInstruction(Opcode.CALL, name=function_name, operand=number_of_arguments)
+        )
 
-    @staticmethod
-    def write_return(include_newline: bool = True) -> str:
-        result = f"return"
-        if include_newline:
-            result += "\n"
-        return result
+    def write_return(self):
+        self.write_instruction(VMInstruction(Opcode.RETURN))
 
 
 # SymbolTable class: manage lookup for addresses of identifiers
@@ -1316,6 +1471,110 @@ class SymbolTable:
         return record.index if record else None
 
 
+# Definite assignment analysis
+#
+# A local variable is definitely assigned at a statement if every path
+# through the subroutine to that statement assigns it with let. A local that
+# is only ever read where it is definitely assigned never needs the 0 that
+# the vm function command gives it, so the translator can skip setting it.
+
+
+# Names of the variables (of any kind) an expression or term reads
+def names_read_by_expression(node: Expression) -> set[str]:
+    names = names_read_by_term(node.first_term)
+    for _, term in node.other_terms:
+        names |= names_read_by_term(term)
+    return names
+
+
+def names_read_by_term(node: Term) -> set[str]:
+    match node:
+        case VarName():
+            return {node.token.value}
+        case ArrayAccess():
+            return {node.array_name_token.value} | names_read_by_expression(
+                node.array_index
+            )
+        case ParentheticalExpression():
+            return names_read_by_expression(node.expression)
+        case UnaryOpTerm():
+            return names_read_by_term(node.term_to_operate_on)
+        case SubroutineCall():
+            # A receiver that is a variable (not a class name) is read too
+            names = (
+                {node.receiver_name_token.value} if node.receiver_name_token else set()
+            )
+            for expression in node.expression_list.expressions:
+                names |= names_read_by_expression(expression)
+            return names
+        case _:
+            return set()
+
+
+# Names definitely assigned after statements run, given the names assigned
+# before them, or None if the statements always return. Names the
+# statements may read before they are assigned are added to
+# read_before_assigned.
+def names_assigned_after_statements(
+    node: Statements, assigned: set[str], read_before_assigned: set[str]
+) -> Optional[set[str]]:
+    for statement in node.statements:
+        assigned = names_assigned_after_statement(
+            statement, assigned, read_before_assigned
+        )
+        if assigned is None:
+            # The statements after a return never run
+            return None
+    return assigned
+
+
+def names_assigned_after_statement(
+    node: Statement, assigned: set[str], read_before_assigned: set[str]
+) -> Optional[set[str]]:
+    match node:
+        case LetStatement():
+            read_before_assigned |= names_read_by_expression(node.expression) - assigned
+            if node.array_index is not None:
+                # let a[i] = ... reads a and i, and assigns no variable
+                read_before_assigned |= (
+                    {node.var_name_token.value}
+                    | names_read_by_expression(node.array_index)
+                ) - assigned
+                return assigned
+            return assigned | {node.var_name_token.value}
+        case DoStatement():
+            read_before_assigned |= names_read_by_term(node.subroutine_call) - assigned
+            return assigned
+        case ReturnStatement():
+            if node.expression is not None:
+                read_before_assigned |= (
+                    names_read_by_expression(node.expression) - assigned
+                )
+            return None
+        case IfStatement():
+            read_before_assigned |= names_read_by_expression(node.condition) - assigned
+            assigned_after_then = names_assigned_after_statements(
+                node.then_statements, assigned, read_before_assigned
+            )
+            assigned_after_else = assigned
+            if node.else_statements is not None:
+                assigned_after_else = names_assigned_after_statements(
+                    node.else_statements, assigned, read_before_assigned
+                )
+            if assigned_after_then is None:
+                return assigned_after_else
+            if assigned_after_else is None:
+                return assigned_after_then
+            return assigned_after_then & assigned_after_else
+        case WhileStatement():
+            # The body may run no times, so assigns nothing definitely
+            read_before_assigned |= names_read_by_expression(node.condition) - assigned
+            names_assigned_after_statements(node.body, assigned, read_before_assigned)
+            return assigned
+        case _:
+            raise ValueError(f"Unexpected statement type {type(node)}")
+
+
 # VMGenerator: walks the JackCompiler output tree,
 # writing vm code for the different constructs
 class VMGenerator:
@@ -1348,86 +1607,72 @@ class VMGenerator:
         # across different files/classes
         return
 
-    def generate_vm_code_for_integer_constant(self, node: IntegerConstant) -> str:
-        return self.vm_writer.write_push("constant", int(node.token.value))
+    def generate_vm_code_for_integer_constant(self, node: IntegerConstant):
+        self.vm_writer.write_push("constant", int(node.token.value))
 
-    def generate_vm_code_for_keyword_constant(self, node: KeywordConstant) -> str:
-        result = ""
+    def generate_vm_code_for_keyword_constant(self, node: KeywordConstant):
         if node.token.value == "true":
-            result += self.vm_writer.write_push("constant", 1)
-            result += self.vm_writer.write_arithmetic("neg")
+            self.vm_writer.write_push("constant", 1)
+            self.vm_writer.write_arithmetic("neg")
         elif node.token.value == "false":
-            result += self.vm_writer.write_push("constant", 0)
+            self.vm_writer.write_push("constant", 0)
         elif node.token.value == "null":
-            result += self.vm_writer.write_push("constant", 0)
+            self.vm_writer.write_push("constant", 0)
         elif node.token.value == "this":
-            result += self.vm_writer.write_push("pointer", 0)
+            self.vm_writer.write_push("pointer", 0)
         else:
             raise ValueError(f"Unknown keyword constant {node.token.value}")
-        return result
 
     # I *think* what this does is use a system call to allocate a string
     # in the heap, then put the pointer to that string on the stack.
     # I won't be able to run this code until I actually have an implementation
     # of String.new and String.append.
-    def generate_vm_code_for_string_constant(self, node: StringConstant) -> str:
+    def generate_vm_code_for_string_constant(self, node: StringConstant):
         text = node.token.value
         number_of_chars = len(text)
         number_of_chars_integer_constant = IntegerConstant(
             token=Token(type="integerConstant", value=str(number_of_chars))
         )
-        result = self.generate_vm_code_for_integer_constant(
-            number_of_chars_integer_constant
-        )
-        result += self.vm_writer.write_call("String.new", 1)
+        self.generate_vm_code_for_integer_constant(number_of_chars_integer_constant)
+        self.vm_writer.write_call("String.new", 1)
         for char in text:
             if not (0 <= ord(char) <= 255):
                 raise ValueError(
                     f"Unsupported non-ASCII character {char} in string constant"
                 )
-            result += self.vm_writer.write_push("constant", ord(char))
-            result += self.vm_writer.write_call("String.appendChar", 2)
-        return result
+            self.vm_writer.write_push("constant", ord(char))
+            self.vm_writer.write_call("String.appendChar", 2)
 
     # Generate vm code for a string constant in the table
-    def generate_vm_code_for_string_constant_in_table(
-        self, node: StringConstant
-    ) -> str:
+    def generate_vm_code_for_string_constant_in_table(self, node: StringConstant):
         if node.token not in self.string_literals_table:
             raise ValueError(
                 f"String constant {node.token.value} not found in string literals table"
             )
         string_literal_position_info = self.string_literals_table[node.token]
-        result = self.vm_writer.write_push(
-            "constant", string_literal_position_info.address
-        )
-        result += self.vm_writer.write_push(
-            "constant", string_literal_position_info.length
-        )
-        result += self.vm_writer.write_call("String.newFromTable", 2)
-        return result
+        self.vm_writer.write_push("constant", string_literal_position_info.address)
+        self.vm_writer.write_push("constant", string_literal_position_info.length)
+        self.vm_writer.write_call("String.newFromTable", 2)
 
     def generate_vm_code_for_parenthetical_expression(
         self, node: ParentheticalExpression
-    ) -> str:
-        return self.generate_vm_code_for_expression(node.expression)
+    ):
+        self.generate_vm_code_for_expression(node.expression)
 
-    def generate_vm_code_for_unary_op_term(self, node: UnaryOpTerm) -> str:
-        result = self.generate_vm_code_for_term(node.term_to_operate_on)
-        result += self.generate_vm_code_for_unary_operator(node.op_token)
-        return result
+    def generate_vm_code_for_unary_op_term(self, node: UnaryOpTerm):
+        self.generate_vm_code_for_term(node.term_to_operate_on)
+        self.generate_vm_code_for_unary_operator(node.op_token)
 
-    def generate_vm_code_for_unary_operator(self, operator_token: Token) -> str:
+    def generate_vm_code_for_unary_operator(self, operator_token: Token):
         match operator_token.value:
             case "-":
-                return self.vm_writer.write_arithmetic("neg")
+                self.vm_writer.write_arithmetic("neg")
             case "~":
-                return self.vm_writer.write_arithmetic("not")
+                self.vm_writer.write_arithmetic("not")
             case _:
                 raise ValueError(f"Unknown unary operator {operator_token.value}")
 
-    def generate_vm_code_for_var_name(self, node: VarName) -> str:
-        result = ""
+    def generate_vm_code_for_var_name(self, node: VarName):
         variable_name = node.token.value
         variable_kind = self.subroutine_symbol_table.kind_of(variable_name)
         variable_index = self.subroutine_symbol_table.index_of(variable_name)
@@ -1444,83 +1689,78 @@ class VMGenerator:
                 f"Variable {variable_name} index is None. Missing declaration?"
             )
         if variable_kind == "static":
-            result += self.vm_writer.write_push("static", variable_index)
+            self.vm_writer.write_push("static", variable_index)
         elif variable_kind == "field":
-            result += self.vm_writer.write_push("this", variable_index)
+            self.vm_writer.write_push("this", variable_index)
         elif variable_kind == "argument":
-            result += self.vm_writer.write_push("argument", variable_index)
+            self.vm_writer.write_push("argument", variable_index)
         elif variable_kind == "local":
-            result += self.vm_writer.write_push("local", variable_index)
+            self.vm_writer.write_push("local", variable_index)
         else:
             raise ValueError(f"Unknown variable kind {variable_kind}")
-        return result
 
-    def generate_vm_code_for_term(self, node: Term) -> str:
+    def generate_vm_code_for_term(self, node: Term):
         match node:
             case IntegerConstant():
-                return self.generate_vm_code_for_integer_constant(node)
+                self.generate_vm_code_for_integer_constant(node)
             case KeywordConstant():
-                return self.generate_vm_code_for_keyword_constant(node)
+                self.generate_vm_code_for_keyword_constant(node)
             case VarName():
-                return self.generate_vm_code_for_var_name(node)
+                self.generate_vm_code_for_var_name(node)
             case StringConstant():
                 if node.token in self.string_literals_table:
-                    return self.generate_vm_code_for_string_constant_in_table(node)
+                    self.generate_vm_code_for_string_constant_in_table(node)
                 else:
-                    return self.generate_vm_code_for_string_constant(node)
+                    self.generate_vm_code_for_string_constant(node)
             case ParentheticalExpression():
-                return self.generate_vm_code_for_parenthetical_expression(node)
+                self.generate_vm_code_for_parenthetical_expression(node)
             case UnaryOpTerm():
-                return self.generate_vm_code_for_unary_op_term(node)
+                self.generate_vm_code_for_unary_op_term(node)
             case ArrayAccess():
-                return self.generate_vm_code_for_array_access(node)
+                self.generate_vm_code_for_array_access(node)
             case SubroutineCall():
-                return self.generate_vm_code_for_subroutine_call(node)
+                self.generate_vm_code_for_subroutine_call(node)
             case _:
                 # This should not be possible to reach, but include to
                 # guard against possible future edits that would add new terms
                 raise ValueError(f"Unknown term {node}")
 
-    def generate_vm_code_for_binary_operator(self, operator_token: Token) -> str:
+    def generate_vm_code_for_binary_operator(self, operator_token: Token):
         match operator_token.value:
             case "+":
-                return self.vm_writer.write_arithmetic("add")
+                self.vm_writer.write_arithmetic("add")
             case "-":
-                return self.vm_writer.write_arithmetic("sub")
+                self.vm_writer.write_arithmetic("sub")
             case "*":
-                return self.vm_writer.write_call("Math.multiply", 2)
+                self.vm_writer.write_call("Math.multiply", 2)
             case "/":
-                return self.vm_writer.write_call("Math.divide", 2)
+                self.vm_writer.write_call("Math.divide", 2)
             case "&":
-                return self.vm_writer.write_arithmetic("and")
+                self.vm_writer.write_arithmetic("and")
             case "|":
-                return self.vm_writer.write_arithmetic("or")
+                self.vm_writer.write_arithmetic("or")
             case "<":
-                return self.vm_writer.write_arithmetic("lt")
+                self.vm_writer.write_arithmetic("lt")
             case ">":
-                return self.vm_writer.write_arithmetic("gt")
+                self.vm_writer.write_arithmetic("gt")
             case "=":
-                return self.vm_writer.write_arithmetic("eq")
+                self.vm_writer.write_arithmetic("eq")
             case _:
                 raise ValueError(f"Unknown operator {operator_token.value}")
 
-    def generate_vm_code_for_expression(self, node: Expression) -> str:
-        result = ""
+    def generate_vm_code_for_expression(self, node: Expression):
         first_term = node.first_term
         other_terms = node.other_terms
-        result += self.generate_vm_code_for_term(first_term)
+        self.generate_vm_code_for_term(first_term)
         for operator_token, term in other_terms:
-            result += self.generate_vm_code_for_term(term)
-            result += self.generate_vm_code_for_binary_operator(operator_token)
-        return result
+            self.generate_vm_code_for_term(term)
+            self.generate_vm_code_for_binary_operator(operator_token)
 
-    def generate_vm_code_for_expression_list(self, node: ExpressionList) -> str:
-        result = ""
+    def generate_vm_code_for_expression_list(self, node: ExpressionList):
         for expression in node.expressions:
-            result += self.generate_vm_code_for_expression(expression)
-        return result
+            self.generate_vm_code_for_expression(expression)
 
-    def generate_vm_code_for_subroutine_call(self, node: SubroutineCall) -> str:
+    def generate_vm_code_for_subroutine_call(self, node: SubroutineCall):
         # Possibilities for receiver name
         #   1. Receiver is an object name in one of the symbol tables
         #         - Push address of object (parameter 0)
@@ -1540,7 +1780,6 @@ class VMGenerator:
         #         - Push each expression in expression list
         #         - Class name is receiver
         #         - Call ClassName.FunctionName len(expression_list)
-        result = ""
         receiver_name = (
             node.receiver_name_token.value if node.receiver_name_token else None
         )
@@ -1551,7 +1790,7 @@ class VMGenerator:
                 # constructor: both have valid (this) that must be parameter 0
                 # of the call
                 # Push 'this' (address of current object) as parameter 0
-                result += self.vm_writer.write_push("pointer", 0)
+                self.vm_writer.write_push("pointer", 0)
                 number_of_arguments_to_push += 1
             elif self.current_subroutine_kind not in ["function"]:
                 raise ValueError(
@@ -1559,16 +1798,14 @@ class VMGenerator:
                 )
 
             # Push each expression in expression_list
-            result += self.generate_vm_code_for_expression_list(node.expression_list)
+            self.generate_vm_code_for_expression_list(node.expression_list)
 
             # Class name is self.current_class_name
             full_name_to_call = (
                 f"{self.current_class_name}.{node.subroutine_name_token.value}"
             )
 
-            result += self.vm_writer.write_call(
-                full_name_to_call, number_of_arguments_to_push
-            )
+            self.vm_writer.write_call(full_name_to_call, number_of_arguments_to_push)
 
         elif receiver_name in self.subroutine_symbol_table.records:
             # Subroutine is a method of an object stored in a local
@@ -1584,16 +1821,16 @@ class VMGenerator:
                     f"Receiver {receiver_name} must be an argument or a local variable, not {receiver_kind}"
                 )
             receiver_index = self.subroutine_symbol_table.index_of(receiver_name)
-            result += self.vm_writer.write_push(receiver_kind, receiver_index)
+            self.vm_writer.write_push(receiver_kind, receiver_index)
 
             # Push each expression in expression_list
-            result += self.generate_vm_code_for_expression_list(node.expression_list)
+            self.generate_vm_code_for_expression_list(node.expression_list)
 
             # Class name is type from symbol table
             receiver_type = self.subroutine_symbol_table.type_of(receiver_name)
             full_name_to_call = f"{receiver_type}.{node.subroutine_name_token.value}"
 
-            result += self.vm_writer.write_call(
+            self.vm_writer.write_call(
                 full_name_to_call, len(node.expression_list.expressions) + 1
             )
         elif receiver_name in self.class_symbol_table.records:
@@ -1610,36 +1847,34 @@ class VMGenerator:
             if receiver_kind == "field":
                 receiver_kind = "this"
             receiver_index = self.class_symbol_table.index_of(receiver_name)
-            result += self.vm_writer.write_push(receiver_kind, receiver_index)
+            self.vm_writer.write_push(receiver_kind, receiver_index)
 
             # Push each expression in expression_list
-            result += self.generate_vm_code_for_expression_list(node.expression_list)
+            self.generate_vm_code_for_expression_list(node.expression_list)
 
             # Class name is type from symbol table
             receiver_type = self.class_symbol_table.type_of(receiver_name)
             full_name_to_call = f"{receiver_type}.{node.subroutine_name_token.value}"
 
-            result += self.vm_writer.write_call(
+            self.vm_writer.write_call(
                 full_name_to_call, len(node.expression_list.expressions) + 1
             )
         else:
             # Subroutine is a class-level function, not a method
 
             # Push each expression in expression_list
-            result += self.generate_vm_code_for_expression_list(node.expression_list)
+            self.generate_vm_code_for_expression_list(node.expression_list)
 
             # Class name is receiver_name
             full_name_to_call = f"{receiver_name}.{node.subroutine_name_token.value}"
 
             # Note: no base address to push, so do not call with "+ 1" arguments
-            result += self.vm_writer.write_call(
+            self.vm_writer.write_call(
                 full_name_to_call, len(node.expression_list.expressions)
             )
 
-        return result
-
     # Array access (rvalue ... lvalue array access handled in let statement)
-    def generate_vm_code_for_array_access(self, node: ArrayAccess) -> str:
+    def generate_vm_code_for_array_access(self, node: ArrayAccess):
         # Get base address of array from one of the symbol tables
         array_name = node.array_name_token.value
         array_kind = self.subroutine_symbol_table.kind_of(array_name)
@@ -1653,33 +1888,28 @@ class VMGenerator:
                 raise ValueError(
                     f"Array {array_name} not found in symbol tables. Missing declaration?"
                 )
-        result = self.vm_writer.write_push(array_kind, array_base_address_index)
-        result += self.generate_vm_code_for_expression(node.array_index)
-        result += self.vm_writer.write_arithmetic("add")
+        self.vm_writer.write_push(array_kind, array_base_address_index)
+        self.generate_vm_code_for_expression(node.array_index)
+        self.vm_writer.write_arithmetic("add")
 
         # Stack now as base address of the array element we want
         # Pop the address to set THAT base address, then push that[0] on stack
-        result += self.vm_writer.write_pop("pointer", 1)
-        result += self.vm_writer.write_push("that", 0)
-
-        return result
+        self.vm_writer.write_pop("pointer", 1)
+        self.vm_writer.write_push("that", 0)
 
     # Return statement
-    def generate_vm_code_for_return_statement(self, node: ReturnStatement) -> str:
-        result = ""
+    def generate_vm_code_for_return_statement(self, node: ReturnStatement):
         if node.expression != None:
-            result += self.generate_vm_code_for_expression(node.expression)
+            self.generate_vm_code_for_expression(node.expression)
         else:
             # No return result; convention is to return 0 in that case
-            result += self.vm_writer.write_push("constant", 0)
-        result += self.vm_writer.write_return()
-        return result
+            self.vm_writer.write_push("constant", 0)
+        self.vm_writer.write_return()
 
     # If statement
-    def generate_vm_code_for_if_statement(self, node: IfStatement) -> str:
-        result = ""
+    def generate_vm_code_for_if_statement(self, node: IfStatement):
         # Start by putting the result of the condition on the stack
-        result += self.generate_vm_code_for_expression(node.condition)
+        self.generate_vm_code_for_expression(node.condition)
         # Book suggests negating the condition. The idea is to jump to else if
         # condition is false, otherwise keep going for the if statements.
         # But ChatGPT points out that this fails of you ever have a condition
@@ -1690,27 +1920,24 @@ class VMGenerator:
         self.label_counter += 1
 
         # Goto true_label if condition is true, false_label otherwise
-        result += self.vm_writer.write_if_goto(true_label)
-        result += self.vm_writer.write_goto(false_label)
+        self.vm_writer.write_if_goto(true_label)
+        self.vm_writer.write_goto(false_label)
 
         # Next, the then statements (condition is true)
-        result += self.vm_writer.write_label(true_label)
-        result += self.generate_vm_code_for_statements(node.then_statements)
-        result += self.vm_writer.write_goto(end_label)
+        self.vm_writer.write_label(true_label)
+        self.generate_vm_code_for_statements(node.then_statements)
+        self.vm_writer.write_goto(end_label)
 
         # Next, the else statements (condition is false), if any
-        result += self.vm_writer.write_label(false_label)
+        self.vm_writer.write_label(false_label)
         if node.else_statements != None:
-            result += self.generate_vm_code_for_statements(node.else_statements)
+            self.generate_vm_code_for_statements(node.else_statements)
 
         # Output the label IF_END_N
-        result += self.vm_writer.write_label(end_label)
-
-        return result
+        self.vm_writer.write_label(end_label)
 
     # While statement
-    def generate_vm_code_for_while_statement(self, node: WhileStatement) -> str:
-        result = ""
+    def generate_vm_code_for_while_statement(self, node: WhileStatement):
         # First, set the label to return to
         start_label = f"WHILE_START_{self.label_counter}"
         true_label = f"WHILE_TRUE_{self.label_counter}"
@@ -1718,40 +1945,35 @@ class VMGenerator:
         self.label_counter += 1
 
         # Evaluate the condition
-        result += self.vm_writer.write_label(start_label)
-        result += self.generate_vm_code_for_expression(node.condition)
+        self.vm_writer.write_label(start_label)
+        self.generate_vm_code_for_expression(node.condition)
 
         # If the condition is true, jump to true label (do the body statements)
         # If false, loop is done; jump to end
-        result += self.vm_writer.write_if_goto(true_label)
-        result += self.vm_writer.write_goto(end_label)
+        self.vm_writer.write_if_goto(true_label)
+        self.vm_writer.write_goto(end_label)
 
         # Generate vm code for the body statements
-        result += self.vm_writer.write_label(true_label)
-        result += self.generate_vm_code_for_statements(node.body)
+        self.vm_writer.write_label(true_label)
+        self.generate_vm_code_for_statements(node.body)
 
         # Jump back to start of the while loop
-        result += self.vm_writer.write_goto(start_label)
+        self.vm_writer.write_goto(start_label)
 
         # Output the label WHILE_END_N
-        result += self.vm_writer.write_label(end_label)
-
-        return result
+        self.vm_writer.write_label(end_label)
 
     # Do statement
     # Do a system call and ignore the result
-    def generate_vm_code_for_do_statement(self, node: DoStatement) -> str:
-        result = ""
-        result += self.generate_vm_code_for_subroutine_call(node.subroutine_call)
+    def generate_vm_code_for_do_statement(self, node: DoStatement):
+        self.generate_vm_code_for_subroutine_call(node.subroutine_call)
         # Pop to temp 0 to ignore the subroutine's return value
-        result += self.vm_writer.write_pop("temp", 0)
-        return result
+        self.vm_writer.write_pop("temp", 0)
 
     # Let statement
-    def generate_vm_code_for_let_statement(self, node: LetStatement) -> str:
-        result = ""
+    def generate_vm_code_for_let_statement(self, node: LetStatement):
         # First, put the r-value (RHS expression) on the stack
-        result += self.generate_vm_code_for_expression(node.expression)
+        self.generate_vm_code_for_expression(node.expression)
 
         # Second, look up the l-value variable name in the symbol tables
         variable_name = node.var_name_token.value
@@ -1774,17 +1996,13 @@ class VMGenerator:
         if node.array_index == None:
             # No array index, so pop to wherever the variable is stored in RAM
             if variable_kind == "local":
-                result += self.vm_writer.write_pop("local", variable_base_address_index)
+                self.vm_writer.write_pop("local", variable_base_address_index)
             elif variable_kind == "argument":
-                result += self.vm_writer.write_pop(
-                    "argument", variable_base_address_index
-                )
+                self.vm_writer.write_pop("argument", variable_base_address_index)
             elif variable_kind == "static":
-                result += self.vm_writer.write_pop(
-                    "static", variable_base_address_index
-                )
+                self.vm_writer.write_pop("static", variable_base_address_index)
             elif variable_kind == "field":
-                result += self.vm_writer.write_pop("this", variable_base_address_index)
+                self.vm_writer.write_pop("this", variable_base_address_index)
             else:
                 raise ValueError(
                     f"Unexpected variable kind {variable_kind} for variable {variable_name}"
@@ -1793,67 +2011,82 @@ class VMGenerator:
             # Array index, so we must add this index to the base address to get
             # the address to pop to
             # Start by saving the top value of the stack, the r-value
-            result += self.vm_writer.write_pop("temp", 0)
+            self.vm_writer.write_pop("temp", 0)
 
             # Next, figure out the target address. For an array,
             # the entry in local/argument/static/field is the base address
             # push that onto the stack for starters
             if variable_kind == "local":
-                result += self.vm_writer.write_push(
-                    "local", variable_base_address_index
-                )
+                self.vm_writer.write_push("local", variable_base_address_index)
             elif variable_kind == "argument":
-                result += self.vm_writer.write_push(
-                    "argument", variable_base_address_index
-                )
+                self.vm_writer.write_push("argument", variable_base_address_index)
             elif variable_kind == "static":
-                result += self.vm_writer.write_push(
-                    "static", variable_base_address_index
-                )
+                self.vm_writer.write_push("static", variable_base_address_index)
             elif variable_kind == "field":
-                result += self.vm_writer.write_push("this", variable_base_address_index)
+                self.vm_writer.write_push("this", variable_base_address_index)
             else:
                 raise ValueError(
                     f"Unexpected variable kind {variable_kind} for variable {variable_name}"
                 )
             # Now add the offset to get the address
-            result += self.generate_vm_code_for_expression(node.array_index)
-            result += self.vm_writer.write_arithmetic("add")
+            self.generate_vm_code_for_expression(node.array_index)
+            self.vm_writer.write_arithmetic("add")
             # We have the address; update THAT by pushing to pointer 1
-            result += self.vm_writer.write_pop("pointer", 1)
+            self.vm_writer.write_pop("pointer", 1)
 
             # THAT segment index 0 is now where we want to push our result
             # Push the saved result to the stack and then pop it to that 0
             # (i.e., pop it to the target address)
-            result += self.vm_writer.write_push("temp", 0)
-            result += self.vm_writer.write_pop("that", 0)
-
-        return result
+            self.vm_writer.write_push("temp", 0)
+            self.vm_writer.write_pop("that", 0)
+
+    # Indices of the current subroutine's locals that are never read before
+    # they are definitely assigned (see names_assigned_after_statement)
+    def find_uninitialized_locals(self, node: SubroutineBody) -> list[int]:
+        read_before_assigned = set()
+        names_assigned_after_statements(node.statements, set(), read_before_assigned)
+        local_names = [
+            token.value
+            for variable_declaration in node.variable_declarations
+            for token in [
+                variable_declaration.first_var_name_token,
+                *variable_declaration.other_var_name_tokens,
+            ]
+        ]
+        return sorted(
+            self.subroutine_symbol_table.index_of(name)
+            for name in local_names
+            if name not in read_before_assigned
+        )
 
     # Statement
-    def generate_vm_code_for_statement(self, node: Statement) -> str:
-        result = ""
+    # The instructions written for the statement, except those of the
+    # statements nested in it (which have their own), get its line as their
+    # jack line, which vm/translator.py carries through to the assembler as
+    # source locations
+    def generate_vm_code_for_statement(self, node: Statement):
+        enclosing_jack_line = self.vm_writer.jack_line
+        if node.line:
+            self.vm_writer.jack_line = node.line
         match node:
             case ReturnStatement():
-                result += self.generate_vm_code_for_return_statement(node)
+                self.generate_vm_code_for_return_statement(node)
             case IfStatement():
-                result += self.generate_vm_code_for_if_statement(node)
+                self.generate_vm_code_for_if_statement(node)
             case WhileStatement():
-                result += self.generate_vm_code_for_while_statement(node)
+                self.generate_vm_code_for_while_statement(node)
             case LetStatement():
-                result += self.generate_vm_code_for_let_statement(node)
+                self.generate_vm_code_for_let_statement(node)
             case DoStatement():
-                result += self.generate_vm_code_for_do_statement(node)
+                self.generate_vm_code_for_do_statement(node)
             case _:
                 raise ValueError(f"Unexpected statement type {type(node)}")
-        return result
+        self.vm_writer.jack_line = enclosing_jack_line
 
     # Statements
-    def generate_vm_code_for_statements(self, node: Statements) -> str:
-        result = ""
+    def generate_vm_code_for_statements(self, node: Statements):
         for statement in node.statements:
-            result += self.generate_vm_code_for_statement(statement)
-        return result
+            self.generate_vm_code_for_statement(statement)
 
     # varDec
     # This populates the symbol table for local variables.
@@ -1874,9 +2107,8 @@ class VMGenerator:
     # subroutineBody
     # Note: symbol table for local variable declarations populated in
     # generate_vm_code_for_subroutine_declaration
-    def generate_vm_code_for_subroutine_body(self, node: SubroutineBody) -> str:
-        result = self.generate_vm_code_for_statements(node.statements)
-        return result
+    def generate_vm_code_for_subroutine_body(self, node: SubroutineBody):
+        self.generate_vm_code_for_statements(node.statements)
 
     # parameterList
     # Defines "argument" symbols in subroutine symbol table
@@ -1898,9 +2130,7 @@ class VMGenerator:
         return
 
     # subroutineDec
-    def generate_vm_code_for_subroutine_declaration(
-        self, node: SubroutineDeclaration
-    ) -> str:
+    def generate_vm_code_for_subroutine_declaration(self, node: SubroutineDeclaration):
         # Starting new subroutine, to reset symbol table and update
         # current subroutine kind
         self.current_subroutine_kind = node.subroutine_kind_token.value
@@ -1911,30 +2141,32 @@ class VMGenerator:
         for variable_declaration in node.subroutine_body.variable_declarations:
             self.populate_symbol_table_for_variable_declaration(variable_declaration)
 
-        result = ""
-        result += self.vm_writer.write_function(
+        # The function command and prolog are from the subroutine's first line
+        self.vm_writer.jack_line = node.subroutine_kind_token.line
+        self.vm_writer.write_function(
             f"{self.current_class_name}.{node.name_token.value}",
             self.subroutine_symbol_table.var_count("local"),
+            self.find_uninitialized_locals(node.subroutine_body),
         )
 
         # Prolog for constructor or method
         if self.current_subroutine_kind == "constructor":
             # Push the number of fields to the stack; this is how much RAM
             # the constructor must allocate
-            result += self.vm_writer.write_push(
+            self.vm_writer.write_push(
                 "constant", self.class_symbol_table.var_count("field")
             )
             # call Memory.alloc(number_of_16_bit_addresses_to_allocate), which takes one argument
-            result += self.vm_writer.write_call("Memory.alloc", 1)
+            self.vm_writer.write_call("Memory.alloc", 1)
             # set THIS to the result value from Memory.alloc
-            result += self.vm_writer.write_pop("pointer", 0)
+            self.vm_writer.write_pop("pointer", 0)
         elif self.current_subroutine_kind == "method":
             # By convention, parameter 0 for methods is the address of the method's object
             # This is enforced in generate_vm_code_for_subroutine_call()
             # Here is where we use that parameter. We push argument 0,
             # then pop pointer 0 to set THIS to the correct address.
-            result += self.vm_writer.write_push("argument", 0)
-            result += self.vm_writer.write_pop("pointer", 0)
+            self.vm_writer.write_push("argument", 0)
+            self.vm_writer.write_pop("pointer", 0)
         elif self.current_subroutine_kind == "function":
             # Functions have no prolog
             pass
@@ -1945,9 +2177,7 @@ class VMGenerator:
 
         # Finally, generate vm code for the subroutine body
         # i.e., the statements in the body (since symbol table already handled)
-        result += self.generate_vm_code_for_subroutine_body(node.subroutine_body)
-
-        return result
+        self.generate_vm_code_for_subroutine_body(node.subroutine_body)
 
     # classVarDec
     def populate_symbol_table_for_class_variable_declaration(
@@ -1963,11 +2193,11 @@ class VMGenerator:
         return
 
     # class
-    def generate_vm_code_for_class(self, node: Class) -> str:
+    # Returns the class's vm code, written to a new buffer
+    def generate_vm_code_for_class(self, node: Class) -> list[VMInstruction]:
         self.current_class_name = node.name_token.value
         self.class_symbol_table.reset()
-
-        result = ""
+        self.vm_writer.instructions = []
 
         # Populate symbol table for class variable declarations
         for class_variable_declaration in node.class_variable_declarations:
@@ -1976,11 +2206,9 @@ class VMGenerator:
             )
 
         for subroutine_declaration in node.subroutine_declarations:
-            result += self.generate_vm_code_for_subroutine_declaration(
-                subroutine_declaration
-            )
+            self.generate_vm_code_for_subroutine_declaration(subroutine_declaration)
 
-        return result
+        return self.vm_writer.instructions
 
 
 # Functions related to xml output
@@ -2393,6 +2621,68 @@ class EmitJackParsedXml:
 # main function: drive compilation
 
 
+# A compilation of a set of jack files
+#
+# parse() tokenizes and parses each file once, adding its string literals
+# to the string constant table as they are parsed. The tokens and parsed
+# classes are kept for the stages after it (the string table, the xml
+# outputs and vm code generation), so no stage reads or tokenizes a file
+# again. stage_times holds the seconds each stage took, over all files.
+class CompilationSession:
+    jack_file_paths: list[Path]
+    string_constant_table: StringConstantTable
+    tokens_by_path: dict[Path, TokenStream]
+    classes_by_path: dict[Path, Class]
+    stage_times: dict[str, float]
+
+    def __init__(self, jack_file_paths):
+        self.jack_file_paths = [
+            Path(jack_file_path) for jack_file_path in jack_file_paths
+        ]
+        self.string_constant_table = StringConstantTable()
+        self.tokens_by_path = {}
+        self.classes_by_path = {}
+        self.stage_times = {"tokenize": 0.0, "parse": 0.0, "generate": 0.0}
+
+    def parse(self):
+        for jack_file_path in self.jack_file_paths:
+            start_time = time.perf_counter()
+            tokens = tokenize_code_from_file(jack_file_path)
+            parse_start_time = time.perf_counter()
+            self.stage_times["tokenize"] += parse_start_time - start_time
+
+            jack_compiler = JackCompiler(
+                tokens=tokens, string_constant_table=self.string_constant_table
+            )
+            self.tokens_by_path[jack_file_path] = tokens
+            self.classes_by_path[jack_file_path] = jack_compiler.compile_class()
+            self.stage_times["parse"] += time.perf_counter() - parse_start_time
+
+    # The vm code of each parsed class, as a dict of jack file path ->
+    # VMInstructions. Labels are numbered across all of the classes, in the
+    # order of the files.
+    def generate_vm_code(self) -> dict[Path, list[VMInstruction]]:
+        start_time = time.perf_counter()
+        vm_generator = VMGenerator(self.string_constant_table)
+        vm_code_by_path = {}
+        for jack_file_path, compiled_class in self.classes_by_path.items():
+            vm_code_by_path[jack_file_path] = vm_generator.generate_vm_code_for_class(
+                compiled_class
+            )
+            vm_generator.reset()
+        self.stage_times["generate"] += time.perf_counter() - start_time
+        return vm_code_by_path
+
+    def timing_summary(self):
+        return (
+            f"Compiled {len(self.jack_file_paths)} files (each tokenized once): "
+            + ", ".join(
+                f"{stage_name} {stage_time:.3f} s"
+                for stage_name, stage_time in self.stage_times.items()
+            )
+        )
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -2400,14 +2690,10 @@ def main():
     )
     args = parser.parse_args()
 
-    # Build the string table
-    string_constant_table = StringConstantTable()
-    for input_file in args.input_files:
-        current_file_path = Path(input_file)
-        current_file_tokens = tokenize_code_from_file(current_file_path)
-        for token in current_file_tokens:
-            if token.type == "stringConstant":
-                string_constant_table.add_string_literal(token)
+    # Tokenize and parse each file once, building the string table
+    session = CompilationSession(args.input_files)
+    session.parse()
+    string_constant_table = session.string_constant_table
     string_constant_table_bytes = (
         string_constant_table.string_token_to_position_info_as_bytes()
     )
@@ -2426,30 +2712,21 @@ def main():
         )
 
     # Generate VM code
-    tokens = []
-    vm_generator = VMGenerator(string_constant_table)
-    for input_file in args.input_files:
-        current_file_path = Path(input_file)
+    vm_code_by_path = session.generate_vm_code()
+    for current_file_path, tokens in session.tokens_by_path.items():
         current_file_stem = current_file_path.stem
         # Get directory of input_file
         current_file_directory = current_file_path.parent
-        # Get output file path
-        output_file_path = current_file_directory / f"{current_file_stem}.vm"
         print(f"Processing {current_file_stem}.jack -> {current_file_stem}.vm")
 
-        # Tokenize the current file and output the result
-        tokens = tokenize_code_from_file(current_file_path)
-
+        # Output the tokens of the current file
         output_file_path_tokens = current_file_directory / f"{current_file_stem}T.xml"
         with open(output_file_path_tokens, "w") as output_file:
             output_file.write(xml_from_token_list(tokens).replace("\n", "\r\n"))
             print(f"  Output XML to {output_file_path_tokens}")
 
-        # Compile the current file
-        jack_compiler = JackCompiler(tokens=tokens)
-        compiled_class = jack_compiler.compile_class()
-
         # Output the raw compiled dataclass hierarchy
+        compiled_class = session.classes_by_path[current_file_path]
         output_file_path_raw = current_file_directory / f"{current_file_stem}.raw"
         with open(output_file_path_raw, "w") as output_file:
             output_file.write(str(compiled_class))
@@ -2467,11 +2744,14 @@ def main():
         # Output the VM code
         output_file_path_vm = current_file_directory / f"{current_file_stem}.vm"
         with open(output_file_path_vm, "w") as output_file:
-            vm_code_to_output = vm_generator.generate_vm_code_for_class(compiled_class)
+            vm_code_to_output = write_vm_code(
+                vm_code_by_path[current_file_path], current_file_path.name
+            )
             output_file.write(vm_code_to_output.replace("\n", "\r\n"))
-            vm_generator.reset()
             print(f"  Output VM code to {output_file_path_vm}")
 
+    print(session.timing_summary())
+
     # print xml with windows line endings to match test file from nand2tetris
     # print(xml_from_token_list(tokens).replace("\n", "\r\n"), end="\r\n")
 
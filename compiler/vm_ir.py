@@ -0,0 +1,112 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+# In-memory form of vack vm code
+#
+# jack_compiler.py compiles each class to a list of VMInstructions.
+# vm/translator.py can translate them in the same process (see
+# iterate_vm_instructions there, which scripts/build.py uses), without
+# writing them to a .vm file and parsing it again; writing the .vm file
+# (see write_vm_code) is optional.
+#
+# The .vm file has the comments the translator reads from it (see
+# iterate_vm_commands in vm/translator.py): before the first instruction
+# compiled from each jack line,
+#
+#   // source Main.jack:5
+#
+# and before a function command, the locals the function assigns before
+# reading them (see find_uninitialized_locals in jack_compiler.py),
+#
+#   // uninitialized_locals 1 3
+
+SOURCE_COMMENT_PREFIX = "// source "
+UNINITIALIZED_LOCALS_COMMENT_PREFIX = "// uninitialized_locals "
+
+
+class Opcode(Enum):
+    PUSH = "push"
+    POP = "pop"
+    ADD = "add"
+    SUB = "sub"
+    NEG = "neg"
+    EQ = "eq"
+    GT = "gt"
+    LT = "lt"
+    AND = "and"
+    OR = "or"
+    NOT = "not"
+    LABEL = "label"
+    GOTO = "goto"
+    IF_GOTO = "if-goto"
+    FUNCTION = "function"
+    CALL = "call"
+    RETURN = "return"
+
+
+class Segment(Enum):
+    ARGUMENT = "argument"
+    LOCAL = "local"
+    STATIC = "static"
+    CONSTANT = "constant"
+    THIS = "this"
+    THAT = "that"
+    POINTER = "pointer"
+    TEMP = "temp"
+    UART = "uart"
+
+
+@dataclass(slots=True)
+class VMInstruction:
+    opcode: Opcode
+    # segment of a push or pop
+    segment: Optional[Segment] = None
+    # label of a label, goto or if-goto; function name of a function or call
+    name: str = ""
+    # index of a push or pop, number of local variables of a function,
+    # number of arguments of a call
+    operand: int = 0
+    # line of the jack code compiled to this instruction (0 if unknown)
+    jack_line: int = 0
+    # for a function, the locals it assigns before reading them
+    uninitialized_locals: tuple[int, ...] = ()
+
+    # The words of the instruction's line of vm code
+    def words(self) -> list[str]:
+        match self.opcode:
+            case Opcode.PUSH | Opcode.POP:
+                return [self.opcode.value, self.segment.value, str(self.operand)]
+            case Opcode.LABEL | Opcode.GOTO | Opcode.IF_GOTO:
+                return [self.opcode.value, self.name]
+            case Opcode.FUNCTION | Opcode.CALL:
+                return [self.opcode.value, self.name, str(self.operand)]
+            case _:
+                return [self.opcode.value]
+
+    def text(self) -> str:
+        return " ".join(self.words())
+
+
+# The lines of the .vm file for instructions compiled from jack_file_name
+# (without source comments if it is empty): each either a comment or the
+# VMInstruction on that line
+def vm_code_lines(instructions, jack_file_name=""):
+    jack_line = 0
+    for instruction in instructions:
+        if jack_file_name and instruction.jack_line not in [0, jack_line]:
+            jack_line = instruction.jack_line
+            yield f"{SOURCE_COMMENT_PREFIX}{jack_file_name}:{jack_line}"
+        if instruction.uninitialized_locals:
+            yield UNINITIALIZED_LOCALS_COMMENT_PREFIX + " ".join(
+                map(str, instruction.uninitialized_locals)
+            )
+        yield instruction
+
+
+# The text of the .vm file for instructions compiled from jack_file_name
+def write_vm_code(instructions, jack_file_name="") -> str:
+    return "".join(
+        f"{line}\n" if isinstance(line, str) else f"{line.text()}\n"
+        for line in vm_code_lines(instructions, jack_file_name)
+    )
@@ -0,0 +1,369 @@
+import argparse
+import hashlib
+import json
+import sys
+import time
+from pathlib import Path
+
+# Single-process build of a directory of jack code
+#
+# Compiles, translates, assembles and links a program in one process, each
+# stage passing its output to the next in memory: vm code as
+# VMInstructions (see compiler/vm_ir.py), assembly code as text and object code
+# as ObjectModules. This replaces running compiler/jack_compiler.py,
+# vm/translator.py --output_directory and assembler/linker.py one after
+# another, each writing files for the next to read, and writes only the
+# outputs asked for. Each stage's modules are imported only when the stage
+# runs.
+#
+# A build is skipped if the jack files, the options and the source code of
+# every stage are the same as for the last build and its outputs are still
+# there (see build_inputs_hash). Otherwise the jack files are compiled
+# again (each class's labels and string addresses depend on the classes
+# before it, and compiling is fast), vm files whose vm code is unchanged
+# reuse their cached assembly code (see TranslationCache in
+# vm/translator.py) and modules whose assembly code is unchanged reuse
+# their cached object code (see assemble_module_text in
+# assembler/linker.py).
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STAGE_DIRECTORIES = [REPO_ROOT / "compiler", REPO_ROOT / "vm", REPO_ROOT / "assembler"]
+BUILD_STATE_FILE_NAME = "build_state.json"
+
+# Options that do not change the outputs of a build
+OPTIONS_NOT_HASHED = ["jobs"]
+
+
+# Hash of everything the outputs of a build depend on: the jack files, the
+# options and the source code of the compiler, translator and assembler
+def build_inputs_hash(jack_paths, args):
+    hasher = hashlib.sha256()
+    for stage_directory in STAGE_DIRECTORIES:
+        for source_path in sorted(stage_directory.glob("*.py")):
+            hasher.update(f"{source_path.name}\n".encode())
+            hasher.update(source_path.read_bytes())
+    options = {
+        option: value
+        for option, value in sorted(vars(args).items())
+        if option not in OPTIONS_NOT_HASHED
+    }
+    hasher.update(f"{json.dumps(options)}\n".encode())
+    for jack_path in jack_paths:
+        hasher.update(f"{jack_path.name}\n".encode())
+        hasher.update(jack_path.read_bytes())
+    return hasher.hexdigest()
+
+
+# Whether the last build had the same inputs and its outputs still exist
+def is_up_to_date(build_state_path, inputs_hash):
+    if not build_state_path.exists():
+        return False
+    build_state = json.loads(build_state_path.read_text())
+    return build_state["inputs_hash"] == inputs_hash and all(
+        Path(output_path).exists() for output_path in build_state["outputs"]
+    )
+
+
+# Compile the jack files, tokenizing and parsing each once (see
+# CompilationSession in compiler/jack_compiler.py). Returns the string
+# constant table and a list of (jack file path, VMInstructions of its
+# class).
+def compile_jack_files(jack_paths):
+    from jack_compiler import CompilationSession
+
+    session = CompilationSession(jack_paths)
+    session.parse()
+    vm_code_by_path = session.generate_vm_code()
+    print(session.timing_summary(), file=sys.stderr)
+    return session.string_constant_table, list(vm_code_by_path.items())
+
+
+# Translate the compiled files, returning (module name, assembly code) of
+# each module in the order to link them (see translate_modules in
+# vm/translator.py)
+def translate_compiled_files(compiled_files, args, build_directory):
+    from translator import (
+        OptimizationReport,
+        TranslationCache,
+        iterate_vm_instructions,
+        prepare_program,
+        translate_modules,
+    )
+
+    report = OptimizationReport()
+    vm_files = [
+        (
+            jack_path.stem,
+            iterate_vm_instructions(
+                instructions, f"{jack_path.stem}.vm", jack_path.name
+            ),
+        )
+        for jack_path, instructions in compiled_files
+    ]
+    vm_files, vm_translator = prepare_program(
+        vm_files,
+        report,
+        optimization_level=args.optimize,
+        remove_unreachable=args.remove_unreachable_functions,
+        optimize_size=args.optimize_size,
+        rom_budget=args.rom_budget,
+    )
+    translation_cache = TranslationCache(build_directory / "translator_cache")
+    modules = list(
+        translate_modules(vm_files, False, vm_translator, translation_cache, args.jobs)
+    )
+    print(translation_cache.summary(), file=sys.stderr)
+    if args.optimize:
+        print(report.summary(), file=sys.stderr)
+    return modules
+
+
+# Assemble each module, reusing cached object modules, returning the
+# object modules in order
+def assemble_modules(modules, args, build_directory):
+    from linker import assemble_module_text
+
+    object_modules = []
+    modules_from_cache = 0
+    for module_name, assembly_code in modules:
+        object_module, from_cache = assemble_module_text(
+            assembly_code,
+            module_name,
+            build_directory / "cache",
+            args.optimize_assembly,
+        )
+        object_modules.append(object_module)
+        modules_from_cache += from_cache
+    print(
+        f"Object modules: {modules_from_cache} from cache, "
+        f"{len(object_modules) - modules_from_cache} assembled",
+        file=sys.stderr,
+    )
+    return object_modules
+
+
+# Write the requested outputs of the build, returning their paths
+def write_outputs(args, string_constant_table, compiled_files, modules, object_code):
+    from assembler import (
+        object_code_to_ascii,
+        object_code_to_big_endian_bytes,
+        object_code_to_memh,
+    )
+
+    output_paths = []
+
+    def write_output(output_path, content):
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, bytes):
+            output_path.write_bytes(content)
+        else:
+            output_path.write_text(content)
+        output_paths.append(str(output_path))
+
+    if args.output_string_table:
+        write_output(
+            args.output_string_table,
+            string_constant_table.string_token_to_position_info_as_bytes(),
+        )
+    if args.output_vm:
+        from vm_ir import write_vm_code
+
+        # With windows line endings, as compiler/jack_compiler.py writes them
+        for jack_path, instructions in compiled_files:
+            write_output(
+                jack_path.with_suffix(".vm"),
+                write_vm_code(instructions, jack_path.name).replace("\n", "\r\n"),
+            )
+    if args.output_asm_directory:
+        for module_name, assembly_code in modules:
+            write_output(
+                Path(args.output_asm_directory) / f"{module_name}.asm", assembly_code
+            )
+    if args.output_bin:
+        write_output(args.output_bin, object_code_to_big_endian_bytes(object_code))
+    if args.output_hack:
+        write_output(args.output_hack, object_code_to_ascii(object_code))
+    if args.output_memh:
+        write_output(args.output_memh, object_code_to_memh(object_code))
+    if args.output_map or args.output_listing:
+        from linker import linked_source_map_of_modules
+        from source_map import source_map_to_json, source_map_to_listing
+
+        entries = linked_source_map_of_modules(
+            [
+                (f"{module_name}.asm", assembly_code)
+                for module_name, assembly_code in modules
+            ],
+            object_code,
+            args.optimize_assembly,
+        )
+        if args.output_map:
+            write_output(args.output_map, source_map_to_json(entries))
+        if args.output_listing:
+            write_output(args.output_listing, source_map_to_listing(entries))
+    return output_paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "source_directory", type=str, help="Directory of the jack files to build"
+    )
+    parser.add_argument(
+        "--build_directory",
+        type=str,
+        help="Directory for the caches and the state of the last build "
+        "(default: build in the source directory)",
+    )
+    parser.add_argument(
+        "--optimize",
+        type=int,
+        default=0,
+        metavar="LEVEL",
+        help="Translate with this optimization level (see vm/translator.py --optimize)",
+    )
+    parser.add_argument(
+        "--optimize_assembly",
+        action="store_true",
+        help="Run the peephole optimizer on each module before assembling",
+    )
+    parser.add_argument(
+        "--remove_unreachable_functions",
+        action="store_true",
+        help="Remove functions not reachable by calls from Sys.init",
+    )
+    parser.add_argument(
+        "--optimize_size",
+        action="store_true",
+        help="Translate every eq, gt and lt as a call to a shared routine",
+    )
+    parser.add_argument(
+        "--rom_budget",
+        type=int,
+        metavar="WORDS",
+        help="Share comparisons until the program fits in this many words",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Translate up to N vm files at once in worker processes",
+    )
+    parser.add_argument(
+        "--output_string_table",
+        type=str,
+        help="Write the string constant table to this file",
+    )
+    parser.add_argument(
+        "--output_vm",
+        action="store_true",
+        help="Write a .vm file next to each .jack file",
+    )
+    parser.add_argument(
+        "--output_asm_directory",
+        type=str,
+        help="Write one .asm module per jack file, plus the prolog and runtime, "
+        "to this directory",
+    )
+    parser.add_argument(
+        "--output_bin",
+        type=str,
+        help="Write object code as big endian bytes to this file",
+    )
+    parser.add_argument(
+        "--output_hack",
+        type=str,
+        help="Write object code as ascii binary numbers, 16 bits per line, to this file",
+    )
+    parser.add_argument(
+        "--output_memh",
+        type=str,
+        help="Write object code as hexadecimal numbers, 4 digits per line, to this file",
+    )
+    parser.add_argument(
+        "--output_map",
+        type=str,
+        help="Write a map (json) of each ROM address to its source to this file",
+    )
+    parser.add_argument(
+        "--output_listing",
+        type=str,
+        help="Write a listing of addresses, object code and source locations to this file",
+    )
+    args = parser.parse_args()
+
+    source_directory = Path(args.source_directory)
+    jack_paths = sorted(source_directory.glob("*.jack"))
+    if not jack_paths:
+        print(f"Error: no .jack files in {source_directory}")
+        exit(1)
+    build_directory = source_directory / "build"
+    if args.build_directory:
+        build_directory = Path(args.build_directory)
+    build_state_path = build_directory / BUILD_STATE_FILE_NAME
+
+    start_time = time.perf_counter()
+    inputs_hash = build_inputs_hash(jack_paths, args)
+    if is_up_to_date(build_state_path, inputs_hash):
+        print(
+            f"Up to date ({time.perf_counter() - start_time:.2f} s)", file=sys.stderr
+        )
+        return
+
+    for stage_directory in STAGE_DIRECTORIES:
+        sys.path.append(str(stage_directory))
+
+    stage_times = {}
+
+    def timed_stage(stage_name, run_stage, *stage_arguments):
+        stage_start_time = time.perf_counter()
+        result = run_stage(*stage_arguments)
+        stage_times[stage_name] = time.perf_counter() - stage_start_time
+        return result
+
+    string_constant_table, compiled_files = timed_stage(
+        "compile", compile_jack_files, jack_paths
+    )
+    modules = timed_stage(
+        "translate", translate_compiled_files, compiled_files, args, build_directory
+    )
+    object_modules = timed_stage(
+        "assemble", assemble_modules, modules, args, build_directory
+    )
+
+    from linker import link
+
+    object_code, _ = timed_stage("link", link, object_modules)
+    output_paths = timed_stage(
+        "write",
+        write_outputs,
+        args,
+        string_constant_table,
+        compiled_files,
+        modules,
+        object_code,
+    )
+
+    build_directory.mkdir(parents=True, exist_ok=True)
+    build_state_path.write_text(
+        json.dumps({"inputs_hash": inputs_hash, "outputs": output_paths})
+    )
+    print(
+        "Stage times: "
+        + ", ".join(
+            f"{stage_name} {stage_time:.2f} s"
+            for stage_name, stage_time in stage_times.items()
+        ),
+        file=sys.stderr,
+    )
+    print(
+        f"Built {len(jack_paths)} jack files into {len(object_code)} words "
+        f"in {time.perf_counter() - start_time:.2f} s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,19 @@ set -eu # exit if any command fails
 STRING_DATA_OFFSET=0x00200000 # 2MB offset for string table
 
 usage() {
-  echo "Usage: $0 -d <source directory>"
+  echo "Usage: $0 -d <source directory> [-O]"
+  echo "  -O  optimize: translate with --optimize 3 and run the peephole optimizer"
+  echo "      on each module before assembling"
   exit 1
 }
 
 ddir=""
+BUILD_FLAGS=""
 
-while getopts ":d:" opt; do
+while getopts ":d:O" opt; do
   case "$opt" in
       d) ddir="$OPTARG" ;;
+      O) BUILD_FLAGS="--optimize 3 --optimize_assembly" ;;
       *) echo "Invalid option: $opt" >&2; usage; exit 1; ;;
   esac
 done
@@ -36,14 +40,13 @@ fi
 echo "Compiling source directory $ddir"
 pushd $ddir > /dev/null
 
-echo "Compiling Jack code"
-uv run python $REPO_ROOT/compiler/jack_compiler.py *.jack
-echo "Translating VM code"
-uv run python $REPO_ROOT/vm/translator.py *.vm > Program.asm
-echo "Assembling program"
-uv run python $REPO_ROOT/assembler/assembler.py Program.asm > Program.hack
-echo "Converting object code to big endian binary"
-uv run python $REPO_ROOT/assembler/object_code_ascii_to_big_endian.py Program.hack Program.bin
+# Compile, translate, assemble and link in one process (see
+# scripts/build.py). The .vm files are written for the line count below.
+# Functions that Sys.init never calls (directly or indirectly) are removed,
+# and comparisons use shared routines if needed to fit the program in ROM.
+# Only changed .vm files are translated again and only changed modules are
+# reassembled; if nothing changed, nothing is rebuilt.
+uv run python $REPO_ROOT/scripts/build.py . --output_vm --remove_unreachable_functions --rom_budget 32768 $BUILD_FLAGS --output_string_table StringConstantTable.bin --output_bin Program.bin --output_hack Program.hack --output_map Program.map.json --output_listing Program.lst
 
 popd > /dev/null
 
@@ -8,11 +8,91 @@ uv run python $REPO_ROOT/vm/translator.py --write_prolog_and_epilog $REPO_ROOT/c
 uv run python $REPO_ROOT/assembler/assembler.py $REPO_ROOT/computer/test_vm_functions.asm > $REPO_ROOT/computer/test_vm_functions.hack
 $SCRIPT_DIR/runtest.sh $REPO_ROOT/computer/tb_computer_functions.v $REPO_ROOT/computer/top_computer.v $REPO_ROOT/memory/memory_spram.v $REPO_ROOT/memory/memory_dff.v $REPO_ROOT/memory/dff.v $REPO_ROOT/uart/uart.v $REPO_ROOT/computer/cpu.v $REPO_ROOT/math/alu.v $REPO_ROOT/math/add.v $REPO_ROOT/logic/gates.v $REPO_ROOT/led/led.v
 
+echo -n "computer/tb_computer_recursion.v -- "
+uv run python $REPO_ROOT/vm/translator.py --write_prolog_and_epilog --optimize 2 $REPO_ROOT/computer/test_vm_recursion.vm > $REPO_ROOT/computer/test_vm_recursion.asm
+uv run python $REPO_ROOT/assembler/assembler.py $REPO_ROOT/computer/test_vm_recursion.asm > $REPO_ROOT/computer/test_vm_recursion.hack
+$SCRIPT_DIR/runtest.sh $REPO_ROOT/computer/tb_computer_recursion.v $REPO_ROOT/computer/top_computer.v $REPO_ROOT/memory/memory_spram.v $REPO_ROOT/memory/memory_dff.v $REPO_ROOT/memory/dff.v $REPO_ROOT/uart/uart.v $REPO_ROOT/computer/cpu.v $REPO_ROOT/math/alu.v $REPO_ROOT/math/add.v $REPO_ROOT/logic/gates.v
+
+# The recursion test must still run through tail calls: Main.count's call
+# to itself, and the calls from Main.count_sum and Main.count_from_zero
+# that rebuild the frame
+echo -n "vm/translator.py tail calls -- "
+TAIL_CALLS=$(grep -c "(tail call)" $REPO_ROOT/computer/test_vm_recursion.asm)
+if [ "$TAIL_CALLS" = "3" ]; then
+  echo "OK"
+else
+  echo "FAIL"
+  echo "computer/test_vm_recursion.vm has $TAIL_CALLS tail calls, expected 3"
+fi
+
 echo -n "computer/tb_computer.v -- "
 uv run python $REPO_ROOT/vm/translator.py --write_prolog_and_epilog $REPO_ROOT/computer/test_vm.vm > $REPO_ROOT/computer/test_vm.asm
 uv run python $REPO_ROOT/assembler/assembler.py $REPO_ROOT/computer/test_vm.asm > $REPO_ROOT/computer/test_vm.hack
 $SCRIPT_DIR/runtest.sh $REPO_ROOT/computer/tb_computer.v $REPO_ROOT/computer/top_computer.v $REPO_ROOT/memory/memory_spram.v $REPO_ROOT/memory/memory_dff.v $REPO_ROOT/memory/dff.v $REPO_ROOT/uart/uart.v $REPO_ROOT/computer/cpu.v $REPO_ROOT/math/alu.v $REPO_ROOT/math/add.v $REPO_ROOT/logic/gates.v $REPO_ROOT/led/led.v
 
+# Translating vm files in parallel must give the same assembly code as
+# translating them one after another
+echo -n "vm/translator.py --jobs -- "
+JOBS_TEMP_DIR=$(mktemp -d)
+uv run python $REPO_ROOT/vm/translator.py --write_prolog_and_epilog --optimize 3 $REPO_ROOT/computer/test_vm*.vm > $JOBS_TEMP_DIR/serial.asm 2> /dev/null
+uv run python $REPO_ROOT/vm/translator.py --write_prolog_and_epilog --optimize 3 --jobs 3 $REPO_ROOT/computer/test_vm*.vm > $JOBS_TEMP_DIR/parallel.asm 2> /dev/null
+if cmp -s $JOBS_TEMP_DIR/serial.asm $JOBS_TEMP_DIR/parallel.asm; then
+  echo "OK"
+else
+  echo "FAIL"
+  echo "Assembly code translated with --jobs 3 differs from serial translation"
+fi
+rm -rf $JOBS_TEMP_DIR
+
+# Test the translator's choice of code for each push and pop
+echo -n "vm/check_addressing_costs.py -- "
+uv run python $REPO_ROOT/vm/check_addressing_costs.py
+
+# Pushes and pops with an index out of range must give an error at every
+# optimization level, including when a pattern fuses them with the
+# commands around them
+echo -n "vm/translator.py index checks -- "
+INDEX_TEMP_DIR=$(mktemp -d)
+INDEX_CHECK_FAILURES=""
+for vm_code in "push local 0\npop pointer 3" "push uart 5\npop local 0" "push constant 1\npush constant 40000\nadd\npop local 0" "pop pointer 1\npush temp 8\npop that 0"; do
+  printf "function Sys.init 1\n$vm_code\nreturn\n" > $INDEX_TEMP_DIR/Sys.vm
+  for optimize in 0 1 2 3; do
+    if ! uv run python $REPO_ROOT/vm/translator.py --optimize $optimize $INDEX_TEMP_DIR/Sys.vm 2>&1 | grep -q "^Error: cannot push"; then
+      INDEX_CHECK_FAILURES="$INDEX_CHECK_FAILURES\n--optimize $optimize: $vm_code"
+    fi
+  done
+done
+if [ -z "$INDEX_CHECK_FAILURES" ]; then
+  echo "OK"
+else
+  echo "FAIL"
+  echo -e "No error for an index out of range in:$INDEX_CHECK_FAILURES"
+fi
+rm -rf $INDEX_TEMP_DIR
+
+# Building in one process must give the same program as compiling,
+# translating and linking through files
+echo -n "scripts/build.py -- "
+BUILD_TEMP_DIR=$(mktemp -d)
+cp $REPO_ROOT/src/os/*.jack $REPO_ROOT/src/hello/*.jack $BUILD_TEMP_DIR
+pushd $BUILD_TEMP_DIR > /dev/null
+uv run python $REPO_ROOT/compiler/jack_compiler.py *.jack > /dev/null
+uv run python $REPO_ROOT/vm/translator.py --output_directory steps --optimize 3 *.vm 2> /dev/null
+MODULES="steps/VM_PROLOG.asm"
+for vm_file in *.vm; do
+  MODULES="$MODULES steps/${vm_file%.vm}.asm"
+done
+uv run python $REPO_ROOT/assembler/linker.py $MODULES steps/VM_RUNTIME.asm --output_hack steps.hack 2> /dev/null
+uv run python $REPO_ROOT/scripts/build.py . --optimize 3 --output_hack build.hack 2> /dev/null
+popd > /dev/null
+if cmp -s $BUILD_TEMP_DIR/steps.hack $BUILD_TEMP_DIR/build.hack; then
+  echo "OK"
+else
+  echo "FAIL"
+  echo "Program built by scripts/build.py differs from the one built in steps"
+fi
+rm -rf $BUILD_TEMP_DIR
+
 # Run cpu test
 echo -n "computer/tb_cpu.v -- "
 $SCRIPT_DIR/runtest.sh $REPO_ROOT/computer/tb_cpu.v $REPO_ROOT/computer/cpu.v $REPO_ROOT/memory/memory_dff.v $REPO_ROOT/memory/dff.v $REPO_ROOT/math/alu.v $REPO_ROOT/math/add.v $REPO_ROOT/logic/gates.v
@@ -87,6 +167,17 @@ else
   diff $TEMP_DIR/add.bin.ascii $REPO_ROOT/assembler/add.hack
 fi
 
+# Now test writing the binary directly from the assembler, which should
+# give the same bytes as packing the ascii object code
+echo -n "assembler/assembler.py --output_bin -- "
+uv run $REPO_ROOT/assembler/assembler.py $REPO_ROOT/assembler/add.asm --output_bin $TEMP_DIR/add_direct.bin
+if cmp -s $TEMP_DIR/add_direct.bin $TEMP_DIR/add.bin; then
+  echo "OK"
+else
+  echo "FAIL"
+  echo "Binary object code from assembler/add.asm differs from packed ascii object code"
+fi
+
 # Clean up
 rm -rf $TEMP_DIR
 
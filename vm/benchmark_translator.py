@@ -0,0 +1,154 @@
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from translator import (
+    VMTranslator,
+    iterate_vm_commands,
+    read_vm_commands,
+    translate_program,
+)
+
+VM_DIRECTORY = Path(__file__).resolve().parent
+
+
+# Write a synthetic vm program of number_of_lines lines. The program is made
+# of functions that look like compiled jack code: pushes and pops of every
+# segment, arithmetic and comparisons, labels and branches, calls and
+# returns, so all of the translator's code paths are used.
+def synthetic_vm_program(number_of_lines):
+    lines = []
+    function_counter = 0
+    while len(lines) < number_of_lines:
+        function_name = f"Bench.f{function_counter}"
+        lines += [
+            f"function {function_name} 2",
+            "push argument 0",
+            "pop pointer 0",
+            "label WHILE_EXP0",
+            "push local 0",
+            "push constant 10",
+            "lt",
+            "not",
+            "if-goto WHILE_END0",
+            "push local 0",
+            "push this 1",
+            "add",
+            "pop local 1",
+            f"push static {function_counter % 50}",
+            "push local 1",
+            "gt",
+            "if-goto IF_TRUE0",
+            "push local 1",
+            "push constant 1",
+            "eq",
+            "pop temp 0",
+            "label IF_TRUE0",
+            "push local 0",
+            "push constant 1",
+            "add",
+            "pop local 0",
+            "goto WHILE_EXP0",
+            "label WHILE_END0",
+            "push local 1",
+            f"call Bench.f{max(function_counter - 1, 0)} 1",
+            "return",
+        ]
+        function_counter += 1
+    return "\n".join(lines[:number_of_lines]) + "\n"
+
+
+# Translate vm_path in-process, writing the assembly code to asm_path
+def translate(vm_path, asm_path, streaming):
+    if streaming:
+        vm_files = [(vm_path.stem, iterate_vm_commands(vm_path))]
+        with open(asm_path, "w") as output_file:
+            output_file.writelines(translate_program(vm_files, False))
+    else:
+        # The whole program read into a list and translated into one
+        # string, as the translator did before it streamed its output
+        vm_files = [(vm_path.stem, read_vm_commands(vm_path))]
+        vm_translator = VMTranslator()
+        assembly_code = ""
+        for file_stem, commands in vm_files:
+            for assembly_chunk in vm_translator.translate(commands, file_stem):
+                assembly_code += assembly_chunk
+        with open(asm_path, "w") as output_file:
+            output_file.write(assembly_code)
+
+
+# Returns the best time of repeat translations and the peak memory traced
+# during one more (tracing slows translation down, so it is not timed)
+def measure_translation(vm_path, asm_path, streaming, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        translate(vm_path, asm_path, streaming)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    translate(vm_path, asm_path, streaming)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--lines",
+        type=int,
+        default=200_000,
+        help="Number of lines of vm code in the largest synthetic program",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of times to time each translation"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        temp_path = Path(temp_directory)
+        asm_path = temp_path / "Bench.asm"
+
+        # Translating a quarter, half and all of the lines shows how the
+        # time and memory grow with program size
+        print("  vm lines    streamed (s, peak MB)    one string (s, peak MB)")
+        for number_of_lines in [args.lines // 4, args.lines // 2, args.lines]:
+            vm_path = temp_path / "Bench.vm"
+            vm_path.write_text(synthetic_vm_program(number_of_lines))
+            results = {
+                streaming: measure_translation(
+                    vm_path, asm_path, streaming, args.repeat
+                )
+                for streaming in [True, False]
+            }
+            print(
+                f"  {number_of_lines:8d}    "
+                f"{results[True][0]:6.3f} s {results[True][1] / 1e6:7.2f} MB       "
+                f"{results[False][0]:6.3f} s {results[False][1] / 1e6:7.2f} MB"
+            )
+
+        # The whole translator, including interpreter start-up
+        start = time.perf_counter()
+        subprocess.run(
+            [
+                sys.executable,
+                str(VM_DIRECTORY / "translator.py"),
+                str(vm_path),
+                "--output_file",
+                str(asm_path),
+            ],
+            check=True,
+        )
+        elapsed = time.perf_counter() - start
+        print(
+            f"translator.py --output_file, {args.lines} vm lines: {elapsed:.3f} s "
+            f"({args.lines / elapsed:,.0f} vm lines/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
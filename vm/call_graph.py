@@ -0,0 +1,159 @@
+from dataclasses import dataclass, field
+
+# Whole-program call graph for vack vm code
+#
+# Functions are found from "function" commands and calls from "call"
+# commands. Jack has no function pointers, so a function that cannot be
+# reached by calls from Sys.init (or from code outside any function, as in
+# the vm tests that run without Sys.init) is never run, and can be removed
+# before translation. Functions that call no other function (leaf
+# functions) can use a lighter calling convention (see vm/translator.py).
+
+ENTRY_FUNCTION = "Sys.init"
+
+
+@dataclass
+class DeadFunctionReport:
+    # removed function name -> words of hack assembly it would have used
+    words_removed_by_function: dict[str, int] = field(default_factory=dict)
+    functions_kept: int = 0
+
+    def words_saved(self):
+        return sum(self.words_removed_by_function.values())
+
+    def summary(self):
+        lines = [
+            f"Dead function elimination: removed "
+            f"{len(self.words_removed_by_function)} functions "
+            f"(kept {self.functions_kept}), {self.words_saved()} words saved"
+        ]
+        for function_name, words in sorted(
+            self.words_removed_by_function.items(), key=lambda item: -item[1]
+        ):
+            lines.append(f"  {function_name}: {words} words")
+        return "\n".join(lines)
+
+
+# Split the vm commands of one file (VMCommands, see vm/translator.py) into
+# the commands outside any function and a dict of function name -> commands
+# of that function (starting with its "function" command)
+def split_into_functions(commands):
+    top_level_commands = []
+    functions = {}
+    current_commands = top_level_commands
+    for command in commands:
+        if command.words[0] == "function":
+            current_commands = [command]
+            functions[command.words[1]] = current_commands
+        else:
+            current_commands.append(command)
+    return top_level_commands, functions
+
+
+def called_functions(commands):
+    return {command.words[1] for command in commands if command.words[0] == "call"}
+
+
+# The vm commands of a whole program outside any function, and a dict of
+# function name -> commands of that function. commands_by_file maps each
+# file stem to its vm commands.
+def program_functions(commands_by_file):
+    top_level_commands = []
+    functions = {}
+    for commands in commands_by_file.values():
+        file_top_level_commands, file_functions = split_into_functions(commands)
+        top_level_commands += file_top_level_commands
+        functions.update(file_functions)
+    return top_level_commands, functions
+
+
+# Names of the functions reachable from the entry function and from code
+# outside any function
+def reachable_functions(top_level_commands, functions):
+    to_visit = called_functions(top_level_commands)
+    if ENTRY_FUNCTION in functions:
+        to_visit.add(ENTRY_FUNCTION)
+    reachable = set()
+    while to_visit:
+        function_name = to_visit.pop()
+        if function_name in reachable or function_name not in functions:
+            continue
+        reachable.add(function_name)
+        to_visit |= called_functions(functions[function_name])
+    return reachable
+
+
+# Remove unreachable functions from the vm commands of a whole program.
+# commands_by_file maps each file stem to its vm commands, in program
+# order; count_words(function_commands, file_stem) gives the words of hack
+# assembly a function translates to, for the report. Returns the new
+# commands_by_file and a DeadFunctionReport.
+def remove_unreachable_functions(commands_by_file, count_words):
+    top_level_commands, functions = program_functions(commands_by_file)
+    reachable = reachable_functions(top_level_commands, functions)
+
+    report = DeadFunctionReport(functions_kept=len(reachable))
+    kept_commands_by_file = {}
+    for file_stem, commands in commands_by_file.items():
+        file_top_level_commands, file_functions = split_into_functions(commands)
+        kept_commands = list(file_top_level_commands)
+        for function_name, function_commands in file_functions.items():
+            if function_name in reachable:
+                kept_commands += function_commands
+            else:
+                report.words_removed_by_function[function_name] = count_words(
+                    function_commands, file_stem
+                )
+        kept_commands_by_file[file_stem] = kept_commands
+    return kept_commands_by_file, report
+
+
+# A function that calls no other function. saved_registers are the
+# registers it changes that its caller needs back: LCL and ARG, which it
+# points at its own locals and arguments, and THIS or THAT if it pops
+# pointer 0 or 1.
+@dataclass
+class LeafFunction:
+    number_of_arguments: int
+    saved_registers: list[str]
+
+
+# Find the functions that can use a lighter calling convention than
+# VM_CALL and VM_RETURN: functions that call no other function, are always
+# called with the same number of arguments, and are only ever entered by a
+# call (so not the entry function, which the OS prolog jumps to). Returns a
+# dict of function name -> LeafFunction.
+def find_leaf_functions(commands_by_file):
+    top_level_commands, functions = program_functions(commands_by_file)
+    numbers_of_arguments = {}
+    for commands in [top_level_commands, *functions.values()]:
+        for command in commands:
+            if command.words[0] == "call":
+                numbers_of_arguments.setdefault(command.words[1], set()).add(
+                    int(command.words[2])
+                )
+
+    leaf_functions = {}
+    for function_name, commands in functions.items():
+        numbers_of_arguments_used = numbers_of_arguments.get(function_name, set())
+        if (
+            function_name == ENTRY_FUNCTION
+            or len(numbers_of_arguments_used) != 1
+            or called_functions(commands)
+        ):
+            continue
+        popped_pointers = {
+            command.words[2]
+            for command in commands
+            if command.words[:2] == ["pop", "pointer"]
+        }
+        saved_registers = ["LCL", "ARG"]
+        if "0" in popped_pointers:
+            saved_registers.append("THIS")
+        if "1" in popped_pointers:
+            saved_registers.append("THAT")
+        leaf_functions[function_name] = LeafFunction(
+            number_of_arguments=numbers_of_arguments_used.pop(),
+            saved_registers=saved_registers,
+        )
+    return leaf_functions
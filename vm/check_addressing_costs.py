@@ -0,0 +1,129 @@
+from translator import (
+    VMTranslator,
+    base_address_of_segments,
+    count_assembly_words,
+    get_fixed_address,
+    parse_vm_command,
+    write_pushpop,
+)
+
+# Check that --optimize 1 translates each push and pop with the fewest
+# words of hack assembly
+#
+# Each row of the table gives a vm command and the words its translation
+# should take. The translation must take exactly that many words, and no
+# more than any other way of writing the same command (see
+# alternative_translations), so each form the translator picks is minimal
+# among the known forms.
+
+FILE_STEM = "Cost"
+
+# (vm command, words)
+expected_words = [
+    ("push constant 0", 4),
+    ("push constant 1", 4),
+    ("push constant 2", 6),
+    ("push constant 32767", 6),
+    ("push local 0", 7),
+    ("push local 1", 7),
+    ("push local 2", 8),
+    ("push local 3", 9),
+    ("push local 100", 9),
+    ("push argument 1", 7),
+    ("push this 3", 9),
+    ("push that 0", 7),
+    ("push temp 0", 6),
+    ("push temp 7", 6),
+    ("push pointer 0", 6),
+    ("push pointer 1", 6),
+    ("push static 3", 6),
+    ("push uart 1", 6),
+    ("pop local 0", 6),
+    ("pop local 1", 6),
+    ("pop local 2", 7),
+    ("pop local 4", 9),
+    ("pop local 5", 9),
+    ("pop local 100", 9),
+    ("pop argument 2", 7),
+    ("pop this 6", 9),
+    ("pop that 0", 6),
+    ("pop temp 3", 5),
+    ("pop pointer 1", 5),
+    ("pop static 0", 5),
+    ("pop uart 0", 5),
+]
+
+PUSH_D = "@SP\nAM=M+1\nA=A-1\nM=D\n"
+POP_INTO_D = "@SP\nAM=M-1\nD=M\n"
+
+
+# The other ways to write a push or pop: without optimization, and with
+# the segment's address computed, incremented or known
+def alternative_translations(command, segment, index):
+    alternatives = {"unoptimized": write_pushpop(command, segment, index, FILE_STEM)}
+    if segment == "constant":
+        alternatives["load into d"] = f"@{index}\nD=A\n{PUSH_D}"
+        return alternatives
+    fixed_address = get_fixed_address(segment, index, FILE_STEM)
+    if fixed_address is not None:
+        if command == "push":
+            alternatives["fixed address"] = f"@{fixed_address}\nD=M\n{PUSH_D}"
+        else:
+            alternatives["fixed address"] = f"{POP_INTO_D}@{fixed_address}\nM=D\n"
+        return alternatives
+
+    base_address = base_address_of_segments[segment]
+    index = int(index)
+    incremented_address = f"@{base_address}\n" + (
+        "A=M\n" if index == 0 else "A=M+1\n" + "A=A+1\n" * (index - 1)
+    )
+    computed_address = f"@{index}\nD=A\n@{base_address}\n"
+    if command == "push":
+        alternatives["incremented address"] = f"{incremented_address}D=M\n{PUSH_D}"
+        alternatives["computed address"] = f"{computed_address}A=D+M\nD=M\n{PUSH_D}"
+    else:
+        alternatives["incremented address"] = (
+            f"{POP_INTO_D}{incremented_address}M=D\n"
+        )
+        alternatives["computed address in R13"] = (
+            f"{computed_address}D=D+M\n@R13\nM=D\n{POP_INTO_D}@R13\nA=M\nM=D\n"
+        )
+        alternatives["address plus value"] = (
+            f"{computed_address}D=D+M\n@SP\nAM=M-1\nD=D+M\nA=D-M\nM=D-A\n"
+        )
+    return alternatives
+
+
+def translated_words(vm_command):
+    vm_translator = VMTranslator(optimization_level=1)
+    return count_assembly_words(
+        "".join(vm_translator.translate([parse_vm_command(vm_command)], FILE_STEM))
+    )
+
+
+def main():
+    failures = []
+    for vm_command, words in expected_words:
+        actual_words = translated_words(vm_command)
+        if actual_words != words:
+            failures.append(f"{vm_command}: {actual_words} words, expected {words}")
+        for name, assembly_code in alternative_translations(
+            *vm_command.split()
+        ).items():
+            alternative_words = count_assembly_words(assembly_code)
+            if alternative_words < actual_words:
+                failures.append(
+                    f"{vm_command}: {actual_words} words, but {name} takes "
+                    f"{alternative_words}"
+                )
+
+    if failures:
+        print("FAIL")
+        for failure in failures:
+            print(f"  {failure}")
+        exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
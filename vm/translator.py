@@ -1,5 +1,14 @@
 import argparse
+from collections import deque
+import copy
+from dataclasses import asdict, dataclass, field
+from functools import partial
+import hashlib
+from itertools import repeat
+import json
 from pathlib import Path
+import sys
+
 
 arithmetic_commands = ["add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"]
 pushpop_commands = ["push", "pop"]
@@ -93,7 +102,8 @@ def get_base_address_for_push_pop(segment, index, file_stem):
         return f"{base_address}"
 
 
-def write_pushpop(command, segment, index, file_stem):
+# Exit with an error if segment[index] is out of range
+def check_pushpop_index(segment, index):
     if (segment == "constant") and (int(index) > 32767):
         print(f"Error: cannot push constant {index} because it is larger than 32767")
         exit(1)
@@ -108,6 +118,10 @@ def write_pushpop(command, segment, index, file_stem):
     if segment == "uart" and int(index) > 2:
         print(f"Error: cannot push {segment} {index} because index is out of range")
         exit(1)
+
+
+def write_pushpop(command, segment, index, file_stem):
+    check_pushpop_index(segment, index)
     result = f"// {command} {segment} {index}\n"
     if command == "push":
         if segment != "static":
@@ -358,6 +372,39 @@ M=M+1
             return "// not\n@SP\nA=M-1\nM=!M\n"
 
 
+# Shared comparisons (--optimize_size, --rom_budget)
+#
+# An inline gt or lt takes about 50 words, and an inline eq about 20. A
+# shared comparison is 4 words at each call site: the return address goes
+# in D, and the shared routine (VM_EQ, VM_GT or VM_LT, in the runtime code
+# like VM_CALL and VM_RETURN) saves it in R15 while it compares, then
+# jumps back. A shared comparison runs 9 more instructions than an inline one.
+shared_comparison_commands = ["eq", "gt", "lt"]
+
+
+def get_shared_comparison_label(command):
+    return f"VM_{command.upper()}"
+
+
+def write_shared_comparison_call(command, file_stem, counter):
+    return_address = f"{file_stem}${command.upper()}_RETURN.{counter}"
+    return (
+        f"// {command} (shared)\n"
+        f"@{return_address}\nD=A\n"
+        f"@{get_shared_comparison_label(command)}\n0;JMP\n"
+        f"({return_address})\n"
+    )
+
+
+def write_shared_comparison(command):
+    label = get_shared_comparison_label(command)
+    return (
+        f"({label})\n@R15\nM=D\n"
+        + write_arithmetic(command, label, 0)
+        + "@R15\nA=M\n0;JMP\n"
+    )
+
+
 # Note: LCL, ARG, THIS, THAT are made up addresses for testing.
 # In a real code, these pointers only take a valid value via call/return
 def write_prolog():
@@ -397,13 +444,67 @@ def write_epilog():
 """
 
 
-def write_function(function_name, function_number_of_local_variables):
+# Given uninitialized_locals (from --optimize 1), the locals are written by
+# write_local_variables instead of one push constant 0 each
+def write_function(
+    function_name, function_number_of_local_variables, uninitialized_locals=None
+):
     result = f"// function {function_name} {function_number_of_local_variables}\n"
     result += f"({function_name})\n"
+    if uninitialized_locals is not None:
+        return result + write_local_variables(
+            function_name, function_number_of_local_variables, uninitialized_locals
+        )
     for _ in range(int(function_number_of_local_variables)):
         result += write_pushpop("push", "constant", "0", "")
     return result
 
+
+# Local variables (from --optimize 1)
+#
+# The jack compiler writes "// uninitialized_locals 1 3" before a function
+# command to list the locals that every path through the function assigns
+# before reading (see find_uninitialized_locals in compiler/jack_compiler.py).
+# Those locals only need room on the stack, not a 0. The other locals are
+# set to 0 by walking A up the stack, or by a loop if there are many.
+LOCAL_VARIABLES_LEVEL = 1
+# The loop takes 9 words, but 7 instructions per local instead of 2
+MAX_UNROLLED_ZEROED_LOCALS = 8
+
+
+# Make room on the stack for a function's local variables, setting each one
+# to 0 unless it is in uninitialized_locals
+def write_local_variables(
+    function_name, number_of_local_variables, uninitialized_locals
+):
+    number_of_local_variables = int(number_of_local_variables)
+    if number_of_local_variables == 0:
+        return ""
+    zeroed_locals = [
+        local
+        for local in range(number_of_local_variables)
+        if local not in uninitialized_locals
+    ]
+    if len(zeroed_locals) > MAX_UNROLLED_ZEROED_LOCALS:
+        loop_label = f"{function_name}$ZERO_LOCALS"
+        return (
+            f"@{number_of_local_variables}\nD=A\n({loop_label})\n"
+            f"@SP\nAM=M+1\nA=A-1\nM=0\nD=D-1\n@{loop_label}\nD;JGT\n"
+        )
+    result = ""
+    if zeroed_locals:
+        result += "@SP\nA=M\n"
+        position = 0
+        for local in zeroed_locals:
+            result += "A=A+1\n" * (local - position) + "M=0\n"
+            position = local
+    # SP += number of local variables
+    if number_of_local_variables == 1:
+        return result + "@SP\nM=M+1\n"
+    if zeroed_locals and zeroed_locals[-1] == number_of_local_variables - 1:
+        return result + "D=A+1\n@SP\nM=D\n"
+    return result + f"@{number_of_local_variables}\nD=A\n@SP\nM=D+M\n"
+
 def write_call(function_to_call, function_number_of_arguments, current_function, call_counter):
     # Put callee address in R13, return address in R15, number of arguments in R14
     result = f"// call {function_to_call} {function_number_of_arguments}\n"
@@ -542,18 +643,193 @@ A=M
     return result
 
 
+TAIL_CALL_LABEL = "VM_TAIL_CALL"
+
+
+# A tail call (call f n / return in a function g) reuses g's frame, and f
+# runs as if g's caller had called it. If g has n arguments too, the frame
+# g's caller saved (return address, LCL, ARG, THIS, THAT) is already where
+# f's would be, and only f's arguments are moved down to ARG. Otherwise,
+# the saved frame is pushed again after f's arguments, then both are moved
+# down to ARG. Callee address in R13, number of arguments in R14.
+def write_common_tail_call_code():
+    # Move the words from R15 up to R14 down to SP, incrementing SP
+    def write_move_loop(loop_name):
+        return f"""
+({TAIL_CALL_LABEL}${loop_name})
+@R15
+D=M
+@R14
+D=D-M
+@{TAIL_CALL_LABEL}${loop_name}_DONE
+D;JGE
+@R15
+AM=M+1
+A=A-1
+D=M
+@SP
+AM=M+1
+A=A-1
+M=D
+@{TAIL_CALL_LABEL}${loop_name}
+0;JMP
+({TAIL_CALL_LABEL}${loop_name}_DONE)
+"""
+
+    # R15 = SP - D (first word to move), R14 = SP (end), then SP = ARG
+    set_up_move = """
+@SP
+D=M-D
+@R15
+M=D
+@SP
+D=M
+@R14
+M=D
+@ARG
+D=M
+@SP
+M=D
+"""
+    result = f"""
+({TAIL_CALL_LABEL})
+// g's number of arguments is LCL - ARG - 5
+@LCL
+D=M
+@ARG
+D=D-M
+@5
+D=D-A
+@R14
+D=D-M
+@{TAIL_CALL_LABEL}$NEW_FRAME
+D;JNE
+// move f's arguments down to ARG, then SP = LCL
+@R14
+D=M
+{set_up_move}{write_move_loop("MOVE_ARGUMENTS")}@LCL
+D=M
+@SP
+M=D
+@R13
+A=M
+0;JMP
+({TAIL_CALL_LABEL}$NEW_FRAME)
+"""
+    # push the saved frame, *(LCL-5) to *(LCL-1)
+    for offset in range(5, 0, -1):
+        result += f"@LCL\nD=M\n@{offset}\nA=D-A\nD=M\n@SP\nAM=M+1\nA=A-1\nM=D\n"
+    result += f"""// move f's arguments and the saved frame down to ARG, then LCL = SP
+@R14
+D=M
+@5
+D=D+A
+{set_up_move}{write_move_loop("MOVE_FRAME")}@SP
+D=M
+@LCL
+M=D
+@R13
+A=M
+0;JMP
+"""
+    return result
+
+
+# Leaf functions (at --optimize 2)
+#
+# A leaf function (see find_leaf_functions in call_graph.py) calls no other
+# function, so only its own code needs its frame. Its callers jump straight
+# to it with the return address in D, and it saves the return address and
+# only the registers it changes (saved_registers, e.g. LCL and ARG) instead
+# of the five that VM_CALL saves. Its first return writes the code that
+# restores them, and its other returns jump to that code.
+LEAF_FUNCTION_LEVEL = 2
+
+
+def get_leaf_return_label(function_name):
+    return f"{function_name}$LEAF_RETURN"
+
+
+def write_leaf_call(function_to_call, current_function, call_counter):
+    return_address = f"{current_function}$ret.{call_counter}"
+    return (
+        f"// call {function_to_call} (leaf)\n"
+        f"@{return_address}\nD=A\n@{function_to_call}\n0;JMP\n"
+        f"({return_address})\n"
+    )
+
+
+def write_leaf_function(
+    function_name, number_of_local_variables, leaf_function, uninitialized_locals=None
+):
+    saved_registers = leaf_function.saved_registers
+    result = (
+        f"// function {function_name} {number_of_local_variables} "
+        f"(leaf, saves {' '.join(saved_registers)})\n"
+    )
+    result += f"({function_name})\n"
+    # push the return address (in D), then the saved registers
+    result += write_push_d()
+    for register in saved_registers:
+        result += f"@{register}\nD=M\n" + write_push_d()
+    # LCL = SP, ARG = SP - frame size - number of arguments
+    frame_size = 1 + len(saved_registers)
+    result += (
+        f"@SP\nD=M\n@LCL\nM=D\n"
+        f"@{frame_size + leaf_function.number_of_arguments}\nD=D-A\n@ARG\nM=D\n"
+    )
+    if uninitialized_locals is not None:
+        return result + write_local_variables(
+            function_name, number_of_local_variables, uninitialized_locals
+        )
+    for _ in range(int(number_of_local_variables)):
+        result += write_pushpop("push", "constant", "0", "")
+    return result
+
+
+def write_leaf_return(function_name, leaf_function):
+    saved_registers = leaf_function.saved_registers
+    frame_size = 1 + len(saved_registers)
+    result = f"// return (leaf)\n({get_leaf_return_label(function_name)})\n"
+    result += (
+        f"// return address = *(LCL - {frame_size}) (R13)\n"
+        f"@LCL\nD=M\n@{frame_size}\nA=D-A\nD=M\n@R13\nM=D\n"
+    )
+    result += (
+        "// pop return value into *(ARG[0]), SP = ARG+1\n"
+        "@SP\nAM=M-1\nD=M\n@ARG\nA=M\nM=D\n@ARG\nD=M+1\n@SP\nM=D\n"
+    )
+    # Restore the saved registers from the top of the frame down, so LCL
+    # (saved first) is restored last
+    for position in reversed(range(len(saved_registers))):
+        offset = frame_size - 1 - position
+        register = saved_registers[position]
+        result += f"// {register} = *(LCL - {offset})\n"
+        if offset == 1:
+            result += "@LCL\nA=M-1\nD=M\n"
+        else:
+            result += f"@LCL\nD=M\n@{offset}\nA=D-A\nD=M\n"
+        result += f"@{register}\nM=D\n"
+    return result + "// goto return address\n@R13\nA=M\n0;JMP\n"
+
+
+# Labels are local to the function they are in
+def get_function_local_label(label_name, current_function):
+    return f"{current_function}${label_name}" if current_function else label_name
+
+
 def write_label(label_name, current_function):
-    label = f"{current_function}${label_name}" if current_function else label_name
+    label = get_function_local_label(label_name, current_function)
     return f"// label {label_name}\n({label})\n"
 
 
 def write_goto(label_name, current_function):
-    label = f"{current_function}${label_name}" if current_function else label_name
+    label = get_function_local_label(label_name, current_function)
     return f"// goto {label_name}\n@{label}\n0;JMP\n"
 
 
 def write_if_goto(label_name, current_function):
-    label = f"{current_function}${label_name}" if current_function else label_name
+    label = get_function_local_label(label_name, current_function)
     return f"""
 // if-goto {label_name}
 @SP
@@ -563,24 +839,8 @@ D=M
 D;JNE
 """
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "input_files", type=str, nargs="+", help="Input files containing vack vm code"
-    )
-    parser.add_argument(
-        "--write_prolog_and_epilog",
-        action="store_true",
-        help="Write prolog and epilog for testing (i.e. if no sys.Init)",
-    )
-    args = parser.parse_args()
-
-    # Globals for label generation
-    current_function = ""
-    label_counter = 0
-    call_counter = 0
-
-    os_prolog = """
+def write_os_prolog():
+    return """
 // Set stack pointer to 256, start of stack (stack grows to higher addresses)
 @256
 D=A
@@ -592,27 +852,1014 @@ M=D
 0;JMP
 
 """
-    assembly_code = write_prolog() if args.write_prolog_and_epilog else os_prolog
-
-    # loop over input files
-    for input_file in args.input_files:
-        # First, open the file
-        # list of vm commands
-        lines_to_parse = []
-        with open(input_file, "r") as opened_input_file:
-            for line in opened_input_file:
-                # remove leading and trailing whitespace
-                line = line.strip()
-                # ignore commented lines and empty lines, but add other
-                # lines for parsing
-                line = line.split("//", 1)[0].strip()
-                if not line:
-                    continue
-                # convert tabs to spaces and remove newline characters
-                lines_to_parse.append(line.replace("\t", " ").replace("\n", ""))
-
-        current_file_stem = Path(input_file).stem
 
+
+# Comments the jack compiler writes in .vm files (see write_vm_code in
+# compiler/vm_ir.py)
+SOURCE_COMMENT_PREFIX = "// source "
+UNINITIALIZED_LOCALS_COMMENT_PREFIX = "// uninitialized_locals "
+
+
+# Read a file of vm code, yielding the commands to translate (see
+# VMCommand) with their source location: the line of the file, and the
+# jack file and line given by the last "// source File.jack:line" comment
+# (if any). The locals listed by a "// uninitialized_locals 1 3" comment
+# are set as the uninitialized_locals of the function command after it.
+def iterate_vm_commands(input_file):
+    vm_file_name = Path(input_file).name
+    jack_file_name = ""
+    jack_line = 0
+    uninitialized_locals = ()
+    index = 0
+    with open(input_file, "r") as opened_input_file:
+        for line_number, line in enumerate(opened_input_file, start=1):
+            # remove leading and trailing whitespace
+            line = line.strip()
+            if line.startswith(SOURCE_COMMENT_PREFIX):
+                jack_source = line[len(SOURCE_COMMENT_PREFIX) :].strip()
+                jack_file_name, _, jack_line = jack_source.rpartition(":")
+                jack_line = int(jack_line)
+                continue
+            if line.startswith(UNINITIALIZED_LOCALS_COMMENT_PREFIX):
+                locals_words = line[len(UNINITIALIZED_LOCALS_COMMENT_PREFIX) :]
+                uninitialized_locals = tuple(map(int, locals_words.split()))
+                continue
+            # ignore commented lines and empty lines, but add other
+            # lines for parsing
+            line = line.split("//", 1)[0].strip()
+            if not line:
+                continue
+            # convert tabs to spaces and remove newline characters
+            line = line.replace("\t", " ").replace("\n", "")
+            words = parse_vm_words(line)
+            yield VMCommand(
+                text=line,
+                words=words,
+                vm_file_name=vm_file_name,
+                vm_line=line_number,
+                jack_file_name=jack_file_name,
+                jack_line=jack_line,
+                index=index,
+                uninitialized_locals=(
+                    uninitialized_locals if words[0] == "function" else ()
+                ),
+            )
+            uninitialized_locals = ()
+            index += 1
+
+
+# The commands to translate for vm code compiled in the same process
+# (a list of VMInstructions, see compiler/vm_ir.py), built from the fields
+# of each instruction. They are the same as iterate_vm_commands gives for
+# the .vm file vm_file_name written from the instructions, without writing
+# and reading that file. Only a process that also compiles jack code has
+# instructions to pass, so it has the compiler on its path (see
+# scripts/build.py).
+def iterate_vm_instructions(instructions, vm_file_name, jack_file_name=""):
+    from vm_ir import vm_code_lines
+
+    jack_line = 0
+    index = 0
+    lines = vm_code_lines(instructions, jack_file_name)
+    for line_number, instruction in enumerate(lines, start=1):
+        # skip the comment lines
+        if isinstance(instruction, str):
+            continue
+        if jack_file_name and instruction.jack_line:
+            jack_line = instruction.jack_line
+        words = instruction.words()
+        yield VMCommand(
+            text=" ".join(words),
+            words=words,
+            vm_file_name=vm_file_name,
+            vm_line=line_number,
+            jack_file_name=jack_file_name if jack_line else "",
+            jack_line=jack_line,
+            index=index,
+            uninitialized_locals=instruction.uninitialized_locals,
+        )
+        index += 1
+
+
+# Read a file of vm code, returning the list of commands to translate
+def read_vm_commands(input_file):
+    return list(iterate_vm_commands(input_file))
+
+
+# Optimizations (opt-in with --optimize LEVEL)
+#
+# Each optimization pattern is called with the VMTranslator, the next few
+# vm commands and the file stem. If the first commands match, it returns
+# the number of commands matched and hack assembly with the same effect in
+# fewer instructions; otherwise it returns None.
+# Patterns only match straight-line sequences of commands (no labels,
+# branches, calls or returns inside a sequence), so no jump can land in the
+# middle of the optimized code.
+
+# Every instruction takes the same number of clock cycles (see
+# CLOCK_CYCLES_PER_INSTRUCTION in assembler/peephole.py)
+CLOCK_CYCLES_PER_INSTRUCTION = 10
+
+# Names of the registers at the fixed addresses of the pointer and uart
+# segments
+pointer_registers = ["THIS", "THAT"]
+uart_registers = ["TX", "RX", "UARTSTAT"]
+
+# Segments addressed through a pointer register (e.g. local i is at LCL+i)
+indirect_segments = ["local", "argument", "this", "that"]
+
+# Above these indices, an access to an indirect segment computes the
+# address with D=A/D+M instead of incrementing A once per index: a load
+# (5 words); a store of a value loaded after the address is computed into
+# R13 (9 words plus the load); a pop (9 words) or a store of D parked at
+# the free stack slot above the top of the stack (12 words), which add the
+# address to the value and subtract it back (see write_store_address_plus_m)
+MAX_INDEX_FOR_INCREMENTED_LOAD = 2
+MAX_INDEX_FOR_INCREMENTED_ADDRESS = 6
+MAX_INDEX_FOR_INCREMENTED_POP = 4
+MAX_INDEX_FOR_INCREMENTED_STORE_OF_D = 9
+
+
+# Symbol for the address of segment[index], for segments whose addresses
+# are known at translation time; None for other segments. The writers
+# below check segment[index] (see check_pushpop_index) before using it.
+def get_fixed_address(segment, index, file_stem):
+    match segment:
+        case "static":
+            return get_static_label(file_stem, index)
+        case "temp":
+            return f"R{5 + int(index)}"
+        case "pointer":
+            return pointer_registers[int(index)]
+        case "uart":
+            return uart_registers[int(index)]
+    return None
+
+
+# D = segment[index]
+def write_load_into_d(segment, index, file_stem):
+    check_pushpop_index(segment, index)
+    index = int(index)
+    if segment == "constant":
+        if index in [0, 1]:
+            return f"D={index}\n"
+        return f"@{index}\nD=A\n"
+    fixed_address = get_fixed_address(segment, index, file_stem)
+    if fixed_address is not None:
+        return f"@{fixed_address}\nD=M\n"
+    base_address = base_address_of_segments[segment]
+    if index <= MAX_INDEX_FOR_INCREMENTED_LOAD:
+        return f"@{base_address}\n" + write_increment_address(index) + "D=M\n"
+    return f"@{index}\nD=A\n@{base_address}\nA=D+M\nD=M\n"
+
+
+# A = M + index, for A pointing at a segment's base address register
+def write_increment_address(index):
+    if index == 0:
+        return "A=M\n"
+    return "A=M+1\n" + "A=A+1\n" * (index - 1)
+
+
+# segment[index] = D. load_value is the code that loads the value into D;
+# it runs after the address is computed if the address needs R13.
+def write_store_from_d(segment, index, file_stem, load_value):
+    check_pushpop_index(segment, index)
+    index = int(index)
+    fixed_address = get_fixed_address(segment, index, file_stem)
+    if fixed_address is not None:
+        return f"{load_value}@{fixed_address}\nM=D\n"
+    base_address = base_address_of_segments[segment]
+    if index <= MAX_INDEX_FOR_INCREMENTED_ADDRESS:
+        return f"{load_value}@{base_address}\n{write_increment_address(index)}M=D\n"
+    return (
+        f"@{index}\nD=A\n@{base_address}\nD=D+M\n@R13\nM=D\n"
+        f"{load_value}@R13\nA=M\nM=D\n"
+    )
+
+
+# segment[index] = M, where A = the address of the value (one of the
+# stack's slots) after the value address loads A. D = segment[index]'s
+# address + the value, then A = D - value = the address, and M = D - A =
+# the value, so no register holds the address.
+def write_store_address_plus_m(segment, index, value_address):
+    return (
+        f"@{index}\nD=A\n@{base_address_of_segments[segment]}\nD=D+M\n"
+        f"{value_address}D=D+M\nA=D-M\nM=D-A\n"
+    )
+
+
+# segment[index] = D, for a value already in D (parked in the free stack
+# slot above the top of the stack if the address cannot be reached by
+# incrementing A)
+def write_store_d(segment, index, file_stem):
+    check_pushpop_index(segment, index)
+    if get_fixed_address(segment, index, file_stem) is not None:
+        return write_store_from_d(segment, index, file_stem, "")
+    if int(index) <= MAX_INDEX_FOR_INCREMENTED_STORE_OF_D:
+        return (
+            f"@{base_address_of_segments[segment]}\n"
+            f"{write_increment_address(int(index))}M=D\n"
+        )
+    return "@SP\nA=M\nM=D\n" + write_store_address_plus_m(
+        segment, index, "@SP\nA=M\n"
+    )
+
+
+# pop segment index: pop the top of the stack into segment[index]
+def write_pop(segment, index, file_stem):
+    check_pushpop_index(segment, index)
+    pop_into_d = "@SP\nAM=M-1\nD=M\n"
+    if get_fixed_address(segment, index, file_stem) is not None:
+        return write_store_from_d(segment, index, file_stem, pop_into_d)
+    if int(index) <= MAX_INDEX_FOR_INCREMENTED_POP:
+        return (
+            f"{pop_into_d}@{base_address_of_segments[segment]}\n"
+            f"{write_increment_address(int(index))}M=D\n"
+        )
+    return write_store_address_plus_m(segment, index, "@SP\nAM=M-1\n")
+
+
+# push segment index: push segment[index] onto the stack
+def write_push(segment, index, file_stem):
+    if segment == "constant":
+        check_pushpop_index(segment, index)
+        return write_push_word(int(index))
+    return write_load_into_d(segment, index, file_stem) + write_push_d()
+
+
+# push X / pop Y: move X to Y through D, without touching the stack
+def fuse_push_pop(vm_translator, commands, file_stem):
+    if len(commands) < 2:
+        return None
+    push, pop = commands[0].words, commands[1].words
+    if push[0] != "push" or pop[0] != "pop" or pop[1] == "constant":
+        return None
+    if push[1:] == pop[1:]:
+        # pushing a value and popping it back where it was changes nothing
+        check_pushpop_index(push[1], push[2])
+        return 2, f"// push {push[1]} {push[2]} / pop {pop[1]} {pop[2]}\n"
+    return 2, (
+        f"// push {push[1]} {push[2]} / pop {pop[1]} {pop[2]}\n"
+        + vm_translator.write_spill()
+        + write_store_from_d(
+            pop[1], pop[2], file_stem, write_load_into_d(push[1], push[2], file_stem)
+        )
+    )
+
+
+# push X or pop X on its own: the cheapest code for the segment and index
+# (see write_push and write_pop). When the top of the stack is kept in D,
+# pushes and pops of D are left to
+# VMTranslator.translate_command_with_top_of_stack_in_d.
+def specialize_addressing(vm_translator, commands, file_stem):
+    command_words = commands[0].words
+    if command_words[0] not in pushpop_commands or command_words[:2] == [
+        "pop",
+        "constant",
+    ]:
+        return None
+    command, segment, index = command_words[:3]
+    if vm_translator.caches_top_of_stack and (
+        command == "push" or vm_translator.top_of_stack_in_d
+    ):
+        return None
+    writer = write_push if command == "push" else write_pop
+    return 1, f"// {command} {segment} {index}\n" + writer(segment, index, file_stem)
+
+
+# pop pointer 1 / push X / pop that 0: the end of the array store in every
+# "let a[i] = expression" in compiled jack code (X is temp 0, holding the
+# value of the expression). Sets THAT from the stack, then moves X to
+# THAT[0] through D.
+def fuse_array_store(vm_translator, commands, file_stem):
+    if len(commands) < 3:
+        return None
+    pop_pointer, push, pop_that = (command.words for command in commands[:3])
+    if (
+        pop_pointer != ["pop", "pointer", "1"]
+        or push[0] != "push"
+        or pop_that != ["pop", "that", "0"]
+    ):
+        return None
+    return 3, (
+        f"// pop pointer 1 / push {push[1]} {push[2]} / pop that 0\n"
+        + vm_translator.write_pop_into_d()
+        + "@THAT\nM=D\n"
+        + write_store_from_d(
+            "that", "0", file_stem, write_load_into_d(push[1], push[2], file_stem)
+        )
+    )
+
+
+# Arithmetic on constants, with 16-bit two's complement words (stored
+# as 0 to 65535) like the hack ALU
+unary_arithmetic_commands = ["neg", "not"]
+binary_arithmetic_commands = ["add", "sub", "eq", "gt", "lt", "and", "or"]
+TRUE_WORD = 0xFFFF
+
+
+def to_signed(word):
+    return word - 0x10000 if word & 0x8000 else word
+
+
+def fold_arithmetic(command, x, y=None):
+    match command:
+        case "neg":
+            return -x & 0xFFFF
+        case "not":
+            return ~x & 0xFFFF
+        case "add":
+            return (x + y) & 0xFFFF
+        case "sub":
+            return (x - y) & 0xFFFF
+        case "and":
+            return x & y
+        case "or":
+            return x | y
+        case "eq":
+            return TRUE_WORD if x == y else 0
+        case "gt":
+            return TRUE_WORD if to_signed(x) > to_signed(y) else 0
+        case "lt":
+            return TRUE_WORD if to_signed(x) < to_signed(y) else 0
+
+
+# Computations the hack ALU can do on any word in one instruction
+comp_for_word = {0: "0", 1: "1", TRUE_WORD: "-1"}
+
+
+# D = word (any 16-bit word; an A instruction can only load 0 to 32767)
+def write_load_word_into_d(word):
+    if word in comp_for_word:
+        return f"D={comp_for_word[word]}\n"
+    if word <= 32767:
+        return f"@{word}\nD=A\n"
+    return f"@{~word & 0xFFFF}\nD=!A\n"
+
+
+# push D (or comp, if given) onto the stack
+def write_push_d(comp="D"):
+    return f"@SP\nAM=M+1\nA=A-1\nM={comp}\n"
+
+
+def write_push_word(word):
+    if word in comp_for_word:
+        return write_push_d(comp_for_word[word])
+    return write_load_word_into_d(word) + write_push_d()
+
+
+# push constant / neg / not / add / ... : evaluate arithmetic on constants
+# at translation time (e.g. push constant 1 / neg, the translation of
+# true), then push the results, or pop the last one straight to a segment
+# if the next command pops it
+def fold_constants(vm_translator, commands, file_stem):
+    stack = []
+    folded = None
+    for number_of_commands, command in enumerate(commands, start=1):
+        words = command.words
+        if words[:2] == ["push", "constant"]:
+            check_pushpop_index("constant", words[2])
+            stack.append(int(words[2]))
+            continue
+        if words[0] in unary_arithmetic_commands and stack:
+            stack[-1] = fold_arithmetic(words[0], stack[-1])
+        elif words[0] in binary_arithmetic_commands and len(stack) >= 2:
+            y = stack.pop()
+            stack[-1] = fold_arithmetic(words[0], stack[-1], y)
+        else:
+            break
+        folded = (number_of_commands, list(stack))
+    if folded is None:
+        return None
+    number_of_commands, words = folded
+    comment = " / ".join(command.text for command in commands[:number_of_commands])
+    assembly_code = f"// fold {comment}\n" + vm_translator.write_spill()
+    assembly_code += "".join(write_push_word(word) for word in words[:-1])
+    if number_of_commands < len(commands):
+        pop = commands[number_of_commands].words
+        if pop[0] == "pop" and pop[1] != "constant":
+            return number_of_commands + 1, assembly_code + write_store_from_d(
+                pop[1], pop[2], file_stem, write_load_word_into_d(words[-1])
+            )
+    return number_of_commands, assembly_code + vm_translator.write_push_word(
+        words[-1]
+    )
+
+
+# Computations of D op A and M op D, for arithmetic with a constant operand
+d_comp_with_a = {"add": "D+A", "sub": "D-A", "and": "D&A", "or": "D|A"}
+m_comp_with_d = {"add": "D+M", "sub": "M-D", "and": "D&M", "or": "D|M"}
+constant_operand_commands = list(d_comp_with_a)
+
+
+# Computation of (value) op constant, where value is the register D or M,
+# if it needs no other register: None otherwise
+def comp_with_constant(command, value, constant):
+    if constant == 0:
+        return "0" if command == "and" else value
+    if constant == 1 and command in ["add", "sub"]:
+        return f"{value}+1" if command == "add" else f"{value}-1"
+    return None
+
+
+# [push X] / push constant c / add|sub|and|or [/ pop Y]: compute with c as
+# an immediate operand instead of pushing it. Without push X, works on the
+# top of the stack in place (e.g. M=M+1). With push X, computes X op c in
+# D, then pushes it or, if the next command pops it, stores it in Y.
+def specialize_constant_operand(vm_translator, commands, file_stem):
+    words = [command.words for command in commands[:4]]
+    if (
+        len(words) >= 2
+        and words[0][:2] == ["push", "constant"]
+        and words[1][0] in constant_operand_commands
+    ):
+        # top of stack op c
+        check_pushpop_index("constant", words[0][2])
+        command, constant = words[1][0], int(words[0][2])
+        comment = f"// {commands[0].text} / {commands[1].text}\n"
+        if vm_translator.top_of_stack_in_d:
+            comp = comp_with_constant(command, "D", constant)
+            if comp == "D":
+                return 2, comment
+            if comp is not None:
+                return 2, comment + f"D={comp}\n"
+            return 2, comment + f"@{constant}\nD={d_comp_with_a[command]}\n"
+        comp = comp_with_constant(command, "M", constant)
+        if comp == "M":
+            return 2, comment
+        if comp is not None:
+            return 2, comment + f"@SP\nA=M-1\nM={comp}\n"
+        return 2, (
+            comment + f"@{constant}\nD=A\n@SP\nA=M-1\nM={m_comp_with_d[command]}\n"
+        )
+    if (
+        len(words) >= 3
+        and words[0][0] == "push"
+        and words[1][:2] == ["push", "constant"]
+        and words[2][0] in constant_operand_commands
+    ):
+        # X op c in D
+        check_pushpop_index("constant", words[1][2])
+        command, constant = words[2][0], int(words[1][2])
+        comp = comp_with_constant(command, "D", constant)
+        spill = vm_translator.write_spill()
+        load_value = write_load_into_d(words[0][1], words[0][2], file_stem)
+        if comp is None:
+            load_value += f"@{constant}\nD={d_comp_with_a[command]}\n"
+        elif comp != "D":
+            load_value += f"D={comp}\n"
+        comment = "// " + " / ".join(command.text for command in commands[:3])
+        if len(words) >= 4 and words[3][0] == "pop" and words[3][1] != "constant":
+            return 4, (
+                f"{comment} / {commands[3].text}\n"
+                + spill
+                + write_store_from_d(words[3][1], words[3][2], file_stem, load_value)
+            )
+        return 3, f"{comment}\n" + spill + load_value + vm_translator.write_push_d()
+    return None
+
+
+# Jump conditions on x - y that are true when x eq|gt|lt y, and when not
+comparison_jumps = {"eq": ("JEQ", "JNE"), "gt": ("JGT", "JLE"), "lt": ("JLT", "JGE")}
+
+
+# eq|gt|lt [/ not ...] / if-goto L: jump on the comparison itself, instead
+# of pushing a true or false result and popping it again to test it. If
+# the compiler's "goto F / label L" follows (as in every jack if and
+# while), jumps to F if the comparison is false instead, leaving out the
+# goto. Like the inline gt and lt, only subtracts if x and y have the same
+# sign, so x - y cannot overflow.
+def fuse_compare_and_branch(vm_translator, commands, file_stem):
+    if not commands or commands[0].words[0] not in comparison_jumps:
+        return None
+    comparison = commands[0].words[0]
+    if comparison != "eq" and vm_translator.shares_comparison(commands[0], file_stem):
+        # a shared gt or lt and an if-goto are smaller than a fused one
+        return None
+    number_of_commands = 1
+    negated = False
+    while (
+        number_of_commands < len(commands)
+        and commands[number_of_commands].words[0] == "not"
+    ):
+        negated = not negated
+        number_of_commands += 1
+    if (
+        number_of_commands == len(commands)
+        or commands[number_of_commands].words[0] != "if-goto"
+    ):
+        return None
+    target = commands[number_of_commands].words[1]
+    number_of_commands += 1
+    following = [
+        command.words
+        for command in commands[number_of_commands : number_of_commands + 2]
+    ]
+    if (
+        len(following) == 2
+        and following[0][0] == "goto"
+        and following[1] == ["label", target]
+    ):
+        negated = not negated
+        target = following[0][1]
+        number_of_commands += 1
+    comment = " / ".join(command.text for command in commands[:number_of_commands])
+    return number_of_commands, f"// {comment}\n" + write_compare_and_branch(
+        vm_translator, comparison, negated, target, file_stem
+    )
+
+
+# Pop y and x and jump to label_name if x comparison y (or, if negated,
+# if not)
+def write_compare_and_branch(vm_translator, comparison, negated, label_name, file_stem):
+    target_label = get_function_local_label(label_name, vm_translator.current_function)
+    jump = comparison_jumps[comparison][negated]
+    assembly_code = vm_translator.write_pop_into_d()
+    if comparison == "eq":
+        return assembly_code + f"@SP\nAM=M-1\nD=M-D\n@{target_label}\nD;{jump}\n"
+
+    vm_translator.label_counter += 1
+    counter = vm_translator.label_counter - 1
+    comparison_type = comparison.upper()
+    x_negative_label = get_comparison_label(file_stem, counter, comparison_type, "XNEG")
+    same_sign_label = get_comparison_label(
+        file_stem, counter, comparison_type, "SAMESIGN"
+    )
+    end_label = get_comparison_label(file_stem, counter, comparison_type, "END")
+    # If x and y have different signs, x > y if x is not negative
+    x_greater = target_label if (comparison == "gt") != negated else end_label
+    x_less = target_label if (comparison == "lt") != negated else end_label
+    return assembly_code + (
+        "// y in R13, x in D and RAM[SP]\n"
+        f"@R13\nM=D\n@SP\nAM=M-1\nD=M\n@{x_negative_label}\nD;JLT\n"
+        f"@R13\nD=M\n@{same_sign_label}\nD;JGE\n@{x_greater}\n0;JMP\n"
+        f"({x_negative_label})\n"
+        f"@R13\nD=M\n@{same_sign_label}\nD;JLT\n@{x_less}\n0;JMP\n"
+        f"({same_sign_label})\n"
+        "// D holds y: jump on x - y\n"
+        f"@SP\nA=M\nD=M-D\n@{target_label}\nD;{jump}\n"
+        f"({end_label})\n"
+    )
+
+
+# call f n / return: a tail call, where f takes over the frame of the
+# function returning its result (see write_common_tail_call_code), so
+# recursion in tail position runs in constant stack space
+def fuse_tail_call(vm_translator, commands, file_stem):
+    if len(commands) < 2 or not vm_translator.current_function:
+        return None
+    call, return_command = commands[0].words, commands[1].words
+    if call[0] != "call" or return_command[0] != "return":
+        return None
+    from call_graph import ENTRY_FUNCTION
+
+    if vm_translator.current_function == ENTRY_FUNCTION:
+        # the entry function is entered by a jump (see write_os_prolog), so
+        # there is no caller's frame to return to
+        return None
+    if call[1] in vm_translator.leaf_functions:
+        # leaf functions are entered with the return address in D, not
+        # through a frame VM_TAIL_CALL could reuse
+        return None
+    vm_translator.runtime_routines_used.add(TAIL_CALL_LABEL)
+    return 2, (
+        f"// {commands[0].text} / return (tail call)\n"
+        + vm_translator.write_spill()
+        + f"@{call[1]}\nD=A\n@R13\nM=D\n@{call[2]}\nD=A\n@R14\nM=D\n"
+        f"@{TAIL_CALL_LABEL}\n0;JMP\n"
+    )
+
+
+# Optimization patterns in the order they are tried, with the --optimize
+# level that enables each (each level includes the levels below it)
+optimization_patterns_in_order = [
+    (2, fuse_compare_and_branch),
+    (2, fuse_tail_call),
+    (2, fold_constants),
+    (2, specialize_constant_operand),
+    (1, fuse_array_store),
+    (1, fuse_push_pop),
+    (1, specialize_addressing),
+]
+
+# Longest sequence of vm commands any pattern looks at
+OPTIMIZATION_WINDOW = 8
+
+# --optimize level that keeps the top of the stack in D between commands
+# (see VMTranslator.translate_command_with_top_of_stack_in_d)
+TOP_OF_STACK_IN_D_LEVEL = 3
+
+
+def optimization_patterns(level):
+    return [
+        pattern
+        for pattern_level, pattern in optimization_patterns_in_order
+        if pattern_level <= level
+    ]
+
+
+@dataclass
+class OptimizationReport:
+    # pattern name -> number of times it was applied
+    matches_by_pattern: dict[str, int] = field(default_factory=dict)
+    # pattern name -> instructions saved (summed over all matches)
+    words_saved_by_pattern: dict[str, int] = field(default_factory=dict)
+
+    def count(self, pattern, words_saved, matches=1):
+        self.matches_by_pattern[pattern] = (
+            self.matches_by_pattern.get(pattern, 0) + matches
+        )
+        self.words_saved_by_pattern[pattern] = (
+            self.words_saved_by_pattern.get(pattern, 0) + words_saved
+        )
+
+    # Add the counts of another report (e.g. of one module) to this one
+    def add(self, report):
+        for pattern, words_saved in report.words_saved_by_pattern.items():
+            self.count(pattern, words_saved, report.matches_by_pattern[pattern])
+
+    def summary(self):
+        total_words_saved = sum(self.words_saved_by_pattern.values())
+        lines = [
+            f"VM optimizations: {total_words_saved} words saved, "
+            f"{total_words_saved * CLOCK_CYCLES_PER_INSTRUCTION} clock cycles "
+            f"saved per pass through the optimized code"
+        ]
+        for pattern, words_saved in self.words_saved_by_pattern.items():
+            matches = self.matches_by_pattern[pattern]
+            cycles_saved = words_saved * CLOCK_CYCLES_PER_INSTRUCTION
+            lines.append(
+                f"  {pattern}: {matches} matches, {words_saved} words, "
+                f"{cycles_saved} cycles ({cycles_saved / matches:.0f} per match)"
+            )
+        return "\n".join(lines)
+
+
+# One vm command: its text, its words (with the command name, and the
+# segment of a push or pop, in lower case), where it was read from (the
+# vm file and line, and the jack file and line it was compiled from, if
+# known) and its position among the commands of its file. A function
+# command's uninitialized_locals are the locals it assigns before reading
+# them (see write_local_variables).
+@dataclass
+class VMCommand:
+    text: str
+    words: list[str]
+    vm_file_name: str = ""
+    vm_line: int = 0
+    jack_file_name: str = ""
+    jack_line: int = 0
+    index: int = 0
+    uninitialized_locals: tuple[int, ...] = ()
+
+    # Source location passed on to the assembler: "File.vm:line", followed
+    # by "File.jack:line" if known
+    @property
+    def source(self):
+        if not self.vm_file_name:
+            return ""
+        if not self.jack_file_name:
+            return f"{self.vm_file_name}:{self.vm_line}"
+        return (
+            f"{self.vm_file_name}:{self.vm_line} "
+            f"{self.jack_file_name}:{self.jack_line}"
+        )
+
+
+# The words of a line of vm code, with the command name, and the segment
+# of a push or pop, in lower case
+def parse_vm_words(line):
+    words = line.split()
+    words[0] = words[0].lower()
+    if words[0] in pushpop_commands:
+        words[1] = words[1].lower()
+    return words
+
+
+# A vm command from a line of vm code (without comments), with no source
+# location
+def parse_vm_command(line, index=0):
+    return VMCommand(text=line.strip(), words=parse_vm_words(line), index=index)
+
+
+# A comparison translated inline, which could use a shared routine instead.
+# in_loop is set if a jump back to an earlier label of the same function
+# follows it, so it likely runs many times.
+@dataclass
+class ComparisonSite:
+    file_stem: str
+    index: int
+    command: str
+    in_loop: bool = False
+
+    def key(self):
+        return (self.file_stem, self.index)
+
+
+# Choose comparison sites to share until a program of program_words words
+# fits in rom_budget words: first sites outside loops, where the extra
+# instructions of a shared comparison run least often, and among those the
+# sites that save the most words. Sharing the first comparison of a kind
+# adds its shared routine to the program. Returns the keys of the chosen
+# sites and the words of the program with them shared.
+def choose_shared_comparison_sites(comparison_sites, program_words, rom_budget):
+    words_saved_by_command = {
+        command: count_assembly_words(write_arithmetic(command, "", 0))
+        - count_assembly_words(write_shared_comparison_call(command, "", 0))
+        for command in shared_comparison_commands
+    }
+    chosen_keys = set()
+    shared_commands = set()
+    for site in sorted(
+        comparison_sites,
+        key=lambda site: (site.in_loop, -words_saved_by_command[site.command]),
+    ):
+        if program_words <= rom_budget:
+            break
+        chosen_keys.add(site.key())
+        program_words -= words_saved_by_command[site.command]
+        if site.command not in shared_commands:
+            shared_commands.add(site.command)
+            program_words += count_assembly_words(write_shared_comparison(site.command))
+    return chosen_keys, program_words
+
+
+# Translates vm code to hack assembly, one vm command at a time.
+# Comparison labels start with the file stem and are numbered from 0 in
+# each file, so the assembly code of a file depends only on its own vm code
+# and the translator's options (see TranslationCache). With an optimization
+# level above 0, sequences of commands matching an optimization pattern
+# are translated together, and the savings are counted in report.
+# Comparisons call shared routines if share_all_comparisons is set, or if
+# their site's key is in shared_comparison_sites; the sites of those left
+# inline are collected in comparison_sites. The labels of the optional
+# runtime routines the translated code uses (e.g. VM_GT) are collected in
+# runtime_routines_used. Calls to and returns from the functions in
+# leaf_functions (see find_leaf_functions in call_graph.py) use the leaf
+# function calling convention.
+class VMTranslator:
+    label_counter: int
+    optimization_level: int
+    optimization_patterns: list
+    report: OptimizationReport
+    caches_top_of_stack: bool
+    top_of_stack_in_d: bool
+    share_all_comparisons: bool
+    shared_comparison_sites: set
+    runtime_routines_used: set
+    comparison_sites: list
+    leaf_functions: dict
+    current_function: str
+    call_counter: int
+    leaf_return_written: bool
+
+    def __init__(
+        self,
+        optimization_level=0,
+        report=None,
+        share_all_comparisons=False,
+        shared_comparison_sites=(),
+        leaf_functions=None,
+    ):
+        self.label_counter = 0
+        self.optimization_level = optimization_level
+        self.optimization_patterns = optimization_patterns(optimization_level)
+        self.report = report if report is not None else OptimizationReport()
+        self.caches_top_of_stack = optimization_level >= TOP_OF_STACK_IN_D_LEVEL
+        self.writes_local_variables_compactly = (
+            optimization_level >= LOCAL_VARIABLES_LEVEL
+        )
+        self.top_of_stack_in_d = False
+        self.share_all_comparisons = share_all_comparisons
+        self.shared_comparison_sites = set(shared_comparison_sites)
+        self.runtime_routines_used = set()
+        self.comparison_sites = []
+        # label -> number of comparison sites before it, in the current function
+        self.label_comparison_sites = {}
+        self.leaf_functions = leaf_functions if leaf_functions is not None else {}
+        self.current_function = ""
+        self.call_counter = 0
+        self.leaf_return_written = False
+
+    # Translate the vm code of one file, yielding the assembly code for
+    # each vm command (or optimized sequence of commands) as it is
+    # translated
+    def translate(self, commands, file_stem):
+        self.label_counter = 0
+        self.current_function = ""
+        self.call_counter = 0
+        self.label_comparison_sites = {}
+        window_size = OPTIMIZATION_WINDOW if self.optimization_patterns else 1
+        window = deque()
+        for command in commands:
+            window.append(command)
+            if len(window) == window_size:
+                yield from self.translate_next_commands(window, file_stem)
+        while window:
+            yield from self.translate_next_commands(window, file_stem)
+        yield self.write_spill()
+
+    # Translate the first command in the window, or the first few if they
+    # match an optimization pattern, removing them from the window
+    def translate_next_commands(self, window, file_stem):
+        commands = list(window)
+        for pattern in self.optimization_patterns:
+            match = pattern(self, commands, file_stem)
+            if match is None:
+                continue
+            number_of_commands, assembly_code = match
+            matched_commands = commands[:number_of_commands]
+            for command in matched_commands:
+                window.popleft()
+                yield write_source_comment(command)
+            self.report.count(
+                pattern.__name__,
+                self.count_unoptimized_words(matched_commands, file_stem)
+                - count_assembly_words(assembly_code),
+            )
+            yield assembly_code
+            return
+        command = window.popleft()
+        self.record_comparison_site(command, file_stem)
+        yield write_source_comment(command)
+        if not self.caches_top_of_stack:
+            yield self.translate_command(command, file_stem)
+            return
+        assembly_code = self.translate_command_with_top_of_stack_in_d(
+            command, file_stem
+        )
+        self.report.count(
+            "top_of_stack_in_d",
+            self.count_unoptimized_words([command], file_stem)
+            - count_assembly_words(assembly_code),
+        )
+        yield assembly_code
+
+    # Top of the stack caching (at --optimize 3)
+    #
+    # While top_of_stack_in_d is set, the value on top of the stack is in D
+    # instead of memory, and SP points just past the rest of the stack.
+    # Straight-line code then passes each result to the next command in D,
+    # instead of writing it to the stack and reading it back. The top of
+    # the stack is written back to memory ("spilled") before labels, jumps,
+    # calls, returns and functions, so the stack is in memory wherever
+    # control flow joins or leaves.
+
+    # Write the top of the stack back to memory, if it is in D
+    def write_spill(self):
+        if not self.top_of_stack_in_d:
+            return ""
+        self.top_of_stack_in_d = False
+        return write_push_d()
+
+    # Pop the top of the stack into D
+    def write_pop_into_d(self):
+        if self.top_of_stack_in_d:
+            self.top_of_stack_in_d = False
+            return ""
+        return "@SP\nAM=M-1\nD=M\n"
+
+    # push D (or comp, if given), leaving it in D when caching the top of
+    # the stack
+    def write_push_d(self, comp="D"):
+        if not self.caches_top_of_stack:
+            return write_push_d(comp)
+        self.top_of_stack_in_d = True
+        return "" if comp == "D" else f"D={comp}\n"
+
+    def write_push_word(self, word):
+        if not self.caches_top_of_stack:
+            return write_push_word(word)
+        self.top_of_stack_in_d = True
+        return write_load_word_into_d(word)
+
+    # Translate one vm command, keeping the top of the stack in D where
+    # the command allows it
+    def translate_command_with_top_of_stack_in_d(self, command, file_stem):
+        command_words = command.words
+        command_name = command_words[0]
+        comment = f"// {command.text} (top of stack in D)\n"
+        if command_name == "push":
+            segment, index = command_words[1], command_words[2]
+            assembly_code = self.write_spill()
+            assembly_code += write_load_into_d(segment, index, file_stem)
+            self.top_of_stack_in_d = True
+            return comment + assembly_code
+        elif (
+            command_name == "pop"
+            and command_words[1] != "constant"
+            and self.top_of_stack_in_d
+        ):
+            segment, index = command_words[1], command_words[2]
+            self.top_of_stack_in_d = False
+            return comment + write_store_d(segment, index, file_stem)
+        elif command_name in d_comp_with_a:
+            # y is popped into D, x is at the new top of the memory stack
+            assembly_code = self.write_pop_into_d()
+            self.top_of_stack_in_d = True
+            return (
+                comment
+                + assembly_code
+                + f"@SP\nAM=M-1\nD={m_comp_with_d[command_name]}\n"
+            )
+        elif command_name in unary_arithmetic_commands and self.top_of_stack_in_d:
+            return comment + ("D=-D\n" if command_name == "neg" else "D=!D\n")
+        elif command_name == "eq" and not self.shares_comparison(command, file_stem):
+            # D = x - y, then D = -1 if it is 0 (x == y) and 0 otherwise
+            self.label_counter += 1
+            true_label = get_comparison_label(
+                file_stem, self.label_counter - 1, "EQ", "TRUE"
+            )
+            assembly_code = self.write_pop_into_d()
+            self.top_of_stack_in_d = True
+            return comment + assembly_code + (
+                f"@SP\nAM=M-1\nD=M-D\n@{true_label}\nD;JEQ\nD=1\n"
+                f"({true_label})\nD=D-1\n"
+            )
+        elif command_name == "if-goto" and self.top_of_stack_in_d:
+            self.top_of_stack_in_d = False
+            label = get_function_local_label(command_words[1], self.current_function)
+            return comment + f"@{label}\nD;JNE\n"
+        # Otherwise, translate the command with the stack in memory
+        return self.write_spill() + self.translate_command(command, file_stem)
+
+    # Record the site of a comparison translated inline, and mark the
+    # sites before a jump back to an earlier label as in a loop
+    def record_comparison_site(self, command, file_stem):
+        command_name = command.words[0]
+        if command_name == "function":
+            self.label_comparison_sites = {}
+        elif command_name == "label":
+            self.label_comparison_sites[command.words[1]] = len(self.comparison_sites)
+        elif command_name in ["goto", "if-goto"]:
+            first_site = self.label_comparison_sites.get(command.words[1])
+            if first_site is not None:
+                for site in self.comparison_sites[first_site:]:
+                    site.in_loop = True
+        elif command_name in shared_comparison_commands and not self.shares_comparison(
+            command, file_stem
+        ):
+            self.comparison_sites.append(
+                ComparisonSite(file_stem, command.index, command_name)
+            )
+
+    def shares_comparison(self, command, file_stem):
+        return (
+            self.share_all_comparisons
+            or (file_stem, command.index) in self.shared_comparison_sites
+        )
+
+    # Everything besides the vm commands of a file that its assembly code
+    # depends on: the options, and the shared comparison sites in the file
+    # and the leaf functions it defines or calls
+    def translation_options(self, commands, file_stem):
+        function_names = {
+            command.words[1]
+            for command in commands
+            if command.words[0] in ["function", "call"]
+        }
+        leaf_functions = sorted(
+            (function_name, asdict(leaf_function))
+            for function_name, leaf_function in self.leaf_functions.items()
+            if function_name in function_names
+        )
+        shared_comparison_sites = sorted(
+            index
+            for site_file_stem, index in self.shared_comparison_sites
+            if site_file_stem == file_stem
+        )
+        return repr(
+            (
+                self.optimization_level,
+                self.share_all_comparisons,
+                shared_comparison_sites,
+                leaf_functions,
+            )
+        )
+
+    # Words of assembly the commands take without optimization
+    def count_unoptimized_words(self, commands, file_stem):
+        state = (
+            self.label_counter,
+            self.current_function,
+            self.call_counter,
+            self.leaf_return_written,
+        )
+        runtime_routines_used = set(self.runtime_routines_used)
+        assembly_code = "".join(
+            self.translate_command(command, file_stem) for command in commands
+        )
+        (
+            self.label_counter,
+            self.current_function,
+            self.call_counter,
+            self.leaf_return_written,
+        ) = state
+        self.runtime_routines_used = runtime_routines_used
+        return count_assembly_words(assembly_code)
+
+    # Translate one vm command, without optimization
+    def translate_command(self, command, file_stem):
         # Goal: generate hack assembly code corresponding to each line of vack
         # virtual machine (vm) code. Must support the following instructions:
         #  push segment index
@@ -653,59 +1900,541 @@ M=D
         #    UART[0] TX
         #    UART[1] RX
         #    UART[2] UARTSTAT (maybe omit??)
-        for line in lines_to_parse:
-            # figure out type of command
-            command_words = line.split()
-            command_name = command_words[0].lower()
-            if command_name in pushpop_commands:
-                segment = command_words[1].lower()
-                index = command_words[2]
-                assembly_code += write_pushpop(
-                    command_name, segment, index, current_file_stem
+        command_words = command.words
+        command_name = command_words[0]
+        if command_name in pushpop_commands:
+            segment = command_words[1]
+            index = command_words[2]
+            return write_pushpop(command_name, segment, index, file_stem)
+        elif command_name in arithmetic_commands:
+            self.label_counter += 1
+            if command_name in shared_comparison_commands and self.shares_comparison(
+                command, file_stem
+            ):
+                self.runtime_routines_used.add(
+                    get_shared_comparison_label(command_name)
                 )
-            elif command_name in arithmetic_commands:
-                assembly_code += write_arithmetic(
-                    command_name, current_file_stem, label_counter
+                return write_shared_comparison_call(
+                    command_name, file_stem, self.label_counter - 1
                 )
-                label_counter += 1
-            elif command_name == "function":
-                function_name = command_words[1]
-                current_function = function_name
-                call_counter = 0
-                function_number_of_local_variables = command_words[2]
-                assembly_code += write_function(
-                    function_name, function_number_of_local_variables
+            return write_arithmetic(command_name, file_stem, self.label_counter - 1)
+        elif command_name == "function":
+            function_name = command_words[1]
+            self.current_function = function_name
+            self.call_counter = 0
+            self.leaf_return_written = False
+            function_number_of_local_variables = command_words[2]
+            uninitialized_locals = (
+                command.uninitialized_locals
+                if self.writes_local_variables_compactly
+                else None
+            )
+            if function_name in self.leaf_functions:
+                return write_leaf_function(
+                    function_name,
+                    function_number_of_local_variables,
+                    self.leaf_functions[function_name],
+                    uninitialized_locals,
                 )
-            elif command_name == "call":
-                function_to_call = command_words[1]
-                function_number_of_arguments = command_words[2]
-                assembly_code += write_call(
-                    function_to_call,
-                    function_number_of_arguments,
-                    current_function,
-                    call_counter,
+            return write_function(
+                function_name, function_number_of_local_variables, uninitialized_locals
+            )
+        elif command_name == "call":
+            function_to_call = command_words[1]
+            function_number_of_arguments = command_words[2]
+            self.call_counter += 1
+            if function_to_call in self.leaf_functions:
+                return write_leaf_call(
+                    function_to_call, self.current_function, self.call_counter - 1
                 )
-                call_counter += 1
-            elif command_name == "return":
-                assembly_code += write_return()
-            elif command_name == "label":
-                label_name = command_words[1]
-                assembly_code += write_label(label_name, current_function)
-            elif command_name == "goto":
-                label_name = command_words[1]
-                assembly_code += write_goto(label_name, current_function)
-            elif command_name == "if-goto":
-                label_name = command_words[1]
-                assembly_code += write_if_goto(label_name, current_function)
-            else:
-                print(f"Error: unknown command {command_name}")
-                exit(1)
-    assembly_code += write_common_return_code()
-    assembly_code += write_common_call_code()
+            return write_call(
+                function_to_call,
+                function_number_of_arguments,
+                self.current_function,
+                self.call_counter - 1,
+            )
+        elif command_name == "return":
+            leaf_function = self.leaf_functions.get(self.current_function)
+            if leaf_function is None:
+                return write_return()
+            if self.leaf_return_written:
+                return (
+                    "// return (leaf)\n"
+                    f"@{get_leaf_return_label(self.current_function)}\n0;JMP\n"
+                )
+            self.leaf_return_written = True
+            return write_leaf_return(self.current_function, leaf_function)
+        elif command_name == "label":
+            label_name = command_words[1]
+            return write_label(label_name, self.current_function)
+        elif command_name == "goto":
+            label_name = command_words[1]
+            return write_goto(label_name, self.current_function)
+        elif command_name == "if-goto":
+            label_name = command_words[1]
+            return write_if_goto(label_name, self.current_function)
+        else:
+            print(f"Error: unknown command {command_name}")
+            exit(1)
+
+
+# Comment passing a vm command's source location on to the assembler
+def write_source_comment(command):
+    if not command.source:
+        return ""
+    return f"// source {command.source} | {command.text}\n"
+
+
+# Translate the vm commands of one file to hack assembly, returning the
+# assembly code
+def translate_vm_commands(commands, file_stem):
+    return "".join(VMTranslator().translate(commands, file_stem))
+
+
+# Runtime routines that are only written if the translated code uses them
+optional_runtime_routines = {
+    get_shared_comparison_label(command): partial(write_shared_comparison, command)
+    for command in shared_comparison_commands
+}
+optional_runtime_routines[TAIL_CALL_LABEL] = write_common_tail_call_code
+
 
-    if args.write_prolog_and_epilog:
+# Code shared by all functions (VM_RETURN, VM_CALL and the optional
+# routines in routines_used), followed by the epilog if testing without
+# Sys.init
+def write_runtime(write_prolog_and_epilog, routines_used=()):
+    assembly_code = write_common_return_code()
+    assembly_code += write_common_call_code()
+    for label, write_routine in optional_runtime_routines.items():
+        if label in routines_used:
+            assembly_code += write_routine()
+    if write_prolog_and_epilog:
         assembly_code += write_epilog()
-    print(assembly_code)
+    return assembly_code
+
+
+# Number of hack instructions (words) in a string of assembly code
+def count_assembly_words(assembly_code):
+    words = 0
+    for line in assembly_code.splitlines():
+        line = line.split("//", 1)[0].strip()
+        if line and not line.startswith("("):
+            words += 1
+    return words
+
+
+# Translate a whole program, yielding its assembly code in chunks: the
+# prolog, each vm command of each file in turn, then the runtime code.
+# vm_files is an iterable of (file stem, vm commands) pairs; vm_translator,
+# if given, sets the optimizations.
+def translate_program(
+    vm_files,
+    write_prolog_and_epilog,
+    vm_translator=None,
+    translation_cache=None,
+    jobs=1,
+):
+    yield write_prolog() if write_prolog_and_epilog else write_os_prolog()
+    if vm_translator is None:
+        vm_translator = VMTranslator()
+    for _, assembly_chunks in translate_files(
+        vm_files, vm_translator, translation_cache, jobs
+    ):
+        yield from assembly_chunks
+    yield write_runtime(
+        write_prolog_and_epilog, vm_translator.runtime_routines_used
+    )
+
+
+# Translate each of vm_files with vm_translator, yielding its file stem and
+# its assembly code (in chunks), in the order of vm_files. Files found in
+# translation_cache (if given) reuse their cached assembly code.
+#
+# With jobs above 1, up to jobs files are translated at once, each in a
+# worker process with its own copy of vm_translator. Each file's labels
+# depend only on its own vm code, so the assembly code is the same as
+# translating the files one after another; the runtime routines and report
+# of each copy are added to vm_translator's in order.
+def translate_files(vm_files, vm_translator, translation_cache=None, jobs=1):
+    if jobs <= 1:
+        for file_stem, commands in vm_files:
+            if translation_cache is None:
+                assembly_chunks = vm_translator.translate(commands, file_stem)
+            else:
+                assembly_chunks = translation_cache.translate(
+                    vm_translator, commands, file_stem
+                )
+            yield file_stem, assembly_chunks
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    vm_files = [(file_stem, list(commands)) for file_stem, commands in vm_files]
+    worker_translator = copy.copy(vm_translator)
+    worker_translator.report = OptimizationReport()
+    worker_translator.runtime_routines_used = set()
+    worker_translator.comparison_sites = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            translate_file_in_worker,
+            repeat(worker_translator),
+            (commands for _, commands in vm_files),
+            (file_stem for file_stem, _ in vm_files),
+            repeat(translation_cache),
+        )
+        for (file_stem, _), (assembly_code, file_translator, file_cache) in zip(
+            vm_files, results
+        ):
+            vm_translator.report.add(file_translator.report)
+            vm_translator.runtime_routines_used |= file_translator.runtime_routines_used
+            vm_translator.comparison_sites += file_translator.comparison_sites
+            if translation_cache is not None:
+                translation_cache.modules_from_cache += file_cache.modules_from_cache
+                translation_cache.modules_translated += file_cache.modules_translated
+            yield file_stem, [assembly_code]
+
+
+# Translate the vm commands of one file in a worker process (see
+# translate_files), returning its assembly code, and the VMTranslator and
+# TranslationCache with the file's report, runtime routines and counts
+def translate_file_in_worker(vm_translator, commands, file_stem, translation_cache):
+    if translation_cache is None:
+        assembly_chunks = vm_translator.translate(commands, file_stem)
+    else:
+        assembly_chunks = translation_cache.translate(
+            vm_translator, commands, file_stem
+        )
+    return "".join(assembly_chunks), vm_translator, translation_cache
+
+
+# Cache of the assembly code of translated vm files
+#
+# Each file's assembly code is saved in directory, with the runtime
+# routines it uses and its optimization report, keyed by the hash of its vm
+# commands, the translator's source code and the options its translation
+# depends on (see VMTranslator.translation_options). A file translated
+# again with the same key reuses the saved assembly code; the runtime that
+# follows the files is always written fresh.
+class TranslationCache:
+    directory: Path
+    modules_from_cache: int
+    modules_translated: int
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.modules_from_cache = 0
+        self.modules_translated = 0
+
+    def module_hash(self, vm_translator, commands, file_stem):
+        hasher = hashlib.sha256()
+        hasher.update(Path(__file__).read_bytes())
+        options = vm_translator.translation_options(commands, file_stem)
+        hasher.update(f"{file_stem} {options}\n".encode())
+        for command in commands:
+            hasher.update(
+                f"{command.index} {command.text} // {command.source} "
+                f"{command.uninitialized_locals}\n".encode()
+            )
+        return hasher.hexdigest()
+
+    # Translate the vm commands of one file with vm_translator, yielding the
+    # cached assembly code if there is any
+    def translate(self, vm_translator, commands, file_stem):
+        commands = list(commands)
+        module_hash = self.module_hash(vm_translator, commands, file_stem)
+        cache_path = self.directory / f"{file_stem}.{module_hash}.json"
+        if cache_path.exists():
+            cached_module = json.loads(cache_path.read_text())
+            vm_translator.runtime_routines_used.update(
+                cached_module["runtime_routines_used"]
+            )
+            vm_translator.report.add(OptimizationReport(**cached_module["report"]))
+            self.modules_from_cache += 1
+            yield cached_module["assembly_code"]
+            return
+
+        # Translate with a report and set of runtime routines of this
+        # module's own, to save with its assembly code
+        report = vm_translator.report
+        runtime_routines_used = vm_translator.runtime_routines_used
+        vm_translator.report = OptimizationReport()
+        vm_translator.runtime_routines_used = set()
+        assembly_code = "".join(vm_translator.translate(commands, file_stem))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(
+            json.dumps(
+                {
+                    "assembly_code": assembly_code,
+                    "runtime_routines_used": sorted(
+                        vm_translator.runtime_routines_used
+                    ),
+                    "report": asdict(vm_translator.report),
+                }
+            )
+        )
+        report.add(vm_translator.report)
+        runtime_routines_used |= vm_translator.runtime_routines_used
+        vm_translator.report = report
+        vm_translator.runtime_routines_used = runtime_routines_used
+        self.modules_translated += 1
+        yield assembly_code
+
+    def summary(self):
+        return (
+            f"Translation cache: {self.modules_from_cache} modules from cache, "
+            f"{self.modules_translated} translated"
+        )
+
+
+# Translate a whole program with vm_translator, which should translate
+# every comparison inline, returning the program's size in words and the
+# sites of its comparisons
+def find_comparison_sites(vm_files, write_prolog_and_epilog, vm_translator):
+    program_words = count_assembly_words(
+        "".join(translate_program(vm_files, write_prolog_and_epilog, vm_translator))
+    )
+    return program_words, vm_translator.comparison_sites
+
+
+# Split chunks of assembly code into lines, e.g. to pass the output of
+# translate_program straight to the assembler
+def assembly_lines(assembly_chunks):
+    for assembly_chunk in assembly_chunks:
+        yield from assembly_chunk.splitlines()
+
+
+# Names of the modules holding the prolog and the shared runtime code when
+# each vm file is translated to its own .asm module
+PROLOG_MODULE_NAME = "VM_PROLOG"
+RUNTIME_MODULE_NAME = "VM_RUNTIME"
+
+
+# Prepare the vm files of a whole program for translation: remove the
+# functions that are never called (if remove_unreachable), find the leaf
+# functions (from LEAF_FUNCTION_LEVEL) and choose the comparisons to share
+# (to fit rom_budget, if given), reporting on stderr. Returns the vm files
+# to translate and the VMTranslator to translate them with, which adds its
+# savings to report.
+def prepare_program(
+    vm_files,
+    report,
+    optimization_level=0,
+    write_prolog_and_epilog=False,
+    remove_unreachable=False,
+    optimize_size=False,
+    rom_budget=None,
+):
+    if remove_unreachable:
+        from call_graph import remove_unreachable_functions
+
+        commands_by_file, dead_function_report = remove_unreachable_functions(
+            {file_stem: list(commands) for file_stem, commands in vm_files},
+            lambda function_commands, file_stem: count_assembly_words(
+                translate_vm_commands(function_commands, file_stem)
+            ),
+        )
+        print(dead_function_report.summary(), file=sys.stderr)
+        vm_files = commands_by_file.items()
+
+    leaf_functions = {}
+    if optimization_level >= LEAF_FUNCTION_LEVEL:
+        from call_graph import find_leaf_functions
+
+        vm_files = [(file_stem, list(commands)) for file_stem, commands in vm_files]
+        leaf_functions = find_leaf_functions(dict(vm_files))
+        print(
+            f"Leaf functions: {len(leaf_functions)} use the leaf calling convention",
+            file=sys.stderr,
+        )
+
+    def new_vm_translator(report, shared_comparison_sites=()):
+        return VMTranslator(
+            optimization_level=optimization_level,
+            report=report,
+            share_all_comparisons=optimize_size,
+            shared_comparison_sites=shared_comparison_sites,
+            leaf_functions=leaf_functions,
+        )
+
+    # Find the comparisons to share to fit the program in the budget
+    shared_comparison_sites = set()
+    if rom_budget is not None and not optimize_size:
+        vm_files = [(file_stem, list(commands)) for file_stem, commands in vm_files]
+        program_words, comparison_sites = find_comparison_sites(
+            vm_files,
+            write_prolog_and_epilog,
+            new_vm_translator(OptimizationReport()),
+        )
+        shared_comparison_sites, program_words = choose_shared_comparison_sites(
+            comparison_sites, program_words, rom_budget
+        )
+        print(
+            f"Shared comparisons: {len(shared_comparison_sites)} of "
+            f"{len(comparison_sites)} shared, {program_words} words "
+            f"(budget {rom_budget})",
+            file=sys.stderr,
+        )
+        if program_words > rom_budget:
+            print(
+                f"Warning: program does not fit in {rom_budget} words "
+                f"even with every comparison shared",
+                file=sys.stderr,
+            )
+
+    return vm_files, new_vm_translator(report, shared_comparison_sites)
+
+
+# Translate vm_files with vm_translator into one module per file, yielding
+# each module's name and assembly code in the order to link them: the
+# prolog, the vm files and the runtime they use
+def translate_modules(
+    vm_files,
+    write_prolog_and_epilog,
+    vm_translator,
+    translation_cache=None,
+    jobs=1,
+):
+    yield PROLOG_MODULE_NAME, (
+        write_prolog() if write_prolog_and_epilog else write_os_prolog()
+    )
+    for file_stem, assembly_chunks in translate_files(
+        vm_files, vm_translator, translation_cache, jobs
+    ):
+        yield file_stem, "".join(assembly_chunks)
+    yield RUNTIME_MODULE_NAME, write_runtime(
+        write_prolog_and_epilog, vm_translator.runtime_routines_used
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "input_files", type=str, nargs="+", help="Input files containing vack vm code"
+    )
+    parser.add_argument(
+        "--write_prolog_and_epilog",
+        action="store_true",
+        help="Write prolog and epilog for testing (i.e. if no sys.Init)",
+    )
+    parser.add_argument(
+        "--output_directory",
+        type=str,
+        help=f"Write one .asm module per vm file to this directory, plus "
+        f"{PROLOG_MODULE_NAME}.asm and {RUNTIME_MODULE_NAME}.asm, for linking "
+        f"with assembler/linker.py (link them in the order prolog, vm files, runtime)",
+    )
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        help="Write the assembly code to this file instead of printing it",
+    )
+    parser.add_argument(
+        "--cache_directory",
+        type=str,
+        help="Reuse the assembly code of vm files translated before with the "
+        "same options from (and save new ones to) this directory",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Translate up to N vm files at once in worker processes "
+        "(the output is the same as with 1, the default)",
+    )
+    parser.add_argument(
+        "--optimize",
+        type=int,
+        default=0,
+        metavar="LEVEL",
+        help="Optimization level (default 0, none): 1 fuses push/pop sequences "
+        "into moves through D, writes each push and pop with the cheapest "
+        "addressing for its segment and index, and only zeroes the locals a "
+        "function may read before assigning; 2 also folds constant arithmetic, uses "
+        "constant operands as immediates and branches on comparisons "
+        "without pushing their results, makes tail calls reuse the caller's "
+        "frame and calls leaf functions without VM_CALL; 3 also keeps the top "
+        "of the stack in D between commands. Savings are reported on stderr",
+    )
+    parser.add_argument(
+        "--remove_unreachable_functions",
+        action="store_true",
+        help="Remove functions not reachable by calls from Sys.init (report on stderr)",
+    )
+    parser.add_argument(
+        "--optimize_size",
+        action="store_true",
+        help="Optimize for size: translate every eq, gt and lt as a call to a "
+        "shared routine instead of inline",
+    )
+    parser.add_argument(
+        "--rom_budget",
+        type=int,
+        metavar="WORDS",
+        help="If the program is larger than this many words, translate "
+        "comparisons as calls to shared routines (outside loops first) "
+        "until it fits (report on stderr)",
+    )
+    args = parser.parse_args()
+
+    report = OptimizationReport()
+
+    # Read each file only as it is translated, unless the whole program
+    # is needed first to find unreachable functions
+    vm_files = (
+        (Path(input_file).stem, iterate_vm_commands(input_file))
+        for input_file in args.input_files
+    )
+    vm_files, vm_translator = prepare_program(
+        vm_files,
+        report,
+        optimization_level=args.optimize,
+        write_prolog_and_epilog=args.write_prolog_and_epilog,
+        remove_unreachable=args.remove_unreachable_functions,
+        optimize_size=args.optimize_size,
+        rom_budget=args.rom_budget,
+    )
+
+    translation_cache = (
+        TranslationCache(args.cache_directory) if args.cache_directory else None
+    )
+
+    if args.output_directory:
+        # Each module's labels depend only on its own vm code, so a module
+        # is unchanged (and its object code can be reused) unless its vm
+        # file changed
+        output_directory = Path(args.output_directory)
+        output_directory.mkdir(parents=True, exist_ok=True)
+        for module_name, assembly_code in translate_modules(
+            vm_files,
+            args.write_prolog_and_epilog,
+            vm_translator,
+            translation_cache,
+            args.jobs,
+        ):
+            (output_directory / f"{module_name}.asm").write_text(assembly_code)
+    else:
+        # Write the assembly code as it is translated, ending with a newline
+        # as print() would
+        assembly_chunks = translate_program(
+            vm_files,
+            args.write_prolog_and_epilog,
+            vm_translator,
+            translation_cache,
+            args.jobs,
+        )
+        if args.output_file:
+            with open(args.output_file, "w") as output_file:
+                output_file.writelines(assembly_chunks)
+                output_file.write("\n")
+        else:
+            sys.stdout.writelines(assembly_chunks)
+            sys.stdout.write("\n")
+
+    if translation_cache is not None:
+        print(translation_cache.summary(), file=sys.stderr)
+    if args.optimize:
+        print(report.summary(), file=sys.stderr)
 
 
 if __name__ == "__main__":